@@ -6,25 +6,38 @@
 import os
 from jsonrpc import dispatcher
 from btctxstore import BtcTxStore
+from jsonschema.exceptions import ValidationError
 from micropayment_core import util
 from picopayments_hub import etc
+from picopayments_hub import err
+from picopayments_hub import sql
+from picopayments_hub import metrics
+from picopayments_hub import trace
+from picopayments_hub import profiler
 from picopayments_hub import verify
 from picopayments_hub import lib
-from picopayments_cli import auth
+from picopayments_hub import wallet
+from picopayments_hub import requestcache
 from picopayments_cli.rpc import jsonrpc_call
 
 
 @dispatcher.add_method
-def mph_status(assets=None):
-    with etc.database_lock:
-        verify.status_input(assets)
+def mph_status(assets=None, after=None, limit=None):
+    # read only, use a snapshot instead of waiting for the database lock
+    with sql.read_cursor() as cursor:
+        with trace.span("verify"):
+            verify.status_input(assets, after, limit)
         btctxstore = BtcTxStore(testnet=etc.testnet)
-        wif = lib.load_wif()
-        address = btctxstore.get_address(wif)
+        address = wallet.address()
         message = util.b2h(os.urandom(32))
-        signature = btctxstore.sign_unicode(wif, message)
+        signature = btctxstore.sign_unicode(wallet.wif(), message)
         if isinstance(signature, bytes):  # XXX update btctxstore instead !!!
             signature = signature.decode("utf-8")
+        connections = lib.get_connections_status(assets=assets, after=after,
+                                                 limit=limit, cursor=cursor)
+        connections_next = None  # handle to continue from if page is full
+        if limit is not None and connections and len(connections) == limit:
+            connections_next = max(connections.keys())
         return {
             "funds": {
                 "address": address,
@@ -33,91 +46,275 @@ def mph_status(assets=None):
                 "liquidity": lib.get_hub_liquidity(assets=assets),
             },
             "current_terms": lib.get_terms(assets=assets),
-            "connections": lib.get_connections_status(assets=assets)
+            "connections": connections,
+            "connections_next": connections_next
         }
 
 
 @dispatcher.add_method
 def mph_request(**kwargs):
     with etc.database_lock:
-        auth.verify_json(kwargs)
-        verify.request_input(
-            kwargs["asset"],
-            kwargs["pubkey"],
-            kwargs["spend_secret_hash"],
-            kwargs.get("hub_rpc_url")
-        )
-        result, authwif = lib.create_hub_connection(
-            kwargs["asset"],
-            kwargs["pubkey"],
-            kwargs["spend_secret_hash"],
-            kwargs.get("hub_rpc_url")
-        )
-        return auth.sign_json(result, authwif)
+        with trace.span("verify"):
+            verify.signature(kwargs)
+            verify.request_input(
+                kwargs["asset"],
+                kwargs["pubkey"],
+                kwargs["spend_secret_hash"],
+                kwargs.get("hub_rpc_url")
+            )
+        with sql.group_commit() as ack:
+            result, authwif = lib.create_hub_connection(
+                kwargs["asset"],
+                kwargs["pubkey"],
+                kwargs["spend_secret_hash"],
+                kwargs.get("hub_rpc_url")
+            )
+    with trace.span("commit_wait"):
+        ack.wait()  # respond only once writes are durable
+    with trace.span("sign"):
+        return wallet.sign_json(result, authwif)
 
 
-@dispatcher.add_method
-def mph_deposit(**kwargs):
+def _idempotent(method, kwargs, verify_input, process):
+    """Process a state changing request once, retries made within
+    etc.request_cache_window get the original signed response."""
+    key = requestcache.key(kwargs)
     with etc.database_lock:
-        auth.verify_json(kwargs)
+        with trace.span("request_cache"):
+            response = requestcache.get(key)
+        if response is None:
+            verify_input(kwargs)
+        with sql.group_commit() as ack:
+            if response is None:
+                result, authwif = process(kwargs)
+                with trace.span("sign"):
+                    response = wallet.sign_json(result, authwif)
+                requestcache.put(method, key, response)
+    with trace.span("commit_wait"):
+        ack.wait()  # respond only once writes are durable, retries too
+    return response
+
+
+def _verify_deposit(kwargs):
+    with trace.span("verify"):
+        verify.signature(kwargs)
         verify.deposit_input(
             kwargs["handle"],
             kwargs["deposit_script"],
             kwargs["next_revoke_secret_hash"],
             kwargs["pubkey"]
         )
-        result, authwif = lib.complete_connection(
-            kwargs["handle"],
-            kwargs["deposit_script"],
-            kwargs["next_revoke_secret_hash"]
-        )
-        return auth.sign_json(result, authwif)
+
+
+def _deposit(kwargs):
+    return lib.complete_connection(
+        kwargs["handle"],
+        kwargs["deposit_script"],
+        kwargs["next_revoke_secret_hash"]
+    )
 
 
 @dispatcher.add_method
-def mph_sync(**kwargs):
-    with etc.database_lock:
-        auth.verify_json(kwargs)
+def mph_deposit(**kwargs):
+    return _idempotent("mph_deposit", kwargs, _verify_deposit, _deposit)
+
+
+def _verify_sync(kwargs):
+    with trace.span("verify"):
+        verify.signature(kwargs)
         verify.sync_input(
             kwargs["handle"],
             kwargs["next_revoke_secret_hash"],
             kwargs["pubkey"],
             kwargs.get("sends"),
             kwargs.get("commit"),
-            kwargs.get("revokes")
+            kwargs.get("revokes"),
+            kwargs.get("rebalance")
         )
-        result, authwif = lib.sync_hub_connection(
-            kwargs["handle"],
-            kwargs["next_revoke_secret_hash"],
-            kwargs.get("sends"),
-            kwargs.get("commit"),
-            kwargs.get("revokes")
-        )
-        return auth.sign_json(result, authwif)
+
+
+def _sync(kwargs):
+    return lib.sync_hub_connection(
+        kwargs["handle"],
+        kwargs["next_revoke_secret_hash"],
+        kwargs.get("sends"),
+        kwargs.get("commit"),
+        kwargs.get("revokes"),
+        rebalance=kwargs.get("rebalance", False)
+    )
+
+
+# errors of invalid mph_sync requests, anything else aborts a sync batch
+_SYNC_ERRORS = tuple(
+    cls for cls in vars(err).values()
+    if isinstance(cls, type) and issubclass(cls, Exception)
+) + (ValidationError,)
+
+
+def _unsigned(response):
+    return {k: v for k, v in response.items()
+            if k not in ("pubkey", "signature")}
+
+
+def _error(e):
+    return {"type": e.__class__.__name__, "message": str(e)}
+
+
+@dispatcher.add_method
+def mph_sync(**kwargs):
+    return _idempotent("mph_sync", kwargs, _verify_sync, _sync)
+
+
+@dispatcher.add_method
+def mph_sync_batch(syncs):
+    """Sync many handles with one lock, transaction and commit wait.
+
+    Every entry is an mph_sync request signed by its client, invalid
+    entries are rolled back on their own and reported per handle. Other
+    errors abort the whole batch. Entries share the request cache with
+    mph_sync, so retried entries are not processed again.
+    """
+    with etc.database_lock:
+        with trace.span("verify"):
+            verify.sync_batch_input(syncs)
+            known = lib.existing_handles([s.get("handle") for s in syncs])
+        results = []
+        seen = set()
+        with sql.group_commit() as ack:
+            for sync in syncs:
+                handle = sync.get("handle")
+                try:
+                    if handle not in known:
+                        raise err.HandleNotFound(handle)
+                    if handle in seen:
+                        raise err.DuplicateHandle(handle)
+                    seen.add(handle)
+                    key = requestcache.key(sync)
+                    with sql.transaction():
+                        response = requestcache.get(key)
+                        if response is None:
+                            _verify_sync(sync)
+                            result, authwif = _sync(sync)
+                            response = wallet.sign_json(result, authwif)
+                            requestcache.put("mph_sync", key, response)
+                    results.append({"handle": handle,
+                                    "result": _unsigned(response)})
+                except _SYNC_ERRORS as e:
+                    results.append({"handle": handle, "error": _error(e)})
+    with trace.span("commit_wait"):
+        ack.wait()  # respond only once writes are durable
+    with trace.span("sign"):
+        return wallet.sign_json({"results": results})
+
+
+@dispatcher.add_method
+def mph_wait(**kwargs):
+    """Long poll until payments or a commit wait for the client."""
+    with etc.database_lock:
+        with trace.span("verify"):
+            verify.signature(kwargs)
+            verify.wait_input(
+                kwargs["handle"],
+                kwargs["pubkey"],
+                kwargs.get("timeout")
+            )
+    timeout = kwargs.get("timeout")
+    if timeout is None:
+        timeout = etc.wait_timeout
+    timeout = min(timeout, etc.wait_timeout)
+    with trace.span("wait"):
+        result = lib.wait_for_notifications(kwargs["handle"], timeout)
+    with trace.span("sign"):
+        return wallet.sign_json(result)
 
 
 @dispatcher.add_method
 def mph_close(**kwargs):
     with etc.database_lock:
-        auth.verify_json(kwargs)
-        verify.close_input(
-            kwargs["handle"],
-            kwargs["pubkey"],
-            kwargs.get("spend_secret"),
-        )
-        result, authwif = lib.close_connection(
-            kwargs["handle"],
-            kwargs.get("spend_secret"),
-        )
-        return auth.sign_json(result, authwif)
+        with trace.span("verify"):
+            verify.signature(kwargs)
+            verify.close_input(
+                kwargs["handle"],
+                kwargs["pubkey"],
+                kwargs.get("spend_secret"),
+            )
+        with sql.group_commit() as ack:
+            result, authwif = lib.close_connection(
+                kwargs["handle"],
+                kwargs.get("spend_secret"),
+            )
+    with trace.span("commit_wait"):
+        ack.wait()  # respond only once writes are durable
+    with trace.span("sign"):
+        return wallet.sign_json(result, authwif)
 
 
-def _cplib_call(method, params={}):
-    return jsonrpc_call(
-        etc.counterparty_url, method, params=params,
-        username=etc.counterparty_username,
-        password=etc.counterparty_password
+@dispatcher.add_method
+def mph_traces(**kwargs):
+    """Recently sampled request traces, admin only."""
+    verify.signature(kwargs)
+    verify.traces_input(kwargs["pubkey"], kwargs.get("limit"),
+                        kwargs.get("method"))
+    result = {"traces": trace.recent(limit=kwargs.get("limit"),
+                                     method=kwargs.get("method"))}
+    return wallet.sign_json(result)
+
+
+@dispatcher.add_method
+def mph_profile_start(**kwargs):
+    """Profile the next requests or a time window, admin only."""
+    verify.signature(kwargs)
+    verify.profile_start_input(
+        kwargs["pubkey"],
+        kwargs.get("mode", "cprofile"),
+        kwargs.get("requests"),
+        kwargs.get("seconds"),
+        kwargs.get("methods")
     )
+    profiler.start(
+        mode=kwargs.get("mode", "cprofile"),
+        requests=kwargs.get("requests"),
+        seconds=kwargs.get("seconds"),
+        methods=kwargs.get("methods")
+    )
+    return wallet.sign_json(profiler.results())
+
+
+@dispatcher.add_method
+def mph_profile_results(**kwargs):
+    """Aggregated profiles of the current or last session, admin only."""
+    verify.signature(kwargs)
+    verify.profile_results_input(
+        kwargs["pubkey"],
+        kwargs.get("stop", False),
+        kwargs.get("save", False)
+    )
+    if kwargs.get("stop", False):
+        profiler.stop()
+    result = profiler.results() or {}
+    if kwargs.get("save", False):
+        result["files"] = profiler.save()
+    return wallet.sign_json(result)
+
+
+@dispatcher.add_method
+def mph_reload_wallet(**kwargs):
+    """Reload hub key from the wallet file, admin only."""
+    verify.signature(kwargs)
+    verify.admin_input(kwargs["pubkey"])
+    with etc.database_lock:
+        key = wallet.load()
+    return wallet.sign_json({"address": key["address"]})
+
+
+def _cplib_call(method, params={}):
+    with trace.span("counterparty", method=method):
+        with metrics.counterparty_call(method):
+            return jsonrpc_call(
+                etc.counterparty_url, method, params=params,
+                username=etc.counterparty_username,
+                password=etc.counterparty_password
+            )
 
 
 def _make_cplib_call(method):
@@ -0,0 +1,223 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import time
+import threading
+from micropayment_core import util
+from picopayments_hub import etc
+from picopayments_hub import sql
+from picopayments_hub import trace
+from picopayments_hub import metrics
+from picopayments_hub import eventbus
+
+
+KEY = "broadcast"  # eventbus key, changes when transactions are queued
+NOT_FOUND = "No such mempool or blockchain transaction"  # backend error
+
+_ADD_BROADCAST = sql.load("add_broadcast")
+_broadcasts_due = sql.make_fetchall("broadcasts_due")
+_set_broadcast_attempt = sql.make_execute("set_broadcast_attempt")
+_set_broadcast_status = sql.make_execute("set_broadcast_status")
+_broadcast_pending = sql.make_fetchone("broadcast_pending")
+_broadcast_unconfirmed = sql.make_fetchone("broadcast_unconfirmed")
+_broadcast_queue_depth = sql.make_fetchall("broadcast_queue_depth")
+_broadcasts_unconfirmed = sql.make_fetchall("broadcasts_unconfirmed")
+
+
+def enqueue(rawtx, kind, handle=None, cursor=None):
+    """Queue signed rawtx for publishing and return its txid.
+
+    Part of the open transaction, workers see it once committed. A
+    transaction already queued is not added again.
+    """
+    txid = util.gettxid(rawtx)
+    sql.execute(_ADD_BROADCAST, {
+        "txid": txid, "rawtx": rawtx, "kind": kind, "handle": handle
+    }, cursor=cursor)
+    eventbus.publish(KEY)
+    return txid
+
+
+def is_pending(handle, kind, cursor=None):
+    """True if a transaction of kind for handle was not yet published."""
+    return _broadcast_pending(handle=handle, kind=kind,
+                              cursor=cursor)["pending"] == 1
+
+
+def spent_outputs(kind, cursor=None):
+    """Outputs as "txid:vout" spent by queued transactions of kind that
+    are not yet confirmed, the backend still lists them as unspent."""
+    spent = set()
+    for entry in _broadcasts_unconfirmed(kind=kind, cursor=cursor):
+        util.Tx.ALLOW_SEGWIT = False
+        for txin in util.Tx.from_hex(entry["rawtx"]).txs_in:
+            spent.add("{0}:{1}".format(util.b2h_rev(txin.previous_hash),
+                                       txin.previous_index))
+    return spent
+
+
+def is_unconfirmed(handle, cursor=None):
+    """True if a transaction for handle was queued but not confirmed."""
+    return _broadcast_unconfirmed(handle=handle,
+                                  cursor=cursor)["unconfirmed"] == 1
+
+
+class QueueApi(object):
+    """Api for Mpc that queues transactions instead of publishing them."""
+
+    def __init__(self, api, kind, handle=None, cursor=None):
+        self._api = api
+        self._kind = kind
+        self._handle = handle
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    def sendrawtransaction(self, tx_hex):
+        return enqueue(tx_hex, self._kind, handle=self._handle,
+                       cursor=self._cursor)
+
+
+def _claim(limit):
+    """Due committed entries, leased so other workers skip them."""
+    claimed = []
+    with etc.database_lock:
+        sql.end_batch()  # commit on our own
+        now = int(time.time())
+        with sql.read_cursor() as cursor:
+            entries = _broadcasts_due(now=now, limit=limit, cursor=cursor)
+        cursor = sql.get_cursor()
+        for entry in entries:
+            _set_broadcast_attempt(id=entry["id"], now=now,
+                                   next_attempt=now + etc.broadcast_lease,
+                                   cursor=cursor)
+            if cursor.getconnection().changes():
+                claimed.append(entry)
+    return claimed
+
+
+def _confirmations(txid):
+    """Confirmations of txid, None if the backend does not know it.
+
+    Other backend errors are raised, they say nothing about the txid.
+    """
+    from picopayments_hub import api
+    try:
+        tx = api.getrawtransaction(tx_hash=txid, verbose=True)
+    except Exception as e:
+        if NOT_FOUND in str(e):
+            return None
+        raise
+    return tx.get("confirmations", 0)
+
+
+def _is_known(txid):
+    try:
+        return _confirmations(txid) is not None
+    except Exception:
+        return False  # unknown, published again later
+
+
+def _retry_delay(attempts):
+    delay = etc.broadcast_retry_delay * 2 ** min(attempts - 1, 16)
+    return min(delay, etc.broadcast_max_retry_delay)
+
+
+def _publish(entry):
+    """Publish entry, returns its updated status fields."""
+    from picopayments_hub import api
+    now = int(time.time())
+    attempts = entry["attempts"] + 1
+    update = {"status": "published", "attempts": attempts,
+              "confirmations": 0, "last_error": None,
+              "next_attempt": now + etc.broadcast_confirm_interval}
+    try:
+        with trace.span("broadcast", txid=entry["txid"]):
+            api.sendrawtransaction(tx_hex=entry["rawtx"])
+    except Exception as e:
+        if _is_known(entry["txid"]):
+            return update  # published before, i.e. lost status update
+        failed = attempts >= etc.broadcast_max_attempts
+        update.update({
+            "status": "failed" if failed else "pending",
+            "next_attempt": now + _retry_delay(attempts),
+            "last_error": repr(e),
+        })
+    return update
+
+
+def _check(entry):
+    """Track confirmations of a published entry."""
+    now = int(time.time())
+    update = {"status": "published", "attempts": entry["attempts"],
+              "confirmations": entry["confirmations"], "last_error": None,
+              "next_attempt": now + etc.broadcast_confirm_interval}
+    try:
+        confirmations = _confirmations(entry["txid"])
+    except Exception as e:
+        update["last_error"] = repr(e)
+        return update  # backend unavailable, check again later
+    if confirmations is None:  # dropped by backend, publish again
+        update.update({"status": "pending", "confirmations": 0,
+                       "next_attempt": now})
+    else:
+        update["confirmations"] = confirmations
+        if confirmations >= etc.broadcast_confirmations:
+            update["status"] = "confirmed"
+    return update
+
+
+def process(limit=None):
+    """Publish due transactions and track published ones.
+
+    Must not be called holding etc.database_lock, the lock is only taken
+    to claim entries and record results. Returns the txids published.
+    """
+    published = []
+    entries = _claim(limit or etc.broadcast_batch_size)
+    for entry in entries:
+        if entry["status"] == "pending":
+            update = _publish(entry)
+            if update["status"] == "published":
+                published.append(entry["txid"])
+        else:
+            update = _check(entry)
+        with etc.database_lock:
+            sql.end_batch()  # commit on our own
+            _set_broadcast_status(id=entry["id"], **update)
+    return published
+
+
+def depth():
+    """Number of queued transactions by status, confirmed excluded."""
+    result = {"pending": 0, "published": 0, "failed": 0}
+    if etc.database_connection is None:
+        return result  # not yet set up
+    with sql.read_cursor() as cursor:
+        for row in _broadcast_queue_depth(cursor=cursor):
+            result[row["status"]] = row["count"]
+    return result
+
+
+def worker(stop_flag):
+    """Process the queue until stop_flag is set, wakes up when queued."""
+    while not stop_flag.is_set():
+        since = eventbus.version([KEY])
+        if process():
+            continue  # more may be due
+        eventbus.wait([KEY], since, etc.broadcast_interval)
+
+
+def start_workers(stop_flag):
+    threads = []
+    for i in range(etc.broadcast_workers):
+        thread = threading.Thread(target=worker, args=(stop_flag,))
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+metrics.register_gauges("broadcast_queue", depth)
@@ -68,4 +68,61 @@ def parse(args):
         help="Counterparty password: {0}".format("1234")
     )
 
+    # monitoring
+    parser.add_argument(
+        '--metrics', action='store_true',
+        help="Serve prometheus metrics at /metrics (unauthenticated)."
+    )
+
+    # rebalancing
+    parser.add_argument(
+        '--rebalance_min_delta', type=int, default=0, metavar="SATOSHIS",
+        help="Defer hub to client commits for smaller transfers: 0"
+    )
+    parser.add_argument(
+        '--rebalance_max_staleness', type=int, default=0, metavar="SECONDS",
+        help="Max time a transfer is deferred, 0 for no limit: 0"
+    )
+
+    # tracing
+    parser.add_argument(
+        '--trace_sample_rate', type=float, default=0.0, metavar="RATE",
+        help="Fraction of requests to trace, 0.0 to 1.0: 0.0"
+    )
+    parser.add_argument(
+        '--trace_file', default=None, metavar="PATH",
+        help="Append sampled traces as json lines to this file."
+    )
+
+    # crypto
+    parser.add_argument(
+        '--crypto_backend', default="auto",
+        choices=["auto", "secp256k1", "python"],
+        help="Ecdsa backend, auto uses libsecp256k1 if installed: auto"
+    )
+
+    # json
+    parser.add_argument(
+        '--json_codec', default="auto",
+        choices=["auto", "orjson", "ujson", "json"],
+        help="Rpc json codec, auto uses orjson or ujson if installed: auto"
+    )
+
+    # run a single cron job instead of serving
+    subparsers = parser.add_subparsers(dest="command")
+    run_job = subparsers.add_parser(
+        "run_job", help="Run a cron job pass, resuming an interrupted one."
+    )
+    run_job.add_argument(
+        'job', choices=[
+            "fund_deposits", "publish_commits", "recover_funds",
+            "update_status", "collect_garbage", "all"
+        ],
+        help="Job to run, all runs every job as the hub does."
+    )
+    run_job.add_argument(
+        '--budget', type=float, default=0.0, metavar="SECONDS",
+        help="Defer remaining connections after this time, 0 no limit: 0.0"
+    )
+
     return vars(parser.parse_args(args=args))
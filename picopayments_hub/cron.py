@@ -9,106 +9,134 @@ from picopayments_hub import db
 from picopayments_hub import lib
 from picopayments_hub import sql
 from picopayments_hub import api
+from picopayments_hub import metrics
+from picopayments_hub import scriptcache
+from picopayments_hub import broadcast
+from picopayments_hub import schedule
 from micropayment_core import util
-from micropayment_core.scripts import get_deposit_spend_secret_hash
 from picopayments_cli.mpc import Mpc
 
 
 # FIXME use http interface to ensure its called in the same process!!!
 
 
-def fund_deposits():
+def _fund_deposit(hub_connection, cursor):
+    """Fund or top off hub deposit, returns the deposit if made."""
+    asset = hub_connection["asset"]
+    terms = db.terms(id=hub_connection["terms_id"], cursor=cursor)
+
+    # load client to hub data
+    c2h_mpc_id = hub_connection["c2h_channel_id"]
+    c2h_state = db.load_channel_state(c2h_mpc_id, asset, cursor=cursor)
+    c2h_deposit_address = lib.deposit_address(c2h_state)
+    c2h_deposit_balance = lib.get_balances(c2h_deposit_address,
+                                           assets=[asset])[asset]
+
+    if c2h_deposit_balance < terms["deposit_min"]:
+        return None  # ignore if client deposit insufficient
+    if lib.is_expired(c2h_state, etc.expire_clearance):
+        return None  # ignore if expires soon
+    if lib.has_unconfirmed_transactions(c2h_deposit_address):
+        return None  # ignore if unconfirmed transaction inputs/outputs
+    if api.mpc_published_commits(state=c2h_state):
+        return None  # ignore if c2h commit published
+    if broadcast.is_pending(hub_connection["handle"], "deposit",
+                            cursor=cursor):
+        return None  # ignore if hub deposit queued but not published
+
+    # load hub to client data
+    h2c_mpc_id = hub_connection["h2c_channel_id"]
+    h2c_state = db.load_channel_state(h2c_mpc_id, asset, cursor=cursor)
+    h2c_deposit_address = lib.deposit_address(h2c_state)
+    h2c_deposit_balance = lib.get_balances(h2c_deposit_address,
+                                           assets=[asset])[asset]
+
+    if lib.is_expired(h2c_state, etc.expire_clearance):
+        return None  # ignore if expires soon
+    if lib.has_unconfirmed_transactions(h2c_deposit_address):
+        return None  # ignore if unconfirmed transaction inputs/outputs
+    if api.mpc_published_commits(state=h2c_state):
+        return None  # ignore if h2c commit published
+
+    # fund hub to client if needed
+    deposit_max = terms["deposit_max"]
+    deposit_ratio = terms["deposit_ratio"]
+    if deposit_max:
+        target = min(deposit_max, c2h_deposit_balance) * deposit_ratio
+    else:
+        target = int(c2h_deposit_balance * deposit_ratio)
+    quantity = target - h2c_deposit_balance
+    if quantity > 0:
+        sent = lib.send_funds(h2c_deposit_address, asset, quantity,
+                              handle=hub_connection["handle"],
+                              cursor=cursor)
+        if sent:
+            return {
+                "txid": sent["txid"],
+                "rawtx": sent["rawtx"],
+                "asset": asset,
+                "address": h2c_deposit_address,
+                "quantity": quantity,
+                "handle": hub_connection["handle"]
+            }
+    return None
+
+
+@metrics.timed("cron_job_seconds", job="fund_deposits")
+def fund_deposits(budget=None):
     """Fund or top off open channels."""
     with etc.database_lock:
-        deposits = []
+        sql.end_batch()  # commit on our own
         cursor = sql.get_cursor()
-        for hub_connection in db.hub_connections_open(cursor=cursor):
-
-            asset = hub_connection["asset"]
-            terms = db.terms(id=hub_connection["terms_id"], cursor=cursor)
-
-            # load client to hub data
-            c2h_mpc_id = hub_connection["c2h_channel_id"]
-            c2h_state = db.load_channel_state(c2h_mpc_id, asset, cursor=cursor)
-            c2h_deposit_address = lib.deposit_address(c2h_state)
-            c2h_deposit_balance = lib.get_balances(c2h_deposit_address,
-                                                   assets=[asset])[asset]
-
-            if c2h_deposit_balance < terms["deposit_min"]:
-                continue  # ignore if client deposit insufficient
-            if lib.is_expired(c2h_state, etc.expire_clearance):
-                continue  # ignore if expires soon
-            if lib.has_unconfirmed_transactions(c2h_deposit_address):
-                continue  # ignore if unconfirmed transaction inputs/outputs
-            if api.mpc_published_commits(state=c2h_state):
-                continue  # ignore if c2h commit published
-
-            # load hub to client data
-            h2c_mpc_id = hub_connection["h2c_channel_id"]
-            h2c_state = db.load_channel_state(h2c_mpc_id, asset, cursor=cursor)
-            h2c_deposit_address = lib.deposit_address(h2c_state)
-            h2c_deposit_balance = lib.get_balances(h2c_deposit_address,
-                                                   assets=[asset])[asset]
-
-            if lib.is_expired(h2c_state, etc.expire_clearance):
-                continue  # ignore if expires soon
-            if lib.has_unconfirmed_transactions(h2c_deposit_address):
-                continue  # ignore if unconfirmed transaction inputs/outputs
-            if api.mpc_published_commits(state=h2c_state):
-                continue  # ignore if h2c commit published
-
-            # fund hub to client if needed
-            deposit_max = terms["deposit_max"]
-            deposit_ratio = terms["deposit_ratio"]
-            if deposit_max:
-                target = min(deposit_max, c2h_deposit_balance) * deposit_ratio
-            else:
-                target = int(c2h_deposit_balance * deposit_ratio)
-            quantity = target - h2c_deposit_balance
-            if quantity > 0:
-                sent = lib.send_funds(h2c_deposit_address, asset, quantity)
-                if sent:
-                    deposits.append({
-                        "txid": sent["txid"],
-                        "rawtx": sent["rawtx"],
-                        "asset": asset,
-                        "address": h2c_deposit_address,
-                        "quantity": quantity,
-                        "handle": hub_connection["handle"]
-                    })
-
-        return deposits
-
-
-def publish_commits():
+        job = schedule.Job("fund_deposits", cursor=cursor)
+        connections = db.hub_connections_open(cursor=cursor)
+        for hub_connection in schedule.scheduled(job, connections, budget):
+            with sql.transaction(cursor):
+                deposit = _fund_deposit(hub_connection, cursor)
+                job.checkpoint(hub_connection, deposit)
+        return job.outputs
+
+
+def _publish_commit(hub_connection, cursor):
+    """Close connection if needed, returns the commit rawtx queued."""
+    asset = hub_connection["asset"]
+    c2h_mpc_id = hub_connection["c2h_channel_id"]
+    c2h_state = db.load_channel_state(c2h_mpc_id, asset, cursor=cursor)
+    h2c_mpc_id = hub_connection["h2c_channel_id"]
+    h2c_state = db.load_channel_state(h2c_mpc_id, asset, cursor=cursor)
+    h2c_spend_secret_hash = scriptcache.deposit(
+        h2c_state["deposit_script"]
+    )["spend_secret_hash"]
+    h2c_spend_secret = lib.get_secret(h2c_spend_secret_hash)
+    c2h_expired = lib.is_expired(c2h_state, etc.expire_clearance)
+    h2c_expired = lib.is_expired(h2c_state, etc.expire_clearance)
+    expired = c2h_expired or h2c_expired
+    h2c_commits_published = api.mpc_published_commits(state=h2c_state)
+    closed = hub_connection["closed"] != 0
+
+    # connection expired or commit published or spend secret known
+    if expired or closed or h2c_commits_published or h2c_spend_secret:
+        if not closed:
+            db.set_connection_closed(handle=hub_connection["handle"])
+        queue = broadcast.QueueApi(api, "commit",
+                                   handle=hub_connection["handle"],
+                                   cursor=cursor)
+        return Mpc(queue).finalize_commit(lib.get_wif, c2h_state)
+    return None
+
+
+@metrics.timed("cron_job_seconds", job="publish_commits")
+def publish_commits(budget=None):
     with etc.database_lock:
-        commit_rawtxs = []
+        sql.end_batch()  # commit on our own
         cursor = sql.get_cursor()
-        for hub_connection in db.hub_connections_complete(cursor=cursor):
-            asset = hub_connection["asset"]
-            c2h_mpc_id = hub_connection["c2h_channel_id"]
-            c2h_state = db.load_channel_state(c2h_mpc_id, asset, cursor=cursor)
-            h2c_mpc_id = hub_connection["h2c_channel_id"]
-            h2c_state = db.load_channel_state(h2c_mpc_id, asset, cursor=cursor)
-            h2c_spend_secret_hash = get_deposit_spend_secret_hash(
-                h2c_state["deposit_script"]
-            )
-            h2c_spend_secret = lib.get_secret(h2c_spend_secret_hash)
-            c2h_expired = lib.is_expired(c2h_state, etc.expire_clearance)
-            h2c_expired = lib.is_expired(h2c_state, etc.expire_clearance)
-            expired = c2h_expired or h2c_expired
-            h2c_commits_published = api.mpc_published_commits(state=h2c_state)
-            closed = hub_connection["closed"] != 0
-
-            # connection expired or commit published or spend secret known
-            if expired or closed or h2c_commits_published or h2c_spend_secret:
-                if not closed:
-                    db.set_connection_closed(handle=hub_connection["handle"])
-                rawtx = Mpc(api).finalize_commit(lib.get_wif, c2h_state)
-                if rawtx:
-                    commit_rawtxs.append(rawtx)
-
-        return commit_rawtxs
+        job = schedule.Job("publish_commits", cursor=cursor)
+        connections = db.hub_connections_complete(cursor=cursor)
+        for hub_connection in schedule.scheduled(job, connections, budget):
+            with sql.transaction(cursor):
+                rawtx = _publish_commit(hub_connection, cursor)
+                job.checkpoint(hub_connection, rawtx)
+        return job.outputs
 
 
 def _merge_rawtxs(a, b):
@@ -135,9 +163,11 @@ def _merge_rawtxs(a, b):
     return merged
 
 
-def recover_funds():
+@metrics.timed("cron_job_seconds", job="recover_funds")
+def recover_funds(budget=None):
     """Recover funds where possible"""
     with etc.database_lock:
+        sql.end_batch()  # commit on our own
         rawtxs = {
             "payout": {},
             "revoke": {},
@@ -147,26 +177,88 @@ def recover_funds():
             "deposit": {},
         }
         cursor = sql.get_cursor()
-        for hub_connection in db.hub_connections_recoverable(cursor=cursor):
-            result = lib.recover_funds(hub_connection, cursor=cursor)
+        job = schedule.Job("recover_funds", cursor=cursor)
+        connections = db.hub_connections_recoverable(cursor=cursor)
+        for hub_connection in schedule.scheduled(job, connections, budget):
+            with sql.transaction(cursor):
+                result = lib.recover_funds(hub_connection, cursor=cursor)
+                job.checkpoint(hub_connection,
+                               result if any(result.values()) else None)
+        for result in job.outputs:
             rawtxs = _merge_rawtxs(rawtxs, result)
         return rawtxs
 
 
-def collect_garbage():
+@metrics.timed("cron_job_seconds", job="update_status")
+def update_status(budget=None):
+    """Refresh status of open connections as deposit ttls change.
+
+    The counterparty lookups are made without holding the lock.
+    """
+    with etc.database_lock:
+        sql.end_batch()  # commit on our own
+        cursor = sql.get_cursor()
+        job = schedule.Job("update_status", cursor=cursor)
+        connections = db.hub_connections_open(cursor=cursor)
+    for hub_connection in schedule.scheduled(job, connections, budget):
+        with sql.read_cursor() as read_cursor:
+            status = lib.get_status(hub_connection, cursor=read_cursor)
+        with etc.database_lock:
+            sql.end_batch()  # commit on our own
+            with sql.transaction(cursor):
+                lib.save_status(hub_connection, status, cursor=cursor)
+                job.checkpoint(hub_connection)
+
+
+@metrics.timed("cron_job_seconds", job="collect_garbage")
+def collect_garbage(budget=None):
     """Remove database entries no longer needed."""
     with etc.database_lock:
         pass
 
 
-def run_all():
+JOBS = {
+    "fund_deposits": fund_deposits,
+    "publish_commits": publish_commits,
+    "recover_funds": recover_funds,
+    "update_status": update_status,
+    "collect_garbage": collect_garbage,
+}
+
+
+def run_job(name, budget=None):
+    """Run a single job manually, resuming its interrupted pass if any.
+
+    Transactions queued by the job are published once afterwards. Refused
+    with err.CronJobLeased while the hub serves, see schedule.acquire.
+    """
+    try:
+        schedule.acquire(list(JOBS) if name == "all" else [name])
+        if name == "all":
+            return run_all(budget=budget)
+        outputs = JOBS[name](budget=budget)
+        broadcast.process()
+        return outputs
+    finally:
+        schedule.release()
+
+
+@metrics.timed("cron_run_seconds")
+def run_all(budget=None):
+    rawtxs = _run_jobs(budget)
+    update_status(budget=budget)  # counterparty lookups without the lock
+    broadcast.process()  # publish queued transactions without the lock
+    return rawtxs
+
+
+def _run_jobs(budget):
     with etc.database_lock:
-        commit_rawtxs = publish_commits()
-        rawtxs = recover_funds()
+        commit_rawtxs = publish_commits(budget=budget)
+        rawtxs = recover_funds(budget=budget)
         for commit_rawtx in commit_rawtxs:
             rawtxs["commit"][util.gettxid(commit_rawtx)] = commit_rawtxs
-        for deposit in fund_deposits():
+        for deposit in fund_deposits(budget=budget):
             rawtxs["deposit"][deposit["txid"]] = deposit["rawtx"]
-        collect_garbage()
+        collect_garbage(budget=budget)
         print(time.time(), "RAWTXS:", rawtxs)  # TODO use propper logger
         return rawtxs
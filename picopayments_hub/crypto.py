@@ -0,0 +1,126 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import copy
+import json
+import hashlib
+import ecdsa
+from micropayment_core import keys
+from pycoin.serialize import b2h, h2b
+from pycoin.ecdsa import generator_secp256k1 as G
+from picopayments_cli.auth import AuthPubkeyMissmatch
+
+try:
+    import coincurve
+except ImportError:  # pragma: no cover
+    coincurve = None
+
+
+ORDER = G.order()
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+class PythonBackend(object):
+    """Pure python ecdsa of micropayment-core/pycoin."""
+
+    name = "python"
+
+    def pubkey(self, privkey):
+        return keys.pubkey_from_privkey(privkey)
+
+    def sign_sha256(self, privkey, data):
+        return keys.sign_sha256(privkey, data)
+
+    def verify_sha256(self, pubkey, signature, data):
+        return keys.verify_sha256(pubkey, signature, data)
+
+
+class Secp256k1Backend(object):
+    """Ecdsa of libsecp256k1 through the coincurve binding."""
+
+    name = "secp256k1"
+
+    def pubkey(self, privkey):
+        key = coincurve.PrivateKey(h2b(privkey))
+        return b2h(key.public_key.format(compressed=True))
+
+    def sign_sha256(self, privkey, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        key = coincurve.PrivateKey(h2b(privkey))
+        return b2h(key.sign(data, hasher=_sha256))
+
+    def verify_sha256(self, pubkey, signature, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+
+        try:
+            # libsecp256k1 only accepts low s, python backend may give high s
+            r, s = ecdsa.util.sigdecode_der(h2b(signature), ORDER)
+            if s > ORDER // 2:
+                s = ORDER - s
+            der = ecdsa.util.sigencode_der(r, s, ORDER)
+
+            key = coincurve.PublicKey(h2b(pubkey))
+            return key.verify(der, data, hasher=_sha256)
+        except (ValueError, ecdsa.der.UnexpectedDER):
+            return False
+
+
+BACKENDS = {"python": PythonBackend}
+if coincurve is not None:
+    BACKENDS["secp256k1"] = Secp256k1Backend
+
+
+_backend = (Secp256k1Backend if coincurve is not None else PythonBackend)()
+
+
+def initialize(name="auto"):
+    """Select backend by name, auto uses libsecp256k1 if available."""
+    global _backend
+    if name == "auto":
+        name = "secp256k1" if "secp256k1" in BACKENDS else "python"
+    if name not in BACKENDS:
+        raise ValueError("Crypto backend not available: {0}".format(name))
+    _backend = BACKENDS[name]()
+    return _backend.name
+
+
+def backend():
+    return _backend.name
+
+
+def sign_json(json_data, auth_wif):
+    """Same as picopayments_cli.auth.sign_json using the selected backend."""
+    privkey = keys.wif_to_privkey(auth_wif)
+    return sign_json_key(json_data, privkey, _backend.pubkey(privkey))
+
+
+def sign_json_key(json_data, privkey, pubkey):
+    """Sign json data with an already decoded key."""
+
+    # add pubkey to json data if needed
+    if "pubkey" in json_data and not json_data["pubkey"] == pubkey:
+        raise AuthPubkeyMissmatch(pubkey, json_data["pubkey"])
+    else:
+        json_data["pubkey"] = pubkey
+
+    # sign serialized data (keys must be ordered!)
+    data = json.dumps(json_data, sort_keys=True)
+    json_data["signature"] = _backend.sign_sha256(privkey,
+                                                  data.encode("utf-8"))
+    return json_data
+
+
+def verify_json(json_data):
+    """Same as picopayments_cli.auth.verify_json using the selected backend."""
+    json_data = copy.deepcopy(json_data)
+    pubkey = json_data["pubkey"]
+    signature = json_data.pop("signature")
+    data = json.dumps(json_data, sort_keys=True)
+    return _backend.verify_sha256(pubkey, signature, data.encode("utf-8"))
@@ -3,11 +3,14 @@
 # License: MIT (see LICENSE file)
 
 
+import time
 import apsw
-from micropayment_core import util
-from micropayment_core import scripts
 from picopayments_hub import etc
 from picopayments_hub import sql
+from picopayments_hub import journal
+from picopayments_hub import eventbus
+from picopayments_hub import scriptcache
+from picopayments_hub import statecache
 
 
 # old version -> migrate sql
@@ -17,7 +20,19 @@ _MIGRATIONS = {
     2: sql.load("migration_2"),
     3: sql.load("migration_3"),
     4: sql.load("migration_4"),
+    5: sql.load("migration_5"),
+    6: sql.load("migration_6"),
+    7: sql.load("migration_7"),
+    8: sql.load("migration_8"),
+    9: sql.load("migration_9"),
+    10: sql.load("migration_10"),
+    11: sql.load("migration_11"),
+    12: sql.load("migration_12"),
+    13: sql.load("migration_13"),
+    14: sql.load("migration_14"),
+    15: sql.load("migration_15"),
 }
+_COMPACTING_MIGRATIONS = [8]  # free a lot of pages, vacuum afterwards
 _HANDLE_EXISTS = "SELECT EXISTS(SELECT * FROM HubConnection WHERE handle = ?);"
 _COMMITS_REQUESTED = sql.load("commits_requested")
 _COMMITS_ACTIVE = sql.load("commits_active")
@@ -28,9 +43,27 @@ _ADD_COMMIT_REQUESTED = sql.load("add_commit_requested")
 _ADD_COMMIT_ACTIVE = sql.load("add_commit_active")
 _ADD_COMMIT_REVOKED = sql.load("add_commit_revoked")
 _RM_COMMITS = sql.load("rm_commits")
+_RM_COMMIT = {
+    "commits_requested": sql.load("rm_commit_requested"),
+    "commits_active": sql.load("rm_commit_active"),
+    "commits_revoked": sql.load("rm_commit_revoked"),
+}
+_ADD_COMMIT = {
+    "commits_requested": _ADD_COMMIT_REQUESTED,
+    "commits_active": _ADD_COMMIT_ACTIVE,
+    "commits_revoked": _ADD_COMMIT_REVOKED,
+}
+_UPDATE_COMMIT = {
+    "commits_active": sql.load("update_commit_active"),
+    "commits_revoked": sql.load("update_commit_revoked"),
+}
 _COMPLETE_CONNECTION = sql.load("complete_connection")
+_ADD_PAYMENT = sql.load("add_payment")
+_SET_COMMIT_NOTIFIED = sql.load("set_commit_notified")
 _SET_PAYMENT_NOTIFIED = sql.load("set_payment_notified")
 _SET_REVOKE_NOTIFIED = sql.load("set_revoke_notified")
+_CONNECTIONS_STATUS = sql.load("connections_status")
+_CONNECTIONS_STATUS_ASSET = sql.load("connections_status_asset")
 
 
 get_secret = sql.make_fetchone("get_secret")
@@ -40,32 +73,43 @@ c2h_channel = sql.make_fetchone("c2h_channel")
 h2c_channel = sql.make_fetchone("h2c_channel")
 unnotified_commit = sql.make_fetchone("unnotified_commit")
 
-hub_connections_complete = sql.make_fetchall("hub_connections_complete")
+_hub_connections_complete = sql.make_fetchall("hub_connections_complete")
 hub_connections_open = sql.make_fetchall("hub_connections_open")
 hub_connections_closed = sql.make_fetchall("hub_connections_closed")
 hub_connections_all = sql.make_fetchall("hub_connections_all")
-hub_connections_recoverable = sql.make_fetchall("hub_connections_recoverable")
+_hub_connections_recoverable = sql.make_fetchall(
+    "hub_connections_recoverable"
+)
+hub_connections_unreported = sql.make_fetchall("hub_connections_unreported")
 
 hub_connection = sql.make_fetchone("hub_connection")
-set_commit_notified = sql.make_execute("set_commit_notified")
-set_connection_closed = sql.make_execute("set_connection_closed")
+commit_active = sql.make_fetchone("commit_active")
+_set_connection_closed = sql.make_execute("set_connection_closed")
+set_connection_recovered = sql.make_execute("set_connection_recovered")
 set_next_revoke_secret_hash = sql.make_execute("set_next_revoke_secret_hash")
 get_next_revoke_secret_hash = sql.make_fetchone("get_next_revoke_secret_hash")
 unnotified_revokes = sql.make_fetchall("unnotified_revokes")
-add_payment = sql.make_execute("add_payment")
+add_sync_fee = sql.make_execute("add_sync_fee")
+set_rebalance_pending = sql.make_execute("set_rebalance_pending")
+clear_rebalance_pending = sql.make_execute("clear_rebalance_pending")
 unnotified_payments = sql.make_fetchall("unnotified_payments")
 micropayment_channel = sql.make_fetchone("micropayment_channel")
 recv_payments_sum = sql.make_fetchone("recv_payments_sum", True)
 send_payments_sum = sql.make_fetchone("send_payments_sum", True)
+save_connection_status = sql.make_execute("save_connection_status")
 
 
 def setup():
 
     # get connection
+    sql.close_readers()
     connection = apsw.Connection(etc.database_path)
 
-    # use foreign keys
+    # readers get their own snapshot and do not block the writer
     cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL;")
+
+    # use foreign keys
     cursor.execute("PRAGMA foreign_keys = ON;")
     cursor.execute("PRAGMA defer_foreign_keys = ON;")
 
@@ -80,17 +124,42 @@ def setup():
     if not (len(rows) == 1 and rows[0][0] == "ok"):
         raise Exception("Integrity check failed!")
 
+    # used by migrations to convert hex text to blobs
+    connection.createscalarfunction("hex_to_blob", sql.hex_to_blob, 1)
+
+    # channel state cache and event bus follow commits and rollbacks
+    statecache.clear()
+    eventbus.clear()
+    connection.setcommithook(_on_commit)
+    connection.setrollbackhook(_on_rollback)
+    sql.add_savepoint_rollback_hook(statecache.on_partial_rollback)
+    sql.add_committed_hook(eventbus.on_committed)
+
     # now ready for global use
     etc.database_connection = connection
 
     # migrate
     script = "PRAGMA user_version;"
     db_version = sql.fetchone(script, cursor=cursor)["user_version"]
+    compact = False
     while db_version in _MIGRATIONS:
         sql.execute(_MIGRATIONS[db_version], cursor=cursor)
+        compact = compact or db_version in _COMPACTING_MIGRATIONS
         db_version += 1
         script = "PRAGMA user_version = {0};".format(db_version)
         sql.execute(script, cursor=cursor)
+    if compact:
+        cursor.execute("VACUUM;")
+
+
+def _on_commit():
+    eventbus.on_commit()
+    return statecache.on_commit()
+
+
+def _on_rollback():
+    eventbus.on_rollback()
+    statecache.on_rollback()
 
 
 def commits_requested(channel_id, cursor=None):
@@ -114,68 +183,227 @@ def commits_revoked(channel_id, cursor=None):
     ]
 
 
+def _deadline_args():
+    return {"now": int(time.time()), "block_time": etc.block_time}
+
+
+def hub_connections_complete(cursor=None):
+    """Complete connections nearest expiry or recovery deadline first."""
+    return _hub_connections_complete(cursor=cursor, **_deadline_args())
+
+
+def hub_connections_recoverable(cursor=None):
+    """As hub_connections_complete without the fully recovered."""
+    return _hub_connections_recoverable(cursor=cursor, **_deadline_args())
+
+
+def set_connection_closed(handle, cursor=None):
+    """Close connection, recording the deadline to recover its funds."""
+    _set_connection_closed(handle=handle, cursor=cursor, **_deadline_args())
+
+
 def add_hub_connection(data, cursor=None):
-    cursor = cursor or sql.get_cursor()
-    cursor.execute("BEGIN TRANSACTION")
-    sql.execute(_ADD_HUB_CONNECTION, data, cursor=cursor)
-    cursor.execute("COMMIT")
+    with sql.transaction(cursor) as cursor:
+        sql.execute(_ADD_HUB_CONNECTION, data, cursor=cursor)
 
 
 def complete_hub_connection(data, cursor=None):
-    cursor = cursor or sql.get_cursor()
-    cursor.execute("BEGIN TRANSACTION")
-    set_next_revoke_secret_hash(
-        handle=data["handle"],
-        next_revoke_secret_hash=data["next_revoke_secret_hash"],
-        cursor=cursor
-    )
-    sql.execute(_COMPLETE_CONNECTION, data, cursor=cursor)
-    add_revoke_secret_args = {
-        "secret_hash": data["secret_hash"],
-        "secret_value": data["secret_value"],
-        "channel_id": data["c2h_channel_id"],
-    }
-    sql.execute(_ADD_REVOKE_SECRET, args=add_revoke_secret_args, cursor=cursor)
-    cursor.execute("COMMIT")
+    with sql.transaction(cursor) as cursor:
+        set_next_revoke_secret_hash(
+            handle=data["handle"],
+            next_revoke_secret_hash=data["next_revoke_secret_hash"],
+            cursor=cursor
+        )
+        sql.execute(_COMPLETE_CONNECTION, data, cursor=cursor)
+        statecache.invalidate(data["c2h_channel_id"])
+        statecache.invalidate(data["h2c_channel_id"])
+        add_revoke_secret_args = {
+            "secret_hash": data["secret_hash"],
+            "secret_value": data["secret_value"],
+            "channel_id": data["c2h_channel_id"],
+        }
+        sql.execute(_ADD_REVOKE_SECRET, args=add_revoke_secret_args,
+                    cursor=cursor)
 
 
 def handles_exist(handles, cursor=None):
-    args = [(handle,) for handle in handles]
+    args = [(sql.hex_to_blob(handle),) for handle in handles]
     cursor = cursor or sql.get_cursor()
     result = cursor.executemany(_HANDLE_EXISTS, args).fetchall()
     return all([r[0] for r in result])
 
 
-def set_payments_notified(payment_ids, cursor=None):
+def existing_handles(handles, cursor=None):
+    """Handles with a hub connection, resolved in one query."""
+    handles = [h for h in set(handles) if isinstance(h, str)]
+    if not handles:
+        return set()
+    script = "SELECT handle FROM HubConnection WHERE handle IN ({0});".format(
+        ", ".join("?" * len(handles))
+    )
+    args = [sql.hex_to_blob(handle) for handle in handles]
+    rows = sql.fetchall(script, args=args, cursor=cursor)
+    return set(row["handle"] for row in rows)
+
+
+def connections_status(assets=None, after=None, limit=None, cursor=None):
+    args = {"after": after or "", "limit": -1 if limit is None else limit}
+    if assets is None:
+        return sql.fetchall(_CONNECTIONS_STATUS, args=args, cursor=cursor)
+
+    # merge pages of each asset, ordered by handle
+    entries = []
+    for asset in assets:
+        args["asset"] = asset
+        entries += sql.fetchall(_CONNECTIONS_STATUS_ASSET, args=args,
+                                cursor=cursor)
+    entries.sort(key=lambda entry: entry["handle"])
+    return entries if limit is None else entries[:limit]
+
+
+def add_payment(amount, payer_handle, payee_handle, token, cursor=None):
+    cursor = cursor or sql.get_cursor()
+    payment = {
+        "amount": amount,
+        "payer_handle": payer_handle,
+        "payee_handle": payee_handle,
+        "token": token,
+    }
+    sql.execute(_ADD_PAYMENT, args=payment, cursor=cursor)
+    payment["id"] = cursor.getconnection().last_insert_rowid()
+    journal.append("payment_recorded", payment, handle=payee_handle,
+                   cursor=cursor)
+    if payee_handle is not None:
+        eventbus.publish(payee_handle)
+
+
+def add_payments(payments, cursor=None):
+    """Insert payments with one statement, journaled as with add_payment."""
+    if not payments:
+        return
+    cursor = cursor or sql.get_cursor()
+    payments = [{
+        "amount": p["amount"],
+        "payer_handle": p["payer_handle"],
+        "payee_handle": p["payee_handle"],
+        "token": p["token"],
+    } for p in payments]
+    sql.executemany(_ADD_PAYMENT, payments, cursor=cursor)
+
+    # rowids of a single insert batch without deletes are consecutive
+    last_id = cursor.getconnection().last_insert_rowid()
+    for index, payment in enumerate(payments):
+        payment["id"] = last_id - len(payments) + 1 + index
+    journal.append_many("payment_recorded", [
+        (payment, None, payment["payee_handle"]) for payment in payments
+    ], cursor=cursor)
+    for payee_handle in set(p["payee_handle"] for p in payments):
+        if payee_handle is not None:
+            eventbus.publish(payee_handle)
+
+
+def set_commit_notified(id, cursor=None):
     cursor = cursor or sql.get_cursor()
-    cursor.executemany(_SET_PAYMENT_NOTIFIED, payment_ids)
+    commit = commit_active(id=id, cursor=cursor)
+    sql.execute(_SET_COMMIT_NOTIFIED, args={"id": id}, cursor=cursor)
+    if commit is not None:
+        data = {"script": commit["script"]}
+        journal.append("commit_notified", data,
+                       channel_id=commit["channel_id"], cursor=cursor)
+        _cache_event(commit["channel_id"], "commit_notified", data, cursor)
 
 
-def set_revokes_notified(revoke_ids, cursor=None):
+def set_payments_notified(payment_ids, handle=None, cursor=None):
     cursor = cursor or sql.get_cursor()
-    cursor.executemany(_SET_REVOKE_NOTIFIED, revoke_ids)
+    sql.executemany(_SET_PAYMENT_NOTIFIED, payment_ids, cursor=cursor)
+    if payment_ids:
+        ids = [payment["id"] for payment in payment_ids]
+        journal.append("payments_notified", {"ids": ids}, handle=handle,
+                       cursor=cursor)
+
+
+def set_revokes_notified(revokes, cursor=None):
+    """Takes CommitRevoked rows as returned by unnotified_revokes."""
+    cursor = cursor or sql.get_cursor()
+    sql.executemany(_SET_REVOKE_NOTIFIED, revokes, cursor=cursor)
+    scripts = {}
+    for revoke in revokes:
+        scripts.setdefault(revoke["channel_id"], []).append(revoke["script"])
+    for channel_id, channel_scripts in sorted(scripts.items()):
+        data = {"scripts": channel_scripts}
+        journal.append("revokes_notified", data, channel_id=channel_id,
+                       cursor=cursor)
+        _cache_event(channel_id, "revokes_notified", data, cursor)
 
 
 def add_revoke_secret(channel_id, secret_hash, secret_value, cursor=None):
+    cursor = cursor or sql.get_cursor()
     args = {
         "channel_id": channel_id,
         "secret_hash": secret_hash,
         "secret_value": secret_value
     }
+    previous = _previous_entries(channel_id, cursor)
     sql.execute(_ADD_REVOKE_SECRET, args=args, cursor=cursor)
+    requested = previous["commits_requested"] + [secret_hash]
+    journal.record_state(channel_id, previous,
+                         dict(previous, commits_requested=requested),
+                         cursor=cursor)
+    _cache_event(channel_id, "commit_requested", {
+        "index": len(requested) - 1, "entry": secret_hash
+    }, cursor)
+
+
+def _channel_state(asset, cached):
+    """Channel state from cached deposit script and journal entries."""
+    entries = cached["entries"]
+    return {
+        "asset": asset,
+        "deposit_script": cached["deposit_script"],
+        "commits_requested": list(entries["commits_requested"]),
+        "commits_active": [
+            {"rawtx": e["rawtx"], "script": e["script"]}
+            for e in entries["commits_active"]
+        ],
+        "commits_revoked": [
+            {"script": e["script"], "revoke_secret": e["revoke_secret"]}
+            for e in entries["commits_revoked"]
+        ],
+    }
+
+
+def _previous_entries(channel_id, cursor):
+    """Journal entries of the current rows, cached with the state."""
+    if statecache.is_writer(cursor):
+        cached = statecache.get(channel_id)
+        if cached is not None:
+            return cached["entries"]
+    return _journal_state(channel_id, cursor)
+
+
+def _cache_event(channel_id, kind, data, cursor):
+    """Apply a journal event to the cached entries of a channel."""
+    if statecache.is_writer(cursor):
+        statecache.update(channel_id, lambda cached: journal.apply(
+            cached["entries"], kind, data
+        ))
 
 
 def load_channel_state(channel_id, asset, cursor=None):
+    cached = statecache.is_writer(cursor)
+    if cached:
+        state = statecache.get(channel_id)
+        if state is not None:
+            return _channel_state(asset, state)
+
     channel = micropayment_channel(id=channel_id, cursor=cursor)
-    state = {}
-    state["asset"] = asset
-    state["deposit_script"] = channel["deposit_script"]
-    state["commits_requested"] = commits_requested(
-        channel_id, cursor=cursor
-    )
-    state["commits_active"] = commits_active(channel_id, cursor=cursor)
-    state["commits_revoked"] = commits_revoked(channel_id, cursor=cursor)
-    return state
+    state = {
+        "deposit_script": channel["deposit_script"],
+        "entries": _journal_state(channel_id, cursor or sql.get_cursor()),
+    }
+    if cached:
+        statecache.put_committed(channel_id, state)
+    return _channel_state(asset, state)
 
 
 def _fmt_requested(channel_id, revoke_secret_hashes):
@@ -189,13 +417,11 @@ def _fmt_requested(channel_id, revoke_secret_hashes):
 
 
 def _script_data(script):
-    delay_time = scripts.get_commit_delay_time(script)
-    secret_hash = scripts.get_commit_revoke_secret_hash(script)
-    commit_address = util.script_address(script, netcode=etc.netcode)
+    data = scriptcache.commit(script)
     return {
-        "commit_address": commit_address,
-        "delay_time": delay_time,
-        "revoke_secret_hash": secret_hash,
+        "commit_address": data["address"],
+        "delay_time": data["delay_time"],
+        "revoke_secret_hash": data["revoke_secret_hash"],
     }
 
 
@@ -246,6 +472,7 @@ def save_channel_state(channel_id, state, h2c_unnotified_commit=None,
                        unnotified_revoke_secrets=None, cursor=None):
 
     cursor = cursor or sql.get_cursor()
+    previous = _previous_entries(channel_id, cursor)
 
     # reformat state data
     commits_requested = _fmt_requested(channel_id, state["commits_requested"])
@@ -257,8 +484,101 @@ def save_channel_state(channel_id, state, h2c_unnotified_commit=None,
         unnotified_revoke_secrets=unnotified_revoke_secrets
     )
 
-    # save state to db
-    cursor.execute(_RM_COMMITS, {"channel_id": channel_id})
-    cursor.executemany(_ADD_COMMIT_REQUESTED, commits_requested)
-    cursor.executemany(_ADD_COMMIT_ACTIVE, commits_active)
-    cursor.executemany(_ADD_COMMIT_REVOKED, commits_revoked)
+    # journal first, then apply the same changes to the current rows
+    rows = {
+        "commits_requested": commits_requested,
+        "commits_active": commits_active,
+        "commits_revoked": commits_revoked,
+    }
+    entries = {
+        name: journal.entries(name, rows[name]) for name in journal.LISTS
+    }
+    changes = journal.record_state(channel_id, previous, entries,
+                                   cursor=cursor)
+    if not _save_changes(channel_id, changes, rows, cursor):
+        sql.execute(_RM_COMMITS, {"channel_id": channel_id}, cursor=cursor)
+        for name in journal.LISTS:
+            sql.executemany(_ADD_COMMIT[name], rows[name], cursor=cursor)
+    if h2c_unnotified_commit is not None:
+        eventbus.publish(("channel", channel_id))
+
+    # write through, as it would be loaded from the db
+    if statecache.is_writer(cursor):
+        statecache.put(channel_id, {
+            "deposit_script": state["deposit_script"],
+            "entries": entries,
+        })
+
+
+def _save_changes(channel_id, changes, rows, cursor):
+    """Apply journaled changes to the current rows, False if they must be
+    rewritten instead to keep the order of the lists (inserts not at the
+    end or a state reset)."""
+    if changes is None:
+        return False
+    for name, (removed, added, updated) in changes.items():
+        if any(index < len(rows[name]) - len(added) for index, _ in added):
+            return False
+
+    for name, (removed, added, updated) in changes.items():
+        if name == "commits_requested":
+            keys = [{"channel_id": channel_id, "revoke_secret_hash": e}
+                    for e in removed]
+        else:
+            keys = [{"channel_id": channel_id, "script": e["script"]}
+                    for e in removed]
+        sql.executemany(_RM_COMMIT[name], keys, cursor=cursor)
+        if updated:
+            sql.executemany(_UPDATE_COMMIT[name], [
+                dict(e, channel_id=channel_id) for e in updated
+            ], cursor=cursor)
+        if added:
+            sql.executemany(_ADD_COMMIT[name], rows[name][-len(added):],
+                            cursor=cursor)
+    return True
+
+
+def _journal_state(channel_id, cursor):
+    args = {"channel_id": channel_id}
+    return {
+        "commits_requested": journal.entries("commits_requested", sql.fetchall(
+            _COMMITS_REQUESTED, args=args, cursor=cursor
+        )),
+        "commits_active": journal.entries("commits_active", sql.fetchall(
+            _COMMITS_ACTIVE, args=args, cursor=cursor
+        )),
+        "commits_revoked": journal.entries("commits_revoked", sql.fetchall(
+            _COMMITS_REVOKED, args=args, cursor=cursor
+        )),
+    }
+
+
+def restore_channel_state(channel_id, until=None, cursor=None):
+    """Rebuild the commits of a channel by replaying its journal.
+
+    Recovers from lost or inconsistent rows, or with until (event id)
+    rolls the channel back to an earlier point, journaled as a new state.
+    """
+    with sql.transaction(cursor) as cursor:
+        state = journal.replay(channel_id, until=until, cursor=cursor)
+        journal.record_state(channel_id, _journal_state(channel_id, cursor),
+                             state, cursor=cursor)
+
+        requested = _fmt_requested(channel_id, state["commits_requested"])
+        active = []
+        for entry in state["commits_active"]:
+            data = dict(entry, channel_id=channel_id)
+            data.update(_script_data(entry["script"]))
+            active.append(data)
+        revoked = []
+        for entry in state["commits_revoked"]:
+            data = dict(entry, channel_id=channel_id)
+            data.update(_script_data(entry["script"]))
+            revoked.append(data)
+
+        sql.execute(_RM_COMMITS, {"channel_id": channel_id}, cursor=cursor)
+        sql.executemany(_ADD_COMMIT_REQUESTED, requested, cursor=cursor)
+        sql.executemany(_ADD_COMMIT_ACTIVE, active, cursor=cursor)
+        sql.executemany(_ADD_COMMIT_REVOKED, revoked, cursor=cursor)
+        statecache.invalidate(channel_id)
+    return state
@@ -96,3 +96,38 @@ class InsufficientFunds(Exception):
     def __init__(self, asset, quantity):
         msg = "Insufficient Funds: {0}{1} required!"
         super(InsufficientFunds, self).__init__(msg.format(quantity, asset))
+
+
+class NotAdmin(Exception):
+
+    def __init__(self, pubkey):
+        msg = "Pubkey {0} is not authorized for admin methods!"
+        super(NotAdmin, self).__init__(msg.format(pubkey))
+
+
+class InvalidSignature(Exception):
+
+    def __init__(self, pubkey):
+        msg = "Invalid request signature for pubkey {0}!"
+        super(InvalidSignature, self).__init__(msg.format(pubkey))
+
+
+class DuplicateHandle(Exception):
+
+    def __init__(self, handle):
+        msg = "Handle given more than once in batch: '{0}'"
+        super(DuplicateHandle, self).__init__(msg.format(handle))
+
+
+class CronJobLeased(Exception):
+
+    def __init__(self, name):
+        msg = "Cron job {0} is leased to another hub or run_job process!"
+        super(CronJobLeased, self).__init__(msg.format(name))
+
+
+class JournalPruned(Exception):
+
+    def __init__(self, channel_id, until):
+        msg = "Journal of channel {0} was pruned before event {1}!"
+        super(JournalPruned, self).__init__(msg.format(channel_id, until))
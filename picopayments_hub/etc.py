@@ -5,7 +5,7 @@
 
 import os
 import picopayments_cli
-from threading import RLock
+from picopayments_hub.metrics import TimedLock
 
 
 # network
@@ -21,6 +21,7 @@ path_log = None  # loaded from args
 # server
 host = None  # loaded from args
 port = None  # loaded from args
+metrics_enabled = False  # loaded from args, serve /metrics if set
 
 
 # counterparty
@@ -32,13 +33,79 @@ counterparty_password = None  # loaded from args
 # database
 database_path = None  # loaded from args
 database_connection = None  # set in db.setup
-database_lock = RLock()
+database_lock = TimedLock("database")
+database_readers = 4  # max idle read only connections kept open
+group_commit_window = 0.002  # seconds, 0 commits every request on its own
+
+
+# rebalancing, hub to client commits for smaller transfers are deferred
+rebalance_min_delta = None  # loaded from args
+rebalance_max_staleness = None  # loaded from args
+
+
+# tracing, sampled requests are kept in a ring buffer for mph_traces
+trace_sample_rate = None  # loaded from args
+trace_path = None  # loaded from args, also append traces as json lines
+trace_buffer_size = 100
+
+
+# ecdsa for request and response signatures: auto, secp256k1 or python
+crypto_backend = None  # loaded from args
+
+
+# rpc request/response json codec: auto, orjson, ujson or json
+json_codec = None  # loaded from args
+
+
+# max parsed deposit/commit scripts kept in memory
+script_cache_size = 4096
+
+
+# max channel states kept in memory, see statecache
+channel_state_cache_size = 2048
+
+
+# signed mph_sync/mph_deposit responses returned again for retries
+request_cache_window = 600  # seconds
+request_cache_size = 100000  # max stored responses, 0 to disable
+
+
+# outbound transactions are queued and published by broadcast workers
+broadcast_workers = 2
+broadcast_interval = 10  # seconds, idle workers check for due entries
+broadcast_batch_size = 50  # entries claimed at once
+broadcast_lease = 60  # seconds a claimed entry is skipped by others
+broadcast_retry_delay = 10  # seconds, doubled for every failed attempt
+broadcast_max_retry_delay = 600  # seconds
+broadcast_max_attempts = 100  # then marked failed, see broadcast.depth
+broadcast_confirm_interval = 60  # seconds between confirmation checks
+broadcast_confirmations = 1  # required to stop tracking
+
+
+# channel journal events between snapshots, see journal
+journal_snapshot_interval = 100
+journal_snapshots_kept = 2  # older events and snapshots are pruned
+
+
+# max syncs per mph_sync_batch request
+sync_batch_max = 1000
+
+
+# max seconds mph_wait blocks for payments or commits
+wait_timeout = 30
 
 
 # blockchain
 confirms = 1
 expire_clearance = 6  # only fund with x blocks clearance before expiration
 delay_time = 2
+block_time = 600  # seconds, estimate for recovery deadlines in blocks
+
+
+# cron passes handle connections nearest expiry first, see schedule
+cron_pass_budget = 5.0  # seconds per job pass, others deferred, 0 no limit
+cron_urgent_ttl = 12  # blocks, closer to expiry is always handled first
+cron_lease = 300  # seconds a job stays leased to a process without renewal
 
 
 def load(args):
@@ -59,12 +126,27 @@ def load(args):
         # server
         "host": args["host"],
         "port": args["port"],
+        "metrics_enabled": args["metrics"],
 
         # counterpartylib api
         "counterparty_url": args["cp_url"],
         "counterparty_username": args["cp_username"],
         "counterparty_password": args["cp_password"],
 
+        # rebalancing
+        "rebalance_min_delta": args["rebalance_min_delta"],
+        "rebalance_max_staleness": args["rebalance_max_staleness"],
+
+        # tracing
+        "trace_sample_rate": args["trace_sample_rate"],
+        "trace_path": args["trace_file"],
+
+        # crypto
+        "crypto_backend": args["crypto_backend"],
+
+        # json
+        "json_codec": args["json_codec"],
+
         # set paths
         "database_path": os.path.join(basedir, database_file),
         "path_terms": os.path.join(basedir, terms_file),
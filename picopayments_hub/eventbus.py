@@ -0,0 +1,75 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import time
+import threading
+
+
+_condition = threading.Condition()
+_versions = {}  # key -> number of committed changes
+_pending = set()  # keys changed in the open transaction
+_committing = set()  # keys of a commit that has not returned yet
+
+
+def publish(key):
+    """Announce a change of key (i.e. payee handle) once committed."""
+    with _condition:
+        _pending.add(key)
+
+
+def version(keys):
+    """Opaque token that changes whenever one of keys changes."""
+    with _condition:
+        return tuple(_versions.get(key, 0) for key in keys)
+
+
+def wait(keys, since, timeout):
+    """Block until one of keys changed after version since or timeout.
+
+    Returns True if changed. Changes are published once their commit
+    returned, readers see them without waiting for etc.database_lock.
+    """
+    deadline = time.time() + timeout
+    with _condition:
+        while version(keys) == since:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            _condition.wait(remaining)
+        return True
+
+
+def _publish(keys):
+    for key in keys:
+        _versions[key] = _versions.get(key, 0) + 1
+    if keys:
+        _condition.notify_all()
+    keys.clear()
+
+
+def on_commit():
+    """Commit hook, the commit is not visible to readers yet."""
+    with _condition:
+        _publish(_committing)  # an earlier commit has returned by now
+        _committing.update(_pending)
+        _pending.clear()
+
+
+def on_committed():
+    """Commit returned, wake waiters for its changes."""
+    with _condition:
+        _publish(_committing)
+
+
+def on_rollback():
+    with _condition:
+        _pending.clear()
+
+
+def clear():
+    with _condition:
+        _versions.clear()
+        _pending.clear()
+        _committing.clear()
@@ -0,0 +1,223 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import copy
+import json
+from picopayments_hub import etc
+from picopayments_hub import err
+from picopayments_hub import sql
+
+
+MAX_EVENT_ID = 2 ** 63 - 1
+LISTS = ["commits_requested", "commits_active", "commits_revoked"]
+
+# state list -> event kind
+_ADDED = {
+    "commits_requested": "commit_requested",
+    "commits_active": "commit_added",
+    "commits_revoked": "commit_revoked",
+}
+_REMOVED = {
+    "commits_requested": "request_removed",
+    "commits_active": "commit_removed",
+    "commits_revoked": "revoke_removed",
+}
+_UPDATED = {
+    "commits_active": "commit_updated",
+    "commits_revoked": "revoke_updated",
+}
+_FIELDS = {
+    "commits_active": ["rawtx", "script", "payee_notified"],
+    "commits_revoked": ["script", "revoke_secret", "payee_notified"],
+}
+_LIST_ADDED = {kind: name for name, kind in _ADDED.items()}
+_LIST_REMOVED = {kind: name for name, kind in _REMOVED.items()}
+_LIST_UPDATED = {kind: name for name, kind in _UPDATED.items()}
+
+
+_ADD_EVENT = sql.load("add_channel_event")
+_add_event = sql.make_execute("add_channel_event")
+_add_snapshot = sql.make_execute("add_channel_snapshot")
+_snapshot = sql.make_fetchone("channel_snapshot")
+_channel_events = sql.make_fetchall("channel_events")
+_connection_events = sql.make_fetchall("connection_events")
+_progress = sql.make_fetchone("channel_journal_progress")
+_prune = sql.make_execute("prune_channel_journal")
+
+
+def empty_state():
+    return {name: [] for name in LISTS}
+
+
+def entries(name, rows):
+    """Journal entries of a state list from CommitRequested/Active/Revoked
+    rows or the equivalent formatted rows of db.save_channel_state."""
+    if name == "commits_requested":
+        return [row["revoke_secret_hash"] for row in rows]
+    return [{field: row[field] for field in _FIELDS[name]} for row in rows]
+
+
+def _key(name, entry):
+    return entry if name == "commits_requested" else entry["script"]
+
+
+def append(kind, data, channel_id=None, handle=None, cursor=None):
+    """Append event to the journal and return its id."""
+    cursor = cursor or sql.get_cursor()
+    _add_event(channel_id=channel_id, handle=handle, kind=kind,
+               data=json.dumps(data, sort_keys=True), cursor=cursor)
+    return cursor.getconnection().last_insert_rowid()
+
+
+def append_many(kind, events, cursor=None):
+    """Append (data, channel_id, handle) events of one kind at once."""
+    sql.executemany(_ADD_EVENT, [{
+        "channel_id": channel_id,
+        "handle": handle,
+        "kind": kind,
+        "data": json.dumps(data, sort_keys=True),
+    } for data, channel_id, handle in events], cursor=cursor)
+
+
+def changes(name, old, new):
+    """Keyed changes turning old list into new as (removed, added, updated)
+    with added as (index, entry) pairs, None if keys repeat or kept entries
+    were reordered."""
+    old_entries = {_key(name, e): e for e in old}
+    new_entries = {_key(name, e): e for e in new}
+    if len(old_entries) != len(old) or len(new_entries) != len(new):
+        return None
+    kept = [_key(name, e) for e in new if _key(name, e) in old_entries]
+    if kept != [_key(name, e) for e in old if _key(name, e) in new_entries]:
+        return None
+    removed = [e for e in old if _key(name, e) not in new_entries]
+    added, updated = [], []
+    for index, entry in enumerate(new):
+        key = _key(name, entry)
+        if key not in old_entries:
+            added.append((index, entry))
+        elif old_entries[key] != entry:
+            updated.append(entry)
+    return removed, added, updated
+
+
+def _events(name, change):
+    removed, added, updated = change
+    events = [(_REMOVED[name], {"entry": e}) for e in removed]
+    events += [(_UPDATED[name], {"entry": e}) for e in updated]
+    events += [(_ADDED[name], {"index": i, "entry": e}) for i, e in added]
+    return events
+
+
+def _diff(name, old, new):
+    """Events turning old list into new, None if entries were reordered."""
+    change = changes(name, old, new)
+    return None if change is None else _events(name, change)
+
+
+def record_state(channel_id, previous, state, cursor=None):
+    """Journal the transition of a channel from previous to state.
+
+    States map LISTS to journal entries (see entries). A snapshot is
+    written once etc.journal_snapshot_interval events were appended since
+    the last one, and a baseline snapshot before the first events. Only
+    the latest etc.journal_snapshots_kept snapshots and the events after
+    the oldest of them are retained.
+
+    Returns the changes of each list (see changes), None if the state
+    was journaled as a reset.
+    """
+    cursor = cursor or sql.get_cursor()
+    progress = _progress(channel_id=channel_id, cursor=cursor)
+    if progress is None:
+        _add_snapshot(channel_id=channel_id, event_id=0,
+                      state=json.dumps(previous), cursor=cursor)
+        count = 0
+    else:
+        count = progress["count"]
+
+    result, events = {}, []
+    for name in LISTS:
+        result[name] = changes(name, previous[name], state[name])
+        if result[name] is None:
+            result, events = None, [("state_reset", {"state": state})]
+            break
+        events += _events(name, result[name])
+    if not events:
+        return result
+
+    for kind, data in events:
+        event_id = append(kind, data, channel_id=channel_id, cursor=cursor)
+    if count + len(events) >= etc.journal_snapshot_interval:
+        _add_snapshot(channel_id=channel_id, event_id=event_id,
+                      state=json.dumps(state), cursor=cursor)
+        _prune(channel_id=channel_id,
+               offset=max(etc.journal_snapshots_kept - 1, 0), cursor=cursor)
+    return result
+
+
+def _set_notified(entries, scripts):
+    for entry in entries:
+        if entry["script"] in scripts:
+            entry["payee_notified"] = 1
+
+
+def apply(state, kind, data):
+    """Apply a journal event to a channel state."""
+    if kind == "state_reset":
+        state.clear()
+        state.update(copy.deepcopy(data["state"]))
+    elif kind in _LIST_ADDED:
+        name = _LIST_ADDED[kind]
+        state[name].insert(data["index"], copy.deepcopy(data["entry"]))
+    elif kind in _LIST_UPDATED:
+        name = _LIST_UPDATED[kind]
+        key = _key(name, data["entry"])
+        state[name] = [
+            copy.deepcopy(data["entry"]) if _key(name, e) == key else e
+            for e in state[name]
+        ]
+    elif kind in _LIST_REMOVED:
+        name = _LIST_REMOVED[kind]
+        key = _key(name, data["entry"])
+        state[name] = [e for e in state[name] if _key(name, e) != key]
+    elif kind == "commit_notified":
+        _set_notified(state["commits_active"], [data["script"]])
+    elif kind == "revokes_notified":
+        _set_notified(state["commits_revoked"], data["scripts"])
+    return state  # payment events do not change channel state
+
+
+def replay(channel_id, until=None, cursor=None):
+    """Channel state after event id until (default latest) from the latest
+    snapshot before it and the events since. Points before the oldest
+    retained snapshot raise err.JournalPruned."""
+    until = MAX_EVENT_ID if until is None else until
+    snapshot = _snapshot(channel_id=channel_id, until=until, cursor=cursor)
+    state, after = empty_state(), 0
+    if snapshot is None and _progress(channel_id=channel_id, cursor=cursor):
+        raise err.JournalPruned(channel_id, until)
+    if snapshot is not None:
+        state, after = json.loads(snapshot["state"]), snapshot["event_id"]
+    for event in _channel_events(channel_id=channel_id, after=after,
+                                 until=until, cursor=cursor):
+        apply(state, event["kind"], json.loads(event["data"]))
+    return state
+
+
+def events(channel_id=None, handle=None, after=0, until=None, cursor=None):
+    """Journal events of a channel or a connection handle for auditing."""
+    args = {
+        "after": after,
+        "until": MAX_EVENT_ID if until is None else until,
+        "cursor": cursor,
+    }
+    if channel_id is not None:
+        rows = _channel_events(channel_id=channel_id, **args)
+    else:
+        rows = _connection_events(handle=handle, **args)
+    for row in rows:
+        row["data"] = json.loads(row["data"])
+    return rows
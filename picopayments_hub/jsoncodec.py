@@ -0,0 +1,91 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+class StdlibCodec(object):
+
+    name = "json"
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+class OrjsonCodec(object):
+
+    name = "orjson"
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:  # i.e. non str keys or ints beyond 64 bit
+            return json.dumps(obj)
+
+
+class UjsonCodec(object):
+
+    name = "ujson"
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(obj, ensure_ascii=True)
+        except (TypeError, OverflowError):  # i.e. ints beyond 64 bit
+            return json.dumps(obj)
+
+
+CODECS = {"json": StdlibCodec}
+if ujson is not None:
+    CODECS["ujson"] = UjsonCodec
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec
+
+
+_codec = StdlibCodec()
+
+
+def initialize(name="auto"):
+    """Select codec by name, auto prefers orjson then ujson."""
+    global _codec
+    if name == "auto":
+        name = next(n for n in ["orjson", "ujson", "json"] if n in CODECS)
+    if name not in CODECS:
+        raise ValueError("Json codec not available: {0}".format(name))
+    _codec = CODECS[name]()
+    return _codec.name
+
+
+def codec():
+    return _codec.name
+
+
+def loads(data):
+    """Decode json text or utf-8 bytes, raises ValueError if invalid."""
+    return _codec.loads(data)
+
+
+def dumps(obj):
+    return _codec.dumps(obj)
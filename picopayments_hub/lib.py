@@ -6,6 +6,7 @@
 import os
 import copy
 import json
+import time
 import pkg_resources
 import cachetools
 from micropayment_core import util
@@ -13,11 +14,17 @@ from micropayment_core import keys
 from micropayment_core import scripts
 from counterpartylib.lib.util import DictCache
 from picopayments_cli.mpc import Mpc
-from picopayments_cli.auth import load_wif
 from picopayments_hub import db
 from picopayments_hub import err
 from picopayments_hub import etc
 from picopayments_hub import sql
+from picopayments_hub import trace
+from picopayments_hub import crypto
+from picopayments_hub import broadcast
+from picopayments_hub import jsoncodec
+from picopayments_hub import wallet
+from picopayments_hub import eventbus
+from picopayments_hub import scriptcache
 
 
 _TERMS_FP = pkg_resources.resource_stream("picopayments_hub", "terms.json")
@@ -35,14 +42,16 @@ def get_secret(secret_hash, cursor=None):
     return None
 
 
+def load_wif():
+    return wallet.wif()
+
+
 def get_wif(pubkey):
-    wif = load_wif()
-    assert(pubkey == keys.pubkey_from_wif(wif))
-    return wif
+    return wallet.get_wif(pubkey)
 
 
 def get_funding_address():
-    return keys.address_from_wif(load_wif())
+    return wallet.address()
 
 
 def create_secret():
@@ -59,9 +68,9 @@ def create_hub_connection(asset, client_pubkey,
     data.update(current_terms)
 
     # new hub key
-    hub_wif = load_wif()
-    data["hub_pubkey"] = keys.pubkey_from_wif(hub_wif)
-    data["hub_address"] = keys.address_from_wif(hub_wif)
+    hub_wif = wallet.wif()
+    data["hub_pubkey"] = wallet.pubkey()
+    data["hub_address"] = wallet.address()
 
     # client key
     data["client_pubkey"] = client_pubkey
@@ -92,9 +101,10 @@ def create_hub_connection(asset, client_pubkey,
 
 def _load_incomplete_connection(handle, c2h_deposit_script_hex):
 
-    client_pubkey = scripts.get_deposit_payer_pubkey(c2h_deposit_script_hex)
-    hub_pubkey = scripts.get_deposit_payee_pubkey(c2h_deposit_script_hex)
-    expire_time = scripts.get_deposit_expire_time(c2h_deposit_script_hex)
+    c2h_deposit = scriptcache.deposit(c2h_deposit_script_hex)
+    client_pubkey = c2h_deposit["payer_pubkey"]
+    hub_pubkey = c2h_deposit["payee_pubkey"]
+    expire_time = c2h_deposit["expire_time"]
 
     hub_conn = db.hub_connection(handle=handle)
     assert(hub_conn is not None)
@@ -130,20 +140,20 @@ def complete_connection(handle, c2h_deposit_script,
         "expire_time": expire_time,
         "c2h_channel_id": hub_conn["c2h_channel_id"],
         "c2h_deposit_script": c2h_deposit_script,
-        "c2h_deposit_address": util.script_address(
-            c2h_deposit_script, netcode=etc.netcode
-        ),
+        "c2h_deposit_address": get_script_address(c2h_deposit_script),
         "h2c_channel_id": hub_conn["h2c_channel_id"],
         "h2c_deposit_script": h2c_deposit_script,
-        "h2c_deposit_address": util.script_address(
-            h2c_deposit_script, netcode=etc.netcode
-        ),
+        "h2c_deposit_address": get_script_address(h2c_deposit_script),
         "next_revoke_secret_hash": next_revoke_secret_hash,
     }
 
     data.update(create_secret())  # revoke secret
 
     db.complete_hub_connection(data)
+
+    # no deposits yet, refreshed by the cron update_status job
+    db.save_connection_status(handle=handle, asset=hub_conn["asset"],
+                              balance=0, ttl=None, status="opening")
     return (
         {
             "deposit_script": h2c_deposit_script,
@@ -160,8 +170,24 @@ def initialize(args):
     if not os.path.exists(etc.basedir):
         os.makedirs(etc.basedir)
 
+    crypto.initialize(etc.crypto_backend)
+    jsoncodec.initialize(etc.json_codec)
     get_terms()  # make sure terms file exists
+    wallet.load()  # make sure wallet exists and cache hub key
     db.setup()  # setup and create db if needed
+    backfill_status()  # connections from before materialized status
+
+
+def backfill_status():
+    """Materialize status of open connections that have none yet."""
+    with sql.read_cursor() as cursor:
+        hub_conns = db.hub_connections_unreported(cursor=cursor)
+    for hub_conn in hub_conns:
+        with sql.read_cursor() as cursor:
+            status = get_status(hub_conn, cursor=cursor)
+        with etc.database_lock:
+            sql.end_batch()  # commit on our own
+            save_status(hub_conn, status)
 
 
 def update_channel_state(channel_id, asset, commit=None,
@@ -185,12 +211,12 @@ def update_channel_state(channel_id, asset, commit=None,
         #      currently not a problem as its only used for hub to client
         #      but its begging to be missused!!
         state = api.mpc_revoke_all(state=state, secrets=revokes)
-    cursor.execute("BEGIN TRANSACTION;")
-    db.save_channel_state(
-        channel_id, state, h2c_unnotified_commit=unnotified_commit,
-        unnotified_revoke_secrets=unnotified_revoke_secrets, cursor=cursor
-    )
-    cursor.execute("COMMIT;")
+    with sql.transaction(cursor):
+        db.save_channel_state(
+            channel_id, state, h2c_unnotified_commit=unnotified_commit,
+            unnotified_revoke_secrets=unnotified_revoke_secrets,
+            cursor=cursor
+        )
     return state
 
 
@@ -198,30 +224,29 @@ def _save_sync_data(cursor, handle, next_revoke_secret_hash,
                     receive_payments, h2c_commit_id, h2c_revokes,
                     c2h_id, next_revoke_secret):
 
-    cursor.execute("BEGIN TRANSACTION;")
-
-    # set next revoke secret hash from client
-    db.set_next_revoke_secret_hash(
-        handle=handle, next_revoke_secret_hash=next_revoke_secret_hash
-    )
+    with sql.transaction(cursor):
 
-    # mark sent payments as received
-    payment_ids = [{"id": p.pop("id")} for p in receive_payments]
-    db.set_payments_notified(payment_ids, cursor=cursor)
+        # set next revoke secret hash from client
+        db.set_next_revoke_secret_hash(
+            handle=handle, next_revoke_secret_hash=next_revoke_secret_hash
+        )
 
-    # mark sent commit as received
-    if h2c_commit_id:
-        db.set_commit_notified(id=h2c_commit_id, cursor=cursor)
+        # mark sent payments as received
+        payment_ids = [{"id": p.pop("id")} for p in receive_payments]
+        db.set_payments_notified(payment_ids, handle=handle, cursor=cursor)
 
-    # mark sent revokes as received
-    if h2c_revokes:
-        db.set_revokes_notified(h2c_revokes, cursor=cursor)
+        # mark sent commit as received
+        if h2c_commit_id:
+            db.set_commit_notified(id=h2c_commit_id, cursor=cursor)
 
-    # save next spend secret
-    db.add_revoke_secret(c2h_id, next_revoke_secret["secret_hash"],
-                         next_revoke_secret["secret_value"], cursor=cursor)
+        # mark sent revokes as received
+        if h2c_revokes:
+            db.set_revokes_notified(h2c_revokes, cursor=cursor)
 
-    cursor.execute("COMMIT;")
+        # save next spend secret
+        db.add_revoke_secret(c2h_id, next_revoke_secret["secret_hash"],
+                             next_revoke_secret["secret_value"],
+                             cursor=cursor)
 
 
 def recover_funds(hub_connection, cursor=None):
@@ -231,10 +256,37 @@ def recover_funds(hub_connection, cursor=None):
     h2c_mpc_id = hub_connection["h2c_channel_id"]
     c2h_state = db.load_channel_state(c2h_mpc_id, asset, cursor=cursor)
     h2c_state = db.load_channel_state(h2c_mpc_id, asset, cursor=cursor)
-    return Mpc(api).full_duplex_recover_funds(
+    queue = broadcast.QueueApi(api, "recover", handle=hub_connection["handle"],
+                               cursor=cursor)
+    rawtxs = Mpc(queue).full_duplex_recover_funds(
         get_wif, get_secret, c2h_state, h2c_state
     )
 
+    # closed and nothing left, skipped by later passes
+    if hub_connection["closed"] and not any(rawtxs.values()):
+        if _is_recovered(hub_connection["handle"], c2h_state, h2c_state,
+                         cursor):
+            db.set_connection_recovered(handle=hub_connection["handle"],
+                                        cursor=cursor)
+    return rawtxs
+
+
+def _is_recovered(handle, c2h_state, h2c_state, cursor):
+    """Nothing queued for handle and no funds left the hub could recover:
+    on the deposits (including commit change), the hub's commits or the
+    client's revoked commits."""
+    from picopayments_hub import api
+    if broadcast.is_unconfirmed(handle, cursor=cursor):
+        return False
+    scripts = [c2h_state["deposit_script"], h2c_state["deposit_script"]]
+    scripts += [c["script"] for c in c2h_state["commits_active"]]
+    scripts += [c["script"] for c in h2c_state["commits_revoked"]]
+    for script in scripts:
+        address = get_script_address(script)
+        if api.get_unspent_txouts(address=address, unconfirmed=True):
+            return False
+    return True
+
 
 def close_connection(handle, h2c_spend_secret=None):
 
@@ -248,8 +300,9 @@ def close_connection(handle, h2c_spend_secret=None):
             db.add_secret(secret_value=h2c_spend_secret,
                           secret_hash=secret_hash, cursor=cursor)
 
-    # close connection if not already done
+    # close connection if not already done, deferred funds are not lost
     if not hub_connection["closed"]:
+        _balance_channel(handle, cursor, rebalance=True)
         db.set_connection_closed(handle=handle, cursor=cursor)
 
     # get c2h spend secret if no commits for channel
@@ -257,24 +310,43 @@ def close_connection(handle, h2c_spend_secret=None):
     c2h_state = db.load_channel_state(hub_connection["c2h_channel_id"],
                                       hub_connection["asset"], cursor=cursor)
     if len(c2h_state["commits_active"]) == 0:
-        c2h_spend_secret_hash = scripts.get_deposit_spend_secret_hash(
-            c2h_state["deposit_script"]
-        )
+        c2h_deposit = scriptcache.deposit(c2h_state["deposit_script"])
+        c2h_spend_secret_hash = c2h_deposit["spend_secret_hash"]
         c2h_spend_secret = get_secret(c2h_spend_secret_hash)
 
-    hub_wif = load_wif()
-    return ({"spend_secret": c2h_spend_secret}, hub_wif)
+    # h2c commit of flushed funds and revokes not yet sent to the client
+    h2c_commit = db.unnotified_commit(
+        channel_id=hub_connection["h2c_channel_id"], cursor=cursor
+    )
+    c2h_revokes = db.unnotified_revokes(
+        channel_id=hub_connection["c2h_channel_id"], cursor=cursor
+    )
+    with sql.transaction(cursor):
+        if h2c_commit:
+            db.set_commit_notified(id=h2c_commit.pop("id"), cursor=cursor)
+        if c2h_revokes:
+            db.set_revokes_notified(c2h_revokes, cursor=cursor)
+
+    hub_wif = wallet.wif()
+    return (
+        {
+            "spend_secret": c2h_spend_secret,
+            "commit": h2c_commit,
+            "revokes": [r["revoke_secret"] for r in c2h_revokes]
+        },
+        hub_wif
+    )
 
 
 def sync_hub_connection(handle, next_revoke_secret_hash,
-                        payments, commit, revokes):
+                        payments, commit, revokes, rebalance=False):
 
     cursor = sql.get_cursor()
     hub_connection = db.hub_connection(handle=handle, cursor=cursor)
 
     _update_channel_state(hub_connection, commit, revokes, cursor)
     _process_payments(handle, payments, hub_connection, cursor)
-    _balance_channel(handle, cursor)
+    _balance_channel(handle, cursor, rebalance=rebalance)
     next_revoke_secret = create_secret()  # create next spend secret
 
     # load unnotified
@@ -293,7 +365,7 @@ def sync_hub_connection(handle, next_revoke_secret_hash,
         h2c_commit_id, c2h_revokes, c2h_id, next_revoke_secret
     )
 
-    hub_wif = load_wif()
+    hub_wif = wallet.wif()
     return (
         {
             "receive": receive_payments,
@@ -305,6 +377,39 @@ def sync_hub_connection(handle, next_revoke_secret_hash,
     )
 
 
+def existing_handles(handles, cursor=None):
+    """Set of the given handles that have a hub connection."""
+    return db.existing_handles(handles, cursor=cursor)
+
+
+def get_notifications(hub_connection, cursor=None):
+    handle = hub_connection["handle"]
+    h2c_id = hub_connection["h2c_channel_id"]
+    payments = db.unnotified_payments(payee_handle=handle, cursor=cursor)
+    commit = db.unnotified_commit(channel_id=h2c_id, cursor=cursor)
+    return {"payments": len(payments), "commit": commit is not None}
+
+
+def wait_for_notifications(handle, timeout):
+    """Block until payments or a commit wait for the client to sync.
+
+    Returns unnotified payment count and if a commit is waiting, both
+    empty after timeout seconds.
+    """
+    with sql.read_cursor() as cursor:
+        hub_connection = db.hub_connection(handle=handle, cursor=cursor)
+    keys = [handle, ("channel", hub_connection["h2c_channel_id"])]
+    deadline = time.time() + timeout
+    while True:
+        since = eventbus.version(keys)
+        with sql.read_cursor() as cursor:
+            result = get_notifications(hub_connection, cursor=cursor)
+        remaining = deadline - time.time()
+        if result["payments"] or result["commit"] or remaining <= 0:
+            return result
+        eventbus.wait(keys, since, remaining)
+
+
 def _terms_assets(assets=None):
     """limit to terms assets and use all terms assets if none given"""
     if assets is not None:
@@ -316,7 +421,7 @@ def get_hub_liquidity(assets=None):
     assets = _terms_assets(assets=assets)
     if "BTC" not in assets:
         assets.append("BTC")
-    address = keys.address_from_wif(load_wif())
+    address = wallet.address()
     return get_balances(address, assets=assets)
 
 
@@ -325,16 +430,28 @@ def get_balances(address, assets=None):
     return Mpc(api).get_balances(address=address, assets=assets)
 
 
-def get_connections_status(assets=None):
+def get_connections_status(assets=None, after=None, limit=None,
+                           cursor=None):
     connections = {}
-    for hub_conn in db.hub_connections_open():
-        if assets is not None and hub_conn["asset"] not in assets:
-            continue
-        connections[hub_conn["handle"]] = get_status(hub_conn)
+    entries = db.connections_status(assets=assets, after=after, limit=limit,
+                                    cursor=cursor)
+    for entry in entries:
+        connections[entry.pop("handle")] = entry
     return connections
 
 
+def save_status(hub_conn, status, cursor=None):
+    """Materialize status unless the connection was closed meanwhile,
+    must hold the lock."""
+    current = db.hub_connection(handle=hub_conn["handle"], cursor=cursor)
+    if not current["closed"]:
+        db.save_connection_status(handle=hub_conn["handle"],
+                                  cursor=cursor, **status)
+
+
 def get_status(hub_conn, clearance=6, cursor=None):
+    """Connection status from counterparty lookups, these are slow so
+    call with a read cursor and without holding the lock."""
     from picopayments_hub import api
 
     send_state = db.load_channel_state(
@@ -345,7 +462,8 @@ def get_status(hub_conn, clearance=6, cursor=None):
     )
     status = Mpc(api).full_duplex_channel_status(
         hub_conn["handle"], etc.netcode, send_state,
-        recv_state, get_secret, clearance=clearance
+        recv_state, lambda h: get_secret(h, cursor=cursor),
+        clearance=clearance
     )
     return {
         "asset": status["asset"],
@@ -360,7 +478,7 @@ def deposit_address(state):
 
 
 def get_script_address(script):
-    return util.script_address(script, netcode=etc.netcode)
+    return scriptcache.address(script)
 
 
 def get_transferred_quantity(state):
@@ -378,12 +496,8 @@ def get_txs(txids):
     return api.getrawtransaction_batch(txhash_list=txids)
 
 
-def publish(rawtx):
-    from picopayments_hub import api
-    return api.sendrawtransaction(tx_hex=rawtx)  # pragma: no cover
-
-
-def send_funds(destination, asset, quantity):
+def send_funds(destination, asset, quantity, handle=None, cursor=None):
+    """Queue a send of quantity to destination, see broadcast."""
 
     from picopayments_hub import api
     try:
@@ -391,9 +505,10 @@ def send_funds(destination, asset, quantity):
         fee_per_kb = 25000  # TODO get from cplib
         fee = int(fee_per_kb / 2)
         extra_btc = (fee + regular_dust_size) * 3
-        wif = load_wif()
-        address = keys.address_from_wif(wif)
-        utxos = _get_hub_utxos(address, asset, quantity, extra_btc)
+        wif = wallet.wif()
+        address = wallet.address()
+        utxos = _get_hub_utxos(address, asset, quantity, extra_btc,
+                               cursor=cursor)
         unsigned_rawtx = api.create_send(
             source=address,
             destination=destination,
@@ -404,15 +519,16 @@ def send_funds(destination, asset, quantity):
             custom_inputs=utxos,
         )
         signed_rawtx = scripts.sign_deposit(get_txs, wif, unsigned_rawtx)
-        txid = publish(signed_rawtx)
-        assert txid, "Failed to publish transaction: {0}".format(signed_rawtx)
+        txid = broadcast.enqueue(signed_rawtx, "deposit", handle=handle,
+                                 cursor=cursor)
         return {"txid": txid, "rawtx": signed_rawtx}
     except err.InsufficientFunds:
         print("Insufficient funds!")
         return None
 
 
-def _get_hub_utxos(address, asset, asset_quantity, btc_quantity):
+def _get_hub_utxos(address, asset, asset_quantity, btc_quantity,
+                   cursor=None):
     from picopayments_hub import api
 
     asset_balance = get_balances(address, assets=[asset])[asset]
@@ -420,11 +536,12 @@ def _get_hub_utxos(address, asset, asset_quantity, btc_quantity):
         raise err.InsufficientFunds(asset, asset_quantity)
 
     utxos = api.get_unspent_txouts(address=address, unconfirmed=False)
+    spent = broadcast.spent_outputs("deposit", cursor=cursor)
     utxo_sum = 0
     results = []
     for utxo in utxos:
         utxoid = "{0}:{1}".format(utxo["txid"], utxo["vout"])
-        if utxoid in _UTXO_LOCKS:
+        if utxoid in _UTXO_LOCKS or utxoid in spent:
             continue
         if utxo_sum >= btc_quantity:
             break
@@ -452,6 +569,7 @@ def has_unconfirmed_transactions(address):
     return False
 
 
+@trace.traced("lib.load_connection_data")
 def load_connection_data(handle, new_c2h_commit=None,
                          new_h2c_revokes=None, cursor=None):
     from picopayments_hub import api
@@ -528,7 +646,7 @@ def _send_client_funds(connection_data, quantity):
     result = db.get_next_revoke_secret_hash(handle=handle)
     next_revoke_secret_hash = result["next_revoke_secret_hash"]
     deposit_script_bin = h2c_state["deposit_script"]
-    hub_pubkey = scripts.get_deposit_payer_pubkey(deposit_script_bin)
+    hub_pubkey = scriptcache.deposit(deposit_script_bin)["payer_pubkey"]
     wif = get_wif(hub_pubkey)
 
     result = Mpc(api).full_duplex_transfer(
@@ -554,28 +672,46 @@ def _update_channel_state(hub_connection, commit, revokes, cursor):
 
 def _process_payments(payer_handle, payments, hub_connection, cursor):
 
-    # add sync fee payment
+    # add sync fee to connection total
     connection_terms = db.terms(id=hub_connection["terms_id"])
-    payments.insert(0, {
-        "payee_handle": None,  # to hub
-        "amount": connection_terms["sync_fee"],
-        "token": "sync_fee"
-    })
+    db.add_sync_fee(handle=payer_handle, amount=connection_terms["sync_fee"],
+                    cursor=cursor)
 
     # process payments
-    for payment in payments:
+    for payment in payments or []:
         payment["payer_handle"] = payer_handle
-        db.add_payment(cursor=cursor, **payment)
+    db.add_payments(payments, cursor=cursor)
 
 
-def _balance_channel(handle, cursor):
+def _rebalance_due(connection_data, quantity, rebalance):
+    """Rebalancing policy, small transfers are deferred and netted later.
+
+    Deferred transfers are flushed before the h2c deposit expires,
+    whatever the staleness limit.
+    """
+    if rebalance or quantity >= etc.rebalance_min_delta:
+        return True
+    pending_since = connection_data["connection"]["rebalance_pending_since"]
+    stale = (etc.rebalance_max_staleness and pending_since is not None and
+             time.time() - pending_since >= etc.rebalance_max_staleness)
+    h2c_state = connection_data["h2c_state"]
+    return stale or is_expired(h2c_state, etc.expire_clearance * 2)
+
+
+def _balance_channel(handle, cursor, rebalance=False):
     connection_data = load_connection_data(handle, cursor=cursor)
 
+    quantity = connection_data["sendable_amount"]
+    if quantity == 0:
+        return  # nothing to transfer
+    if not _rebalance_due(connection_data, quantity, rebalance):
+        db.set_rebalance_pending(handle=handle, cursor=cursor)
+        return
+
     c2h_unnotified_revokes = db.unnotified_revokes(
         channel_id=connection_data["connection"]["c2h_channel_id"]
     )
     prev_unnotified_commit = connection_data["h2c_unnotified_commit"]
-    quantity = connection_data["sendable_amount"]
     result = _send_client_funds(connection_data, quantity)
 
     # remove previously unnotified commit if never sent to client
@@ -586,17 +722,20 @@ def _balance_channel(handle, cursor):
     if prev_unnotified_commit is not None and new_commit:
         del h2c_commits_active[-2]  # unnotified is always second highest
 
-    cursor.execute("BEGIN TRANSACTION;")
     c2h_unnotified_revokes += result["c2h_revoke_secrets"]
-    db.save_channel_state(
-        connection_data["connection"]["c2h_channel_id"], result["c2h_state"],
-        unnotified_revoke_secrets=c2h_unnotified_revokes, cursor=cursor
-    )
-    db.save_channel_state(
-        connection_data["connection"]["h2c_channel_id"], result["h2c_state"],
-        h2c_unnotified_commit=result["h2c_unnotified_commit"], cursor=cursor
-    )
-    cursor.execute("COMMIT;")
+    with sql.transaction(cursor):
+        db.save_channel_state(
+            connection_data["connection"]["c2h_channel_id"],
+            result["c2h_state"],
+            unnotified_revoke_secrets=c2h_unnotified_revokes, cursor=cursor
+        )
+        db.save_channel_state(
+            connection_data["connection"]["h2c_channel_id"],
+            result["h2c_state"],
+            h2c_unnotified_commit=result["h2c_unnotified_commit"],
+            cursor=cursor
+        )
+        db.clear_rebalance_pending(handle=handle, cursor=cursor)
 
 
 def get_terms(assets=None):
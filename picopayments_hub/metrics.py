@@ -0,0 +1,169 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import time
+import functools
+import threading
+import contextlib
+from threading import RLock
+from collections import OrderedDict
+
+
+PREFIX = "picopayments_hub_"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+_lock = threading.Lock()
+_histograms = OrderedDict()  # (name, labels) -> [buckets, counts, sum, n]
+_request = threading.local()  # counterparty calls of the current request
+_gauges = OrderedDict()  # name -> func returning {key: number}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def register_gauges(name, func):
+    """Render numbers returned by func as gauges on every scrape."""
+    _gauges[name] = func
+
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    """Add a value to the histogram with the given name and labels."""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = [buckets, [0] * len(buckets), 0.0, 0]
+            _histograms[key] = histogram
+        for i, bound in enumerate(histogram[0]):
+            if value <= bound:
+                histogram[1][i] += 1
+        histogram[2] += value
+        histogram[3] += 1
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - begin, **labels)
+
+
+def timed(name, **labels):
+    """Decorator to observe call durations."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def request(method):
+    """Observe duration and counterparty calls of a json-rpc request."""
+    _request.counterparty_calls = 0
+    try:
+        with timer("rpc_request_seconds", method=method):
+            yield
+    finally:
+        observe("rpc_counterparty_calls", _request.counterparty_calls,
+                buckets=COUNT_BUCKETS, method=method)
+        _request.counterparty_calls = None
+
+
+@contextlib.contextmanager
+def counterparty_call(method):
+    if getattr(_request, "counterparty_calls", None) is not None:
+        _request.counterparty_calls += 1
+    with timer("counterparty_call_seconds", method=method):
+        yield
+
+
+class TimedLock(object):
+    """Reentrant lock observing acquire wait and outermost hold times."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = RLock()
+        self._local = threading.local()
+
+    def acquire(self, blocking=True, timeout=-1):
+        begin = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            depth = getattr(self._local, "depth", 0)
+            if depth == 0:
+                now = time.perf_counter()
+                observe("lock_wait_seconds", now - begin, lock=self.name)
+                self._local.acquired = now
+            self._local.depth = depth + 1
+        return acquired
+
+    def release(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            held = time.perf_counter() - self._local.acquired
+            observe("lock_hold_seconds", held, lock=self.name)
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    pairs = ['{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+             for k, v in items]
+    return "{" + ",".join(pairs) + "}"
+
+
+def render():
+    """Histograms in the prometheus text exposition format."""
+    with _lock:
+        histograms = [(k, [b, list(c), s, n])
+                      for k, (b, c, s, n) in _histograms.items()]
+    histograms.sort(key=lambda item: item[0][0])  # group by metric
+    lines = []
+    typed = set()
+    for (name, labels), (buckets, counts, total, count) in histograms:
+        metric = PREFIX + name
+        if metric not in typed:
+            typed.add(metric)
+            lines.append("# TYPE {0} histogram".format(metric))
+        for bound, bucket_count in zip(buckets, counts):
+            lines.append("{0}_bucket{1} {2}".format(
+                metric, _format_labels(labels, le=bound), bucket_count
+            ))
+        lines.append("{0}_bucket{1} {2}".format(
+            metric, _format_labels(labels, le="+Inf"), count
+        ))
+        lines.append("{0}_sum{1} {2}".format(
+            metric, _format_labels(labels), total
+        ))
+        lines.append("{0}_count{1} {2}".format(
+            metric, _format_labels(labels), count
+        ))
+    for name, func in list(_gauges.items()):
+        for key, value in sorted(func().items()):
+            metric = "{0}{1}_{2}".format(PREFIX, name, key)
+            lines.append("# TYPE {0} gauge".format(metric))
+            lines.append("{0} {1}".format(metric, value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,211 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import io
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+from collections import Counter
+from collections import defaultdict
+from picopayments_hub import etc
+
+
+MODES = ["cprofile", "sample"]
+DEFAULT_METHODS = ["mph_sync", "mph_status", "cron.run_all"]
+DEFAULT_REQUESTS = 100  # if neither requests nor seconds given
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+
+
+_lock = threading.Lock()
+_session = None  # current or last profiling session
+
+
+def _collapse(frame):
+    """Stack of the frame in flamegraph collapsed format, root first."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("{0}:{1}".format(
+            os.path.basename(code.co_filename), code.co_name
+        ))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Session(object):
+
+    def __init__(self, mode, requests, seconds, methods, interval):
+        self.mode = mode
+        self.remaining = requests  # None for no limit
+        self.started = time.time()
+        self.deadline = self.started + seconds if seconds else None
+        self.methods = set(methods or DEFAULT_METHODS)
+        self.interval = interval
+        self.requests = Counter()  # method -> requests profiled
+        self.stats = {}  # method -> pstats.Stats
+        self.stacks = defaultdict(Counter)  # method -> stack -> samples
+        self.active = {}  # thread ident -> method, threads to sample
+        self.stopped = threading.Event()
+        if mode == "sample":
+            thread = threading.Thread(target=self._sample_loop)
+            thread.daemon = True
+            thread.start()
+
+    def finished(self):
+        if self.stopped.is_set():
+            return True
+        if self.deadline is not None and time.time() > self.deadline:
+            return True
+        return self.remaining is not None and self.remaining <= 0
+
+    def accept(self, method):
+        with _lock:
+            if method not in self.methods or self.finished():
+                return False
+            if self.remaining is not None:
+                self.remaining -= 1
+            self.requests[method] += 1
+            return True
+
+    def add_profile(self, method, profile):
+        with _lock:
+            if method in self.stats:
+                self.stats[method].add(profile)
+            else:
+                self.stats[method] = pstats.Stats(profile)
+
+    def _sample_loop(self):
+        while not (self.finished() and not self.active):
+            frames = sys._current_frames()
+            with _lock:
+                for ident, method in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.stacks[method][_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+
+def start(mode="cprofile", requests=None, seconds=None, methods=None,
+          interval=SAMPLE_INTERVAL):
+    """Profile the next requests of the given methods or a time window."""
+    global _session
+    if requests is None and seconds is None:
+        requests = DEFAULT_REQUESTS
+    with _lock:
+        if _session is not None:
+            _session.stopped.set()
+        _session = _Session(mode, requests, seconds, methods, interval)
+
+
+def stop():
+    session = _session
+    if session is not None:
+        session.stopped.set()
+
+
+@contextlib.contextmanager
+def request(method):
+    """Profile the json-rpc request or cron pass if a session wants it."""
+    session = _session
+    if session is None or not session.accept(method):
+        yield
+        return
+
+    if session.mode == "sample":
+        ident = threading.get_ident()
+        with _lock:
+            session.active[ident] = method
+        try:
+            yield
+        finally:
+            with _lock:
+                session.active.pop(ident, None)
+        return
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:  # another profiler active in this interpreter
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        session.add_profile(method, profile)
+
+
+def _pstats_text(stats, limit):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def _collapsed_text(stacks):
+    return "\n".join("{0} {1}".format(stack, samples)
+                     for stack, samples in sorted(stacks.items()))
+
+
+def results(limit=50):
+    """Aggregated profiles of the current or last session."""
+    session = _session
+    if session is None:
+        return None
+    with _lock:
+        result = {
+            "mode": session.mode,
+            "started": session.started,
+            "finished": session.finished(),
+            "methods": sorted(session.methods),
+            "requests": dict(session.requests),
+        }
+        if session.mode == "cprofile":
+            result["pstats"] = {
+                method: _pstats_text(stats, limit)
+                for method, stats in session.stats.items()
+            }
+        else:
+            result["collapsed"] = {
+                method: _collapsed_text(stacks)
+                for method, stacks in session.stacks.items()
+            }
+    return result
+
+
+def _filename(method, extension):
+    """File name of a method, cannot leave the profiles directory."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", method) + extension
+
+
+def save():
+    """Save profiles to basedir/profiles, pstats or collapsed stacks."""
+    session = _session
+    if session is None:
+        return []
+    dirname = os.path.join(etc.basedir, "profiles",
+                           str(int(session.started)))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    paths = []
+    with _lock:
+        if session.mode == "cprofile":
+            for method, stats in session.stats.items():
+                path = os.path.join(dirname, _filename(method, ".pstats"))
+                stats.dump_stats(path)
+                paths.append(path)
+        else:
+            for method, stacks in session.stacks.items():
+                path = os.path.join(dirname,
+                                    _filename(method, ".collapsed"))
+                with open(path, "w") as fp:
+                    fp.write(_collapsed_text(stacks) + "\n")
+                paths.append(path)
+    return paths
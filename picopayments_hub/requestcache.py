@@ -0,0 +1,85 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import json
+import time
+import hashlib
+import threading
+from picopayments_hub import etc
+from picopayments_hub import sql
+from picopayments_hub import metrics
+
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+_cached_response = sql.make_fetchone("cached_response")
+_add_cached_response = sql.make_execute("add_cached_response")
+_prune_cached_responses = sql.make_execute("prune_cached_responses")
+
+
+def key(kwargs):
+    """Cache key of a request, None if it is not signed for a handle.
+
+    Must be taken before processing as it may modify the arguments.
+    """
+    handle = kwargs.get("handle")
+    signature = kwargs.get("signature")
+    if not isinstance(handle, str) or not isinstance(signature, str):
+        return None  # rejected by verification
+    data = json.dumps(kwargs, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    return {"handle": handle, "signature": signature, "digest": digest}
+
+
+def _expired():
+    return int(time.time()) - etc.request_cache_window
+
+
+def get(key, cursor=None):
+    """Signed response of an identical request made within the window.
+
+    Looked up by handle and client signature, the digest of the whole
+    request must match too as only the original request was verified.
+    """
+    row = None
+    if key is not None and etc.request_cache_size:
+        row = _cached_response(handle=key["handle"],
+                               signature=key["signature"],
+                               expired=_expired(), cursor=cursor)
+    if row is not None and row["digest"] != key["digest"]:
+        row = None
+    with _lock:
+        _stats["hits" if row is not None else "misses"] += 1
+    return json.loads(row["response"]) if row is not None else None
+
+
+def put(method, key, response, cursor=None):
+    """Store signed response as part of the open transaction."""
+    if key is None or not etc.request_cache_size:
+        return
+    _prune_cached_responses(expired=_expired(),
+                            size=etc.request_cache_size, cursor=cursor)
+    _add_cached_response(method=method, response=json.dumps(response),
+                         cursor=cursor, **key)
+
+
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+def clear():
+    with _lock:
+        _stats["hits"] = 0
+        _stats["misses"] = 0
+
+
+metrics.register_gauges("request_cache", stats)
@@ -0,0 +1,173 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import os
+import json
+import time
+import socket
+from micropayment_core import util
+from picopayments_hub import etc
+from picopayments_hub import err
+from picopayments_hub import sql
+from picopayments_hub import metrics
+
+
+OWNER = "{0}:{1}:{2}".format(  # leases
+    socket.gethostname(), os.getpid(), util.b2h(os.urandom(8))
+)
+
+_cron_job = sql.make_fetchone("cron_job")
+_acquire_cron_job = sql.make_execute("acquire_cron_job")
+_take_over_cron_job = sql.make_execute("take_over_cron_job")
+_release_cron_jobs = sql.make_execute("release_cron_jobs")
+_save_cron_job = sql.make_execute("save_cron_job")
+_cron_job_outputs = sql.make_fetchall("cron_job_outputs")
+_add_cron_job_output = sql.make_execute("add_cron_job_output")
+_rm_cron_job_outputs = sql.make_execute("rm_cron_job_outputs")
+
+
+class Job(object):
+    """Checkpointed progress of a cron job pass.
+
+    A pass interrupted by a restart or deferred by the budget is resumed
+    by the next one, together with the outputs recorded so far. Outputs
+    are stored per connection, a checkpoint only adds its own.
+
+    Jobs are leased to the process running them, see acquire.
+    """
+
+    def __init__(self, name, cursor=None):
+        self.name = name
+        self.cursor = cursor or sql.get_cursor()
+        acquire([name], cursor=self.cursor)
+        state = _cron_job(name=name, cursor=self.cursor)
+        self.running = state is not None and state["running"] == 1
+        self.position = state["position"] if state is not None else 0
+        self.outputs = []
+        if self.running:
+            self.outputs = [
+                json.loads(row["output"])
+                for row in _cron_job_outputs(job=name, cursor=self.cursor)
+            ]
+
+    def _save(self):
+        _save_cron_job(name=self.name, position=self.position,
+                       running=int(self.running), owner=OWNER,
+                       expires=int(time.time()) + etc.cron_lease,
+                       cursor=self.cursor)
+
+    def checkpoint(self, connection, output=None):
+        """Record connection as processed and its output if not None,
+        call in its transaction."""
+        if not is_urgent(connection):
+            self.position = connection["id"]
+        self.running = True
+        self._save()
+        if output is not None:
+            _add_cron_job_output(job=self.name, output=json.dumps(output),
+                                 cursor=self.cursor)
+            self.outputs.append(output)
+
+    def finish(self):
+        """Record the pass as complete, the next one starts over."""
+        if self.running:
+            with etc.database_lock:
+                sql.end_batch()  # commit on our own
+                self.position = 0
+                self.running = False
+                self._save()
+                _rm_cron_job_outputs(job=self.name, cursor=self.cursor)
+
+
+def acquire(names, cursor=None):
+    """Lease jobs to this process, renewed by checkpoints.
+
+    Raises err.CronJobLeased if another process holds an unexpired lease,
+    so run_job and a serving hub never run cron jobs at the same time.
+    Leases of crashed processes on this host are taken over right away.
+    """
+    with etc.database_lock:
+        sql.end_batch()  # commit on our own
+        cursor = cursor or sql.get_cursor()
+        now = int(time.time())
+        for name in names:
+            _acquire_cron_job(name=name, owner=OWNER, now=now,
+                              expires=now + etc.cron_lease, cursor=cursor)
+            if cursor.getconnection().changes():
+                continue
+            previous = _cron_job(name=name, cursor=cursor)["lease_owner"]
+            if _is_dead(previous):
+                _take_over_cron_job(name=name, owner=OWNER,
+                                    previous=previous,
+                                    expires=now + etc.cron_lease,
+                                    cursor=cursor)
+            if not cursor.getconnection().changes():
+                raise err.CronJobLeased(name)
+
+
+def _is_dead(owner):
+    """Lease owner is a process on this host that no longer runs."""
+    try:
+        host, pid, nonce = owner.split(":")
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False  # unknown owner, wait for lease to expire
+    if os.name != "posix" or host != socket.gethostname():
+        return False
+    if pid == os.getpid():
+        return True  # owner was an earlier process with our pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass  # exists but not ours
+    return False
+
+
+def release(cursor=None):
+    """Release the jobs leased to this process."""
+    with etc.database_lock:
+        sql.end_batch()  # commit on our own
+        _release_cron_jobs(owner=OWNER, cursor=cursor)
+
+
+def is_urgent(connection):
+    """Deposit expires, or funds of a closed connection must be recovered,
+    within etc.cron_urgent_ttl blocks."""
+    ttl = connection.get("ttl")
+    return ttl is not None and ttl <= etc.cron_urgent_ttl
+
+
+def order(connections, after=0):
+    """Urgent connections nearest deadline first (as given, see
+    hub_connections_complete), then the others by id not yet processed
+    in turn by the pass, i.e. after the given position."""
+    urgent = [c for c in connections if is_urgent(c)]
+    others = sorted([c for c in connections
+                     if not is_urgent(c) and c["id"] > after],
+                    key=lambda c: c["id"])
+    return urgent + others
+
+
+def scheduled(job, connections, budget=None):
+    """Yield connections of the jobs pass until the budget is spent.
+
+    At least one connection is processed per call, each must be
+    checkpointed by the caller. The pass is finished once all were.
+    """
+    budget = etc.cron_pass_budget if budget is None else budget
+    ordered = order(connections, job.position)
+    stop = time.perf_counter() + budget
+    for index, connection in enumerate(ordered):
+        if index and budget and time.perf_counter() >= stop:
+            deferred = len(ordered) - index
+            metrics.observe("cron_deferred_connections", deferred,
+                            buckets=metrics.COUNT_BUCKETS, job=job.name)
+            return
+        yield connection
+    job.finish()
+    metrics.observe("cron_deferred_connections", 0,
+                    buckets=metrics.COUNT_BUCKETS, job=job.name)
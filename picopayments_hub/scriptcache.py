@@ -0,0 +1,98 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import threading
+from collections import OrderedDict
+from micropayment_core import util
+from micropayment_core import scripts
+from picopayments_hub import etc
+from picopayments_hub import metrics
+
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # (kind, netcode, script hex) -> data, lru first
+_stats = {"hits": 0, "misses": 0}
+
+
+def _parse_deposit(script):
+    return {
+        "payer_pubkey": scripts.get_deposit_payer_pubkey(script),
+        "payee_pubkey": scripts.get_deposit_payee_pubkey(script),
+        "expire_time": scripts.get_deposit_expire_time(script),
+        "spend_secret_hash": scripts.get_deposit_spend_secret_hash(script),
+        "address": util.script_address(script, netcode=etc.netcode),
+    }
+
+
+def _parse_commit(script):
+    return {
+        "delay_time": scripts.get_commit_delay_time(script),
+        "revoke_secret_hash": scripts.get_commit_revoke_secret_hash(script),
+        "address": util.script_address(script, netcode=etc.netcode),
+    }
+
+
+def _parse_address(script):
+    return {"address": util.script_address(script, netcode=etc.netcode)}
+
+
+_PARSERS = {
+    "deposit": _parse_deposit,
+    "commit": _parse_commit,
+    "address": _parse_address,
+}
+
+
+def _get(kind, script):
+    key = (kind, etc.netcode, script)
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return data
+        _stats["misses"] += 1
+
+    data = _PARSERS[kind](script)  # parse outside lock, may raise
+    with _lock:
+        _cache[key] = data
+        while len(_cache) > etc.script_cache_size:
+            _cache.popitem(last=False)
+    return data
+
+
+def deposit(script):
+    """Pubkeys, expire time, spend secret hash and address of a deposit."""
+    return _get("deposit", script)
+
+
+def commit(script):
+    """Delay time, revoke secret hash and address of a commit script."""
+    return _get("commit", script)
+
+
+def address(script):
+    return _get("address", script)["address"]
+
+
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+            "size": len(_cache),
+        }
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+        _stats["hits"] = 0
+        _stats["misses"] = 0
+
+
+metrics.register_gauges("script_cache", stats)
@@ -4,28 +4,266 @@
 
 
 import os
+import time
+import apsw
+import queue
+import threading
+import contextlib
 import pkg_resources
 from picopayments_hub import etc
+from picopayments_hub import metrics
+from picopayments_hub import trace
+
+
+_READERS = queue.Queue()  # idle read only connections
+_BATCH = None  # open group commit batch, guarded by etc.database_lock
+_NAMES = {}  # script -> name, to label query metrics
+_SAVEPOINT_ROLLBACK_HOOKS = []  # called after a savepoint was rolled back
+_COMMITTED_HOOKS = []  # called after a commit returned
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+# arguments stored as blobs, see migration_8
+HEX_ARGS = frozenset([
+    "handle", "payer_handle", "payee_handle", "after", "token",
+    "hash", "secret_hash", "secret_value", "h2c_spend_secret_hash",
+    "hub_pubkey", "client_pubkey", "h2c_deposit_script",
+    "c2h_deposit_script", "script", "rawtx", "revoke_secret",
+    "revoke_secret_hash", "next_revoke_secret_hash", "signature", "digest",
+    "txid",
+])
+
+
+def hex_to_blob(value):
+    """Lowercase even length hex as bytes, anything else is unchanged.
+
+    Only canonical hex is converted so every value reads back as written.
+    """
+    if (isinstance(value, str) and len(value) % 2 == 0 and
+            _HEX_DIGITS.issuperset(value)):
+        return bytes.fromhex(value)
+    return value
+
+
+def blob_to_hex(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def _hex_args(args):
+    if not isinstance(args, dict):
+        return args
+    return {
+        k: hex_to_blob(v) if k in HEX_ARGS else v for k, v in args.items()
+    }
 
 
 def _row_to_dict_factory(cursor, row):
-    return {k[0]: row[i] for i, k in enumerate(cursor.getdescription())}
+    return {
+        k[0]: blob_to_hex(row[i])
+        for i, k in enumerate(cursor.getdescription())
+    }
 
 
 def get_cursor():
     return etc.database_connection.cursor()
 
 
+def close_readers():
+    """Close idle read only connections, i.e. after changing database."""
+    while not _READERS.empty():
+        _READERS.get_nowait().close()
+
+
+def _get_reader():
+    try:
+        return _READERS.get_nowait()
+    except queue.Empty:
+        flags = apsw.SQLITE_OPEN_READONLY
+        return apsw.Connection(etc.database_path, flags=flags)
+
+
+def _put_reader(connection):
+    if _READERS.qsize() < etc.database_readers:
+        _READERS.put(connection)
+    else:
+        connection.close()
+
+
+@contextlib.contextmanager
+def read_cursor():
+    """Cursor of a pooled read only connection.
+
+    All reads within the context see the same consistent snapshot and
+    do not wait for writers on the main connection (requires WAL mode).
+    """
+    connection = _get_reader()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("BEGIN;")
+        try:
+            yield cursor
+        finally:
+            cursor.execute("COMMIT;")
+    finally:
+        _put_reader(connection)
+
+
+@contextlib.contextmanager
+def transaction(cursor=None):
+    """Nestable transaction, joins the open group commit batch if any."""
+    cursor = cursor or get_cursor()
+    cursor.execute("SAVEPOINT tx;")
+    try:
+        yield cursor
+    except Exception:
+        cursor.execute("ROLLBACK TO tx;")
+        for hook in _SAVEPOINT_ROLLBACK_HOOKS:
+            hook()  # before RELEASE, it commits if outermost
+        cursor.execute("RELEASE tx;")
+        _committed(cursor)
+        raise
+    cursor.execute("RELEASE tx;")
+    _committed(cursor)
+
+
+def add_savepoint_rollback_hook(func):
+    """Full rollbacks are reported by the connection rollback hook."""
+    if func not in _SAVEPOINT_ROLLBACK_HOOKS:
+        _SAVEPOINT_ROLLBACK_HOOKS.append(func)
+
+
+def add_committed_hook(func):
+    """Unlike the connection commit hook, called once readers see the
+    commit, i.e. after COMMIT or an autocommit write returned."""
+    if func not in _COMMITTED_HOOKS:
+        _COMMITTED_HOOKS.append(func)
+
+
+def _committed(cursor):
+    if cursor.getconnection().getautocommit():
+        for hook in _COMMITTED_HOOKS:
+            hook()
+
+
+class _Batch(object):
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.has_leader = False
+        self.error = None
+        self.done = threading.Event()
+
+    def commit(self):
+        global _BATCH
+        with etc.database_lock:
+            if self.done.is_set():
+                return
+            if _BATCH is self:
+                _BATCH = None
+            try:
+                self.cursor.execute("COMMIT;")
+                _committed(self.cursor)
+            except Exception as e:
+                self.error = e
+                if not self.cursor.getconnection().getautocommit():
+                    self.cursor.execute("ROLLBACK;")
+            finally:
+                self.done.set()
+
+
+class Ack(object):
+    """Durability acknowledgement for writes made in a group commit."""
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.leader = False
+
+    def wait(self):
+        """Block until the writes are committed, must not hold the lock."""
+        if self.leader and not self.batch.done.is_set():
+            time.sleep(etc.group_commit_window)  # let others join batch
+            self.batch.commit()
+        self.batch.done.wait()
+        if self.batch.error is not None:
+            raise self.batch.error
+
+
+@contextlib.contextmanager
+def group_commit(cursor=None):
+    """Make writes part of a batch committed once per batching window.
+
+    Must be entered holding etc.database_lock. Failed writes are rolled
+    back without affecting the rest of the batch. The yielded Ack must be
+    waited on after releasing the lock, before reporting success.
+
+    Any write on the connection while a batch is open joins it, writers
+    outside of requests call end_batch first to commit on their own.
+    """
+    global _BATCH
+    cursor = cursor or get_cursor()
+    if _BATCH is None:
+        cursor.execute("BEGIN;")
+        _BATCH = _Batch(cursor)
+    batch = _BATCH
+    ack = Ack(batch)
+    try:
+        with transaction(cursor):
+            yield ack
+    except Exception:
+        if not batch.has_leader:
+            batch.commit()  # nobody else will end the batch
+        raise
+
+    # first to succeed commits the batch when the window closes
+    if not batch.has_leader:
+        batch.has_leader = True
+        ack.leader = True
+    if not etc.group_commit_window:
+        batch.commit()
+
+
+def end_batch():
+    """Commit the open group commit batch early, must hold the lock.
+
+    Later writes autocommit instead of depending on the batch leader.
+    Waiting requests of the batch are acknowledged as usual.
+    """
+    batch = _BATCH
+    if batch is not None:
+        batch.commit()
+
+
 def load(script_name):
     sql_path = os.path.join("sql", "{0}.sql".format(script_name))
     script = pkg_resources.resource_stream("picopayments_hub", sql_path).read()
-    return script.decode("utf-8")
+    script = script.decode("utf-8")
+    _NAMES[script] = script_name
+    return script
+
+
+@contextlib.contextmanager
+def _instrument(script):
+    name = _NAMES.get(script, "adhoc")
+    with trace.span("sql", query=name):
+        with metrics.timer("query_seconds", query=name):
+            yield
 
 
 def execute(script, args=None, cursor=None):
     """Execute script"""
     cursor = cursor or get_cursor()
-    cursor.execute(script, args)
+    with _instrument(script):
+        cursor.execute(script, _hex_args(args))
+    _committed(cursor)
+
+
+def executemany(script, args_list, cursor=None):
+    """Execute script once for every args in args_list."""
+    cursor = cursor or get_cursor()
+    with _instrument(script):
+        cursor.executemany(script, [_hex_args(a) for a in args_list])
+    _committed(cursor)
 
 
 def make_execute(script_name):
@@ -41,7 +279,8 @@ def fetchone(script, args=None, cursor=None, getsum=False):
     """Execute script and fetch one row."""
     cursor = cursor or get_cursor()
     cursor.setrowtrace(_row_to_dict_factory)
-    result = cursor.execute(script, args).fetchone()
+    with _instrument(script):
+        result = cursor.execute(script, _hex_args(args)).fetchone()
     if getsum:
         return result["sum"] if result else 0
     return result
@@ -60,7 +299,8 @@ def fetchall(script, args=None, cursor=None):
     """Execute script and fetch all rows."""
     cursor = cursor or get_cursor()
     cursor.setrowtrace(_row_to_dict_factory)
-    return cursor.execute(script, args).fetchall()
+    with _instrument(script):
+        return cursor.execute(script, _hex_args(args)).fetchall()
 
 
 def make_fetchall(script_name):
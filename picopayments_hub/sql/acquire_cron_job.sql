@@ -0,0 +1,5 @@
+INSERT OR IGNORE INTO CronJob (name) VALUES (:name);
+UPDATE CronJob SET lease_owner = :owner, lease_expires = :expires
+WHERE name = :name AND (
+    lease_owner IS NULL OR lease_owner = :owner OR lease_expires < :now
+);
@@ -0,0 +1,6 @@
+-- same txid is only queued once
+INSERT OR IGNORE INTO BroadcastQueue (
+    txid, rawtx, kind, handle
+) VALUES (
+    :txid, :rawtx, :kind, :handle
+);
@@ -0,0 +1,5 @@
+INSERT OR REPLACE INTO RequestCache (
+    method, handle, signature, digest, response
+) VALUES (
+    :method, :handle, :signature, :digest, :response
+);
@@ -0,0 +1,5 @@
+INSERT INTO ChannelEvent (
+    channel_id, handle, kind, data
+) VALUES (
+    :channel_id, :handle, :kind, :data
+);
@@ -0,0 +1,5 @@
+INSERT INTO ChannelSnapshot (
+    channel_id, event_id, state
+) VALUES (
+    :channel_id, :event_id, :state
+);
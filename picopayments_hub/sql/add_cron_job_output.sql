@@ -0,0 +1 @@
+INSERT INTO CronJobOutput (job, output) VALUES (:job, :output);
@@ -0,0 +1 @@
+UPDATE HubConnection SET sync_fees = sync_fees + :amount WHERE handle = :handle;
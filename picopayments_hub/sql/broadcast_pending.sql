@@ -0,0 +1,4 @@
+SELECT EXISTS(
+    SELECT * FROM BroadcastQueue
+    WHERE handle = :handle AND kind = :kind AND status = 'pending'
+) AS pending;
@@ -0,0 +1,2 @@
+SELECT status, count(*) AS count FROM BroadcastQueue
+WHERE status IN ('pending', 'published', 'failed') GROUP BY status;
@@ -0,0 +1,4 @@
+SELECT EXISTS(
+    SELECT * FROM BroadcastQueue
+    WHERE handle = :handle AND status IN ('pending', 'published')
+) AS unconfirmed;
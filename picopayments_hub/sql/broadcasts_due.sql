@@ -0,0 +1,3 @@
+SELECT id, txid, rawtx, status, attempts, confirmations FROM BroadcastQueue
+WHERE status IN ('pending', 'published') AND next_attempt <= :now
+ORDER BY next_attempt, id LIMIT :limit;
@@ -0,0 +1,2 @@
+SELECT rawtx FROM BroadcastQueue
+WHERE kind = :kind AND status IN ('pending', 'published');
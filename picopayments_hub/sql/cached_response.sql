@@ -0,0 +1,3 @@
+SELECT digest, response FROM RequestCache
+WHERE handle = :handle AND signature = :signature
+    AND unixtimestamp >= :expired;
@@ -0,0 +1,3 @@
+SELECT id, channel_id, handle, kind, data, unixtimestamp FROM ChannelEvent
+WHERE channel_id = :channel_id AND id > :after AND id <= :until
+ORDER BY id;
@@ -0,0 +1,7 @@
+-- latest snapshot of a channel and the number of events since
+SELECT event_id, (
+    SELECT count(*) FROM ChannelEvent
+    WHERE channel_id = :channel_id AND id > ChannelSnapshot.event_id
+) AS count
+FROM ChannelSnapshot WHERE channel_id = :channel_id
+ORDER BY event_id DESC LIMIT 1;
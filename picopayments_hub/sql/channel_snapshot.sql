@@ -0,0 +1,3 @@
+SELECT event_id, state FROM ChannelSnapshot
+WHERE channel_id = :channel_id AND event_id <= :until
+ORDER BY event_id DESC LIMIT 1;
@@ -0,0 +1 @@
+UPDATE HubConnection SET rebalance_pending_since = NULL WHERE handle = :handle;
@@ -0,0 +1 @@
+SELECT * FROM CommitActive WHERE id = :id;
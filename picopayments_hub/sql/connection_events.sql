@@ -0,0 +1,3 @@
+SELECT id, channel_id, handle, kind, data, unixtimestamp FROM ChannelEvent
+WHERE handle = :handle AND id > :after AND id <= :until
+ORDER BY id;
@@ -0,0 +1,2 @@
+SELECT handle, asset, balance, ttl, status FROM ConnectionStatus
+WHERE handle > :after ORDER BY handle LIMIT :limit;
@@ -0,0 +1 @@
+SELECT * FROM CronJob WHERE name = :name;
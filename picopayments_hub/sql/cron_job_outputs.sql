@@ -0,0 +1 @@
+SELECT output FROM CronJobOutput WHERE job = :job ORDER BY id;
@@ -1 +1,16 @@
-SELECT * FROM HubConnection WHERE complete > 0;
+-- nearest deadline first in blocks, the deposit expiry of open connections
+-- and the recovery deadline of closed ones, fully recovered are done
+SELECT * FROM (
+    SELECT HubConnection.*, CASE
+        WHEN HubConnection.closed != 0
+        THEN (ConnectionRecovery.deadline - :now) / :block_time
+        ELSE ConnectionStatus.ttl
+    END AS ttl
+    FROM HubConnection
+    LEFT JOIN ConnectionStatus
+        ON ConnectionStatus.handle = HubConnection.handle
+    LEFT JOIN ConnectionRecovery
+        ON ConnectionRecovery.handle = HubConnection.handle
+    WHERE HubConnection.complete > 0
+        AND coalesce(ConnectionRecovery.recovered, 0) = 0
+) ORDER BY ttl IS NULL, ttl, id;
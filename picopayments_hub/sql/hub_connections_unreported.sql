@@ -0,0 +1,5 @@
+-- open connections without materialized status, i.e. before migration_5
+SELECT HubConnection.* FROM HubConnection
+LEFT JOIN ConnectionStatus ON ConnectionStatus.handle = HubConnection.handle
+WHERE HubConnection.complete != 0 AND HubConnection.closed = 0
+    AND ConnectionStatus.id IS NULL;
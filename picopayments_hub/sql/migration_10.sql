@@ -0,0 +1,18 @@
+BEGIN TRANSACTION;
+
+-- signed responses of state changing requests, returned again for retries
+
+CREATE TABLE RequestCache(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    method                      TEXT NOT NULL,
+    handle                      TEXT NOT NULL,          -- hex
+    signature                   TEXT NOT NULL,          -- hex
+    digest                      TEXT NOT NULL,          -- hex, sha256
+    response                    TEXT NOT NULL,          -- json
+    unixtimestamp               timestamp default (strftime('%s', 'now'))
+);
+
+CREATE UNIQUE INDEX RequestCacheSignature ON RequestCache(handle, signature);
+CREATE INDEX RequestCacheTimestamp ON RequestCache(unixtimestamp);
+
+COMMIT;
@@ -0,0 +1,25 @@
+BEGIN TRANSACTION;
+
+-- outbound transactions, published with retries by broadcast workers
+
+CREATE TABLE BroadcastQueue(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    txid                        TEXT NOT NULL UNIQUE,   -- hex
+    rawtx                       TEXT NOT NULL,          -- hex
+    kind                        TEXT NOT NULL,          -- deposit, commit,
+                                                        -- recover
+    handle                      TEXT,                   -- hex
+    status                      TEXT NOT NULL DEFAULT 'pending',
+                                                        -- pending, published,
+                                                        -- confirmed, failed
+    attempts                    INTEGER NOT NULL DEFAULT 0,
+    confirmations               INTEGER NOT NULL DEFAULT 0,
+    next_attempt                INTEGER NOT NULL DEFAULT 0, -- unixtimestamp
+    last_error                  TEXT,
+    unixtimestamp               timestamp default (strftime('%s', 'now'))
+);
+
+CREATE INDEX BroadcastQueueDue ON BroadcastQueue(status, next_attempt);
+CREATE INDEX BroadcastQueueHandle ON BroadcastQueue(handle, kind, status);
+
+COMMIT;
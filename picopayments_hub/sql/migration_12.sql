@@ -0,0 +1,16 @@
+BEGIN TRANSACTION;
+
+-- progress of cron job passes, interrupted passes are resumed
+
+CREATE TABLE CronJob(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    name                        TEXT NOT NULL UNIQUE,
+    position                    INTEGER NOT NULL DEFAULT 0, -- id of the last
+                                                        -- connection processed
+                                                        -- in turn
+    running                     INTEGER NOT NULL DEFAULT 0, -- pass unfinished
+    outputs                     TEXT,                   -- json, of the pass
+    unixtimestamp               timestamp default (strftime('%s', 'now'))
+);
+
+COMMIT;
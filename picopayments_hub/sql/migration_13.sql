@@ -0,0 +1,21 @@
+BEGIN TRANSACTION;
+
+-- recovery of closed connections, see set_connection_closed
+
+CREATE TABLE ConnectionRecovery(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    handle                      TEXT NOT NULL UNIQUE,   -- hex
+    deadline                    INTEGER,                -- unixtimestamp, funds
+                                                        -- at risk after it
+    recovered                   INTEGER NOT NULL DEFAULT 0, -- nothing left
+    unixtimestamp               timestamp default (strftime('%s', 'now')),
+
+    FOREIGN KEY(handle) REFERENCES HubConnection(handle)
+);
+
+-- deadlines of connections closed before are unknown, checked first
+INSERT INTO ConnectionRecovery (handle, deadline)
+SELECT handle, CAST(strftime('%s', 'now') AS INTEGER)
+FROM HubConnection WHERE closed != 0;
+
+COMMIT;
@@ -0,0 +1,17 @@
+BEGIN TRANSACTION;
+
+-- outputs of cron job passes, one row per processed connection
+
+CREATE TABLE CronJobOutput(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    job                         TEXT NOT NULL,          -- CronJob name
+    output                      TEXT NOT NULL,          -- json
+    unixtimestamp               timestamp default (strftime('%s', 'now'))
+);
+
+CREATE INDEX CronJobOutputJob ON CronJobOutput(job, id);
+
+-- outputs of interrupted passes cannot be split, such passes start over
+UPDATE CronJob SET position = 0, running = 0, outputs = NULL;
+
+COMMIT;
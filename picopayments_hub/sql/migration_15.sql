@@ -0,0 +1,8 @@
+BEGIN TRANSACTION;
+
+-- cron jobs run by one process at a time, the hub or run_job
+
+ALTER TABLE CronJob ADD COLUMN lease_owner TEXT;
+ALTER TABLE CronJob ADD COLUMN lease_expires INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
@@ -0,0 +1,19 @@
+BEGIN TRANSACTION;
+
+-- materialized connection status, kept up to date by syncs and cron
+
+CREATE TABLE ConnectionStatus(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    handle                      TEXT NOT NULL UNIQUE,   -- hex
+    asset                       TEXT NOT NULL,
+    balance                     INTEGER NOT NULL,       -- satoshis
+    ttl                         INTEGER,                -- blocks
+    status                      TEXT NOT NULL,
+    unixtimestamp               timestamp default (strftime('%s', 'now')),
+
+    FOREIGN KEY(handle) REFERENCES HubConnection(handle)
+);
+
+CREATE INDEX ConnectionStatusAsset ON ConnectionStatus(asset, handle);
+
+COMMIT;
@@ -0,0 +1,14 @@
+BEGIN TRANSACTION;
+
+-- account sync fees per connection instead of one payment per sync
+
+ALTER TABLE HubConnection ADD COLUMN sync_fees INTEGER NOT NULL DEFAULT 0;
+
+UPDATE HubConnection SET sync_fees = coalesce((
+    SELECT sum(amount) FROM Payment
+    WHERE payer_handle = HubConnection.handle AND payee_handle IS NULL
+), 0);
+
+DELETE FROM Payment WHERE payee_handle IS NULL;
+
+COMMIT;
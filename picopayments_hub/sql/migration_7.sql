@@ -0,0 +1,6 @@
+BEGIN TRANSACTION;
+
+-- time since hub to client funds were deferred by the rebalancing policy
+ALTER TABLE HubConnection ADD COLUMN rebalance_pending_since INTEGER DEFAULT NULL;
+
+COMMIT;
@@ -0,0 +1,45 @@
+BEGIN TRANSACTION;
+
+-- HubConnection.handle is referenced by ConnectionStatus.handle
+PRAGMA defer_foreign_keys = ON;
+
+-- store hex columns as blobs, half the size on disk, in cache and in indexes
+-- hex_to_blob only converts lowercase hex, other values are kept as text
+-- values are converted back to hex when read (see sql.py)
+
+UPDATE Secrets SET
+    hash = hex_to_blob(hash),
+    value = hex_to_blob(value);
+
+UPDATE CommitRequested SET
+    revoke_secret_hash = hex_to_blob(revoke_secret_hash);
+
+UPDATE CommitActive SET
+    rawtx = hex_to_blob(rawtx),
+    script = hex_to_blob(script),
+    revoke_secret_hash = hex_to_blob(revoke_secret_hash);
+
+UPDATE CommitRevoked SET
+    script = hex_to_blob(script),
+    revoke_secret = hex_to_blob(revoke_secret);
+
+UPDATE Payment SET
+    payer_handle = hex_to_blob(payer_handle),
+    payee_handle = hex_to_blob(payee_handle),
+    token = hex_to_blob(token);
+
+UPDATE MicropaymentChannel SET
+    deposit_script = hex_to_blob(deposit_script),
+    payee_pubkey = hex_to_blob(payee_pubkey),
+    payer_pubkey = hex_to_blob(payer_pubkey),
+    spend_secret_hash = hex_to_blob(spend_secret_hash),
+    handle = hex_to_blob(handle);
+
+UPDATE HubConnection SET
+    handle = hex_to_blob(handle),
+    next_revoke_secret_hash = hex_to_blob(next_revoke_secret_hash);
+
+UPDATE ConnectionStatus SET
+    handle = hex_to_blob(handle);
+
+COMMIT;
@@ -0,0 +1,34 @@
+BEGIN TRANSACTION;
+
+-- append only journal of channel state transitions and payments
+-- CommitRequested, CommitActive and CommitRevoked rows can be rebuilt from it
+
+CREATE TABLE ChannelEvent(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    channel_id                  INTEGER,                -- NULL -> connection
+    handle                      TEXT,                   -- hex
+    kind                        TEXT NOT NULL,
+    data                        TEXT NOT NULL,          -- json
+    unixtimestamp               timestamp default (strftime('%s', 'now')),
+
+    FOREIGN KEY(channel_id) REFERENCES MicropaymentChannel(id)
+);
+
+CREATE INDEX ChannelEventChannel ON ChannelEvent(channel_id, id);
+CREATE INDEX ChannelEventHandle ON ChannelEvent(handle, id);
+
+-- replayed channel state, events after event_id are applied on top
+
+CREATE TABLE ChannelSnapshot(
+    id                          INTEGER NOT NULL PRIMARY KEY,
+    channel_id                  INTEGER NOT NULL,
+    event_id                    INTEGER NOT NULL,       -- last applied
+    state                       TEXT NOT NULL,          -- json
+    unixtimestamp               timestamp default (strftime('%s', 'now')),
+
+    FOREIGN KEY(channel_id) REFERENCES MicropaymentChannel(id)
+);
+
+CREATE INDEX ChannelSnapshotChannel ON ChannelSnapshot(channel_id, event_id);
+
+COMMIT;
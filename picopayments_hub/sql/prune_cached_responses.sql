@@ -0,0 +1,4 @@
+DELETE FROM RequestCache
+WHERE unixtimestamp < :expired OR id <= (
+    SELECT max(id) FROM RequestCache
+) - :size;
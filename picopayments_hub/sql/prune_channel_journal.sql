@@ -0,0 +1,9 @@
+-- events and snapshots before the oldest kept snapshot are not needed
+DELETE FROM ChannelEvent WHERE channel_id = :channel_id AND id <= (
+    SELECT event_id FROM ChannelSnapshot WHERE channel_id = :channel_id
+    ORDER BY event_id DESC LIMIT 1 OFFSET :offset
+);
+DELETE FROM ChannelSnapshot WHERE channel_id = :channel_id AND event_id < (
+    SELECT event_id FROM ChannelSnapshot WHERE channel_id = :channel_id
+    ORDER BY event_id DESC LIMIT 1 OFFSET :offset
+);
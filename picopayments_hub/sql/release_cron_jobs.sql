@@ -0,0 +1,2 @@
+UPDATE CronJob SET lease_owner = NULL, lease_expires = 0
+WHERE lease_owner = :owner;
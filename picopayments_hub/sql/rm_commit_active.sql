@@ -0,0 +1 @@
+DELETE FROM CommitActive WHERE channel_id = :channel_id AND script = :script;
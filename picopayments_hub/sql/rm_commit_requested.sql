@@ -0,0 +1,2 @@
+DELETE FROM CommitRequested
+WHERE channel_id = :channel_id AND revoke_secret_hash = :revoke_secret_hash;
@@ -0,0 +1 @@
+DELETE FROM CommitRevoked WHERE channel_id = :channel_id AND script = :script;
@@ -0,0 +1 @@
+DELETE FROM CronJobOutput WHERE job = :job;
@@ -0,0 +1,5 @@
+INSERT OR REPLACE INTO ConnectionStatus (
+    handle, asset, balance, ttl, status
+) VALUES (
+    :handle, :asset, :balance, :ttl, :status
+);
@@ -0,0 +1,6 @@
+INSERT OR IGNORE INTO CronJob (name) VALUES (:name);
+UPDATE CronJob
+SET position = :position, running = :running,
+    lease_owner = :owner, lease_expires = :expires,
+    unixtimestamp = strftime('%s', 'now')
+WHERE name = :name;
@@ -1,2 +1,6 @@
-SELECT sum(amount) AS 'sum' FROM Payment 
-WHERE payer_handle = :handle GROUP BY payer_handle;
+-- payments sent to other connections and sync fees paid to the hub
+SELECT coalesce((
+    SELECT sum(amount) FROM Payment WHERE payer_handle = :handle
+), 0) + coalesce((
+    SELECT sync_fees FROM HubConnection WHERE handle = :handle
+), 0) AS 'sum';
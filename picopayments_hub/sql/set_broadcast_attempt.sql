@@ -0,0 +1,3 @@
+-- lease, unless another worker claimed it meanwhile
+UPDATE BroadcastQueue SET next_attempt = :next_attempt
+WHERE id = :id AND next_attempt <= :now;
@@ -0,0 +1,7 @@
+UPDATE BroadcastQueue SET
+    status = :status,
+    attempts = :attempts,
+    confirmations = :confirmations,
+    next_attempt = :next_attempt,
+    last_error = :last_error
+WHERE id = :id;
@@ -1 +1,16 @@
 UPDATE HubConnection SET closed = 1 WHERE handle = :handle;
+
+-- recover by the deposit expiry or, if the client publishes a revoked
+-- commit right away, its delay, whichever is earlier
+INSERT OR IGNORE INTO ConnectionRecovery (handle, deadline)
+SELECT :handle, :now + :block_time * min(blocks) FROM (
+    SELECT ttl AS blocks FROM ConnectionStatus WHERE handle = :handle
+    UNION ALL
+    SELECT CommitRevoked.delay_time AS blocks
+    FROM CommitRevoked JOIN HubConnection
+        ON CommitRevoked.channel_id = HubConnection.h2c_channel_id
+    WHERE HubConnection.handle = :handle
+);
+
+-- closed connections are not reported
+DELETE FROM ConnectionStatus WHERE handle = :handle;
@@ -0,0 +1 @@
+UPDATE ConnectionRecovery SET recovered = 1 WHERE handle = :handle;
@@ -0,0 +1,6 @@
+UPDATE HubConnection SET
+    rebalance_pending_since = coalesce(
+        rebalance_pending_since, CAST(strftime('%s', 'now') AS INTEGER)
+    )
+WHERE
+    handle = :handle;
@@ -0,0 +1,2 @@
+UPDATE CronJob SET lease_owner = :owner, lease_expires = :expires
+WHERE name = :name AND lease_owner = :previous;
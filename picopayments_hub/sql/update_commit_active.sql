@@ -0,0 +1,2 @@
+UPDATE CommitActive SET rawtx = :rawtx, payee_notified = :payee_notified
+WHERE channel_id = :channel_id AND script = :script;
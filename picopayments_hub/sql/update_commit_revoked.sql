@@ -0,0 +1,3 @@
+UPDATE CommitRevoked
+SET revoke_secret = :revoke_secret, payee_notified = :payee_notified
+WHERE channel_id = :channel_id AND script = :script;
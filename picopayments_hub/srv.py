@@ -3,22 +3,88 @@
 # License: MIT (see LICENSE file)
 
 
+import json
 import time
 import threading
 from werkzeug.serving import run_simple
 from werkzeug.wrappers import Request, Response
 from jsonrpc import JSONRPCResponseManager, dispatcher
+from jsonrpc.jsonrpc1 import JSONRPC10Request
+from jsonrpc.jsonrpc2 import JSONRPC20Request, JSONRPC20Response
+from jsonrpc.exceptions import JSONRPCParseError, JSONRPCInvalidRequest
+from jsonrpc.exceptions import JSONRPCInvalidRequestException
+from picopayments_hub import err
 from picopayments_hub import lib
+from picopayments_hub import jsoncodec
 from picopayments_hub import cli
 from picopayments_hub import etc
 from picopayments_hub import cron
+from picopayments_hub import schedule
+from picopayments_hub import broadcast
+from picopayments_hub import metrics
+from picopayments_hub import trace
+from picopayments_hub import profiler
 from picopayments_hub import __version__
 
 
+_PARSE_ERROR = object()
+
+
+class _Decoded20(JSONRPC20Request):
+    deserialize = staticmethod(lambda data: data)  # already decoded
+
+
+class _Decoded10(JSONRPC10Request):
+    deserialize = staticmethod(lambda data: data)  # already decoded
+
+
+def _decode(data):
+    try:
+        return jsoncodec.loads(data)
+    except ValueError:  # also UnicodeDecodeError and orjson.JSONDecodeError
+        return _PARSE_ERROR
+
+
+def _rpc_method(payload):
+    """Method label, bounded by the registered methods."""
+    if isinstance(payload, list):
+        return "batch"
+    if not isinstance(payload, dict):
+        return "invalid"
+    method = payload.get("method")
+    if isinstance(method, str) and method in dispatcher.method_map:
+        return method
+    return "unknown"
+
+
+def _handle(payload):
+    """Same as JSONRPCResponseManager.handle without decoding again."""
+    if payload is _PARSE_ERROR:
+        return JSONRPC20Response(error=JSONRPCParseError()._data)
+    try:
+        if isinstance(payload, dict) and "jsonrpc" not in payload:
+            request = _Decoded10.from_json(payload)
+        else:
+            request = _Decoded20.from_json(payload)
+    except (JSONRPCInvalidRequestException, ValueError):
+        return JSONRPC20Response(error=JSONRPCInvalidRequest()._data)
+    return JSONRPCResponseManager.handle_request(request, dispatcher)
+
+
 @Request.application
 def application(request):
-    response = JSONRPCResponseManager.handle(request.data, dispatcher)
-    return Response(response.json, mimetype='application/json')
+    if request.path == "/metrics":
+        if not etc.metrics_enabled:
+            return Response("", status=404)  # see --metrics
+        return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+    payload = _decode(request.data)
+    method = _rpc_method(payload)
+    with metrics.request(method), trace.request(method) as sampled:
+        with profiler.request(method):
+            response = _handle(payload)
+    body = "" if response is None else jsoncodec.dumps(response.data)
+    headers = {"X-Trace-Id": sampled["trace_id"]} if sampled else {}
+    return Response(body, mimetype='application/json', headers=headers)
 
 
 def _ssl_context(parsed):
@@ -36,24 +102,38 @@ _stop_cron_flag = threading.Event()
 
 def _cron_loop():
     while not _stop_cron_flag.isSet():
-        cron.run_all()
+        with trace.request("cron.run_all"), profiler.request("cron.run_all"):
+            try:
+                schedule.acquire(list(cron.JOBS))  # renew while serving
+                cron.run_all()
+            except err.CronJobLeased as e:
+                print(e)  # lease expired and taken over, retry next round
         time.sleep(10)
 
 
 def _start_server(parsed):
+    schedule.acquire(list(cron.JOBS))  # refuse to start during run_job
+    workers = []
+    thread = None
     try:
         thread = threading.Thread(target=_cron_loop)
         thread.start()
+        workers = broadcast.start_workers(_stop_cron_flag)
 
         run_simple(
             etc.host, etc.port,
             application,
             processes=1,  # ensure db integrety, avoid race conditions
+            threaded=True,  # writers serialized by etc.database_lock
             ssl_context=_ssl_context(parsed)
         )
     finally:
         _stop_cron_flag.set()
-        thread.join()
+        if thread is not None:
+            thread.join()
+        for worker in workers:
+            worker.join()
+        schedule.release()
 
 
 def main(args, serve=True):
@@ -67,5 +147,10 @@ def main(args, serve=True):
     parsed = cli.parse(args)
     lib.initialize(parsed)
 
+    if parsed["command"] == "run_job":
+        outputs = cron.run_job(parsed["job"], budget=parsed["budget"])
+        print(json.dumps(outputs, indent=2))
+        return outputs
+
     if serve:
         return _start_server(parsed)
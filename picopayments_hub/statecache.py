@@ -0,0 +1,132 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import copy
+import threading
+from collections import OrderedDict
+from picopayments_hub import etc
+from picopayments_hub import metrics
+
+
+_lock = threading.Lock()
+_committed = OrderedDict()  # channel id -> committed state, lru first
+_pending = {}  # channel id -> state written in the open transaction
+_invalid = set()  # channel ids changed in the open transaction, not cached
+_stats = {"hits": 0, "misses": 0}
+
+
+def is_writer(cursor):
+    """Only the main connection uses the cache, readers have snapshots."""
+    connection = etc.database_connection
+    return cursor is None or cursor.getconnection() is connection
+
+
+def get(channel_id):
+    with _lock:
+        if channel_id in _invalid:
+            state = None
+        elif channel_id in _pending:
+            state = _pending[channel_id]
+        else:
+            state = _committed.get(channel_id)
+            if state is not None:
+                _committed.move_to_end(channel_id)
+        _stats["hits" if state is not None else "misses"] += 1
+        return copy.deepcopy(state)
+
+
+def put(channel_id, state):
+    """Cache state written in the open transaction, public after commit."""
+    state = copy.deepcopy(state)
+    with _lock:
+        if channel_id in _invalid:
+            return
+        _pending[channel_id] = state
+
+
+def put_committed(channel_id, state):
+    """Cache state loaded from the database outside of pending writes."""
+    state = copy.deepcopy(state)
+    with _lock:
+        if channel_id in _invalid or channel_id in _pending:
+            return
+        _committed[channel_id] = state
+        _evict()
+
+
+def update(channel_id, change):
+    """Change cached state in place as written in the open transaction,
+    public after commit. Nothing to do if it is not cached."""
+    with _lock:
+        if channel_id in _invalid:
+            return
+        state = _pending.get(channel_id, _committed.get(channel_id))
+        if state is None:
+            return
+        state = copy.deepcopy(state)
+        change(state)
+        _pending[channel_id] = state
+
+
+def invalidate(channel_id):
+    """Channel changed by other means, load from database until commit."""
+    with _lock:
+        _committed.pop(channel_id, None)
+        _pending.pop(channel_id, None)
+        _invalid.add(channel_id)
+
+
+def _evict():
+    while len(_committed) > etc.channel_state_cache_size:
+        _committed.popitem(last=False)
+
+
+def on_commit():
+    with _lock:
+        _committed.update(_pending)
+        for channel_id in _pending:
+            _committed.move_to_end(channel_id)
+        _pending.clear()
+        _invalid.clear()
+        _evict()
+    return False  # allow commit (apsw commit hook)
+
+
+def on_rollback():
+    with _lock:
+        _pending.clear()
+        _invalid.clear()
+
+
+def on_partial_rollback():
+    """Savepoint rolled back, pending writes are unknown until commit."""
+    with _lock:
+        for channel_id in _pending:
+            _committed.pop(channel_id, None)
+            _invalid.add(channel_id)
+        _pending.clear()
+
+
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+            "size": len(_committed),
+        }
+
+
+def clear():
+    with _lock:
+        _committed.clear()
+        _pending.clear()
+        _invalid.clear()
+        _stats["hits"] = 0
+        _stats["misses"] = 0
+
+
+metrics.register_gauges("channel_state_cache", stats)
@@ -0,0 +1,107 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import os
+import json
+import time
+import random
+import functools
+import threading
+import contextlib
+from collections import deque
+from micropayment_core import util
+from picopayments_hub import etc
+
+
+_local = threading.local()  # trace of the current request if sampled
+_lock = threading.Lock()
+_traces = deque()  # recently finished traces, newest last
+
+
+def _sampled():
+    rate = etc.trace_sample_rate
+    return bool(rate) and random.random() < rate
+
+
+def _finish(trace):
+    with _lock:
+        _traces.append(trace)
+        while len(_traces) > etc.trace_buffer_size:
+            _traces.popleft()
+        if etc.trace_path:
+            with open(etc.trace_path, "a") as fp:
+                fp.write(json.dumps(trace, sort_keys=True) + "\n")
+
+
+def current_trace_id():
+    trace = getattr(_local, "trace", None)
+    return trace["trace_id"] if trace else None
+
+
+@contextlib.contextmanager
+def request(method):
+    """Trace the json-rpc request or cron pass if sampled."""
+    if not _sampled():
+        yield None
+        return
+    trace = {
+        "trace_id": util.b2h(os.urandom(8)),
+        "method": method,
+        "timestamp": time.time(),
+        "spans": [],
+    }
+    _local.trace = trace
+    _local.depth = 0
+    _local.begin = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace["duration"] = time.perf_counter() - _local.begin
+        _local.trace = None
+        _finish(trace)
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Record a span in the current trace, noop if not sampled."""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        yield
+        return
+    begin = time.perf_counter()
+    entry = {"name": name, "depth": _local.depth,
+             "offset": begin - _local.begin}
+    if attrs:
+        entry["attrs"] = attrs
+    trace["spans"].append(entry)
+    _local.depth += 1
+    try:
+        yield
+    except Exception as e:
+        entry["error"] = repr(e)
+        raise
+    finally:
+        _local.depth -= 1
+        entry["duration"] = time.perf_counter() - begin
+
+
+def traced(name):
+    """Decorator to record calls as spans."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def recent(limit=None, method=None):
+    """Recently finished traces, newest first."""
+    with _lock:
+        traces = list(reversed(_traces))
+    if method is not None:
+        traces = [t for t in traces if t["method"] == method]
+    return traces if limit is None else traces[:limit]
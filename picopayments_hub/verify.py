@@ -5,14 +5,18 @@
 
 import re
 import copy
-import jsonschema
+from collections import OrderedDict
+from jsonschema.validators import validator_for
 from counterpartylib.lib.micropayments import validate
-from micropayment_core import scripts
 from micropayment_core import util
 from picopayments_hub import err
 from picopayments_hub import db
 from picopayments_hub import etc
 from picopayments_hub import lib
+from picopayments_hub import crypto
+from picopayments_hub import profiler
+from picopayments_hub import wallet
+from picopayments_hub import scriptcache
 from jsonrpc import dispatcher
 
 
@@ -63,6 +67,41 @@ REVOKES_SCHEMA = {
 }
 
 
+REBALANCE_SCHEMA = {"type": "boolean"}
+
+
+def _compile(schema):
+    """Check schema once and return a reusable validator for it."""
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+_PAYMENTS = _compile(PAYMENT_SCHEMA)
+_COMMIT = _compile(COMMIT_SCHEMA)
+_REVOKES = _compile(REVOKES_SCHEMA)
+_REBALANCE = _compile(REBALANCE_SCHEMA)
+_STRING = _compile({"type": "string"})
+_BOOLEAN = _compile({"type": "boolean"})
+_SECONDS = _compile({"type": "number", "minimum": 0})
+_STRINGS = _compile({"type": "array", "items": {"type": "string"}})
+_PROFILE_MODE = _compile({"enum": profiler.MODES})
+_sync_batch = {}  # etc.sync_batch_max -> validator
+
+
+def _sync_batch_validator():
+    validator = _sync_batch.get(etc.sync_batch_max)
+    if validator is None:
+        validator = _compile({
+            "type": "array",
+            "items": {"type": "object"},
+            "minItems": 1,
+            "maxItems": etc.sync_batch_max,
+        })
+        _sync_batch[etc.sync_batch_max] = validator
+    return validator
+
+
 def asset_exists(asset):
     from picopayments_hub import api
     validate.is_string(asset)
@@ -97,28 +136,47 @@ def _check_payment_payer(payer_handle, payments, new_c2h_commit,
     return payer
 
 
-def _check_payment_payee(payer, payment, cursor=None):
+def _check_payee(payer, payee_handle, payments, cursor=None):
+    """Check payee once for all its payments, amounts are cumulative."""
     from picopayments_hub import lib
 
-    payee_handle = payment["payee_handle"]
-    if payee_handle:
-        payee = lib.load_connection_data(payee_handle, cursor=cursor)
-        if payer["connection"]["asset"] != payee["connection"]["asset"]:
-            raise err.AssetMissmatch(
-                payer["connection"]["asset"], payee["connection"]["asset"]
-            )
-        if payee["h2c_expired"]:
-            raise err.DepositExpired(payee_handle, "hub")
-        if payee["c2h_expired"]:
-            raise err.DepositExpired(payee_handle, "client")
-        if payment["amount"] > payee["receivable_amount"]:
+    payee = lib.load_connection_data(payee_handle, cursor=cursor)
+    if payer["connection"]["asset"] != payee["connection"]["asset"]:
+        raise err.AssetMissmatch(
+            payer["connection"]["asset"], payee["connection"]["asset"]
+        )
+    if payee["h2c_expired"]:
+        raise err.DepositExpired(payee_handle, "hub")
+    if payee["c2h_expired"]:
+        raise err.DepositExpired(payee_handle, "client")
+    amount = 0
+    for payment in payments:
+        amount += payment["amount"]
+        if amount > payee["receivable_amount"]:
             raise err.PaymentExceedsReceivable(
-                payment["amount"],
-                payee["receivable_amount"],
-                payment["token"]
+                amount, payee["receivable_amount"], payment["token"]
             )
 
 
+def _check_payments(payer, payments, cursor=None):
+    """Verify all payments of a sync, loading every payee only once."""
+    by_payee = OrderedDict()  # payee handle -> payments, in given order
+    for payment in payments:
+        validate.is_hex(payment["token"])
+        validate.is_quantity(payment["amount"])
+        if payment["payee_handle"] is not None:
+            validate.is_hex(payment["payee_handle"])
+            by_payee.setdefault(payment["payee_handle"], []).append(payment)
+
+    existing = db.existing_handles(list(by_payee.keys()), cursor=cursor)
+    for payee_handle in by_payee:
+        if payee_handle not in existing:
+            raise err.HandleNotFound(payee_handle)
+
+    for payee_handle, payee_payments in by_payee.items():
+        _check_payee(payer, payee_handle, payee_payments, cursor=cursor)
+
+
 def is_url(url):
     if not URL_REGEX.match(url):
         raise err.InvalidUrl(url)
@@ -150,9 +208,51 @@ def terms_input(assets):
         assets_exists(assets)
 
 
-def status_input(assets):
+def status_input(assets, after=None, limit=None):
     if assets:
         assets_exists(assets)
+    if after is not None:
+        validate.is_hex(after)
+    if limit is not None:
+        validate.is_quantity(limit)
+
+
+def signature(kwargs):
+    """Request must be signed by its pubkey."""
+    if not crypto.verify_json(kwargs):
+        raise err.InvalidSignature(kwargs["pubkey"])
+
+
+def admin_input(pubkey):
+    """Admin methods must be signed with the hub wallet key."""
+    validate.pubkey(pubkey)
+    if pubkey != wallet.pubkey():
+        raise err.NotAdmin(pubkey)
+
+
+def traces_input(pubkey, limit=None, method=None):
+    admin_input(pubkey)
+    if limit is not None:
+        validate.is_quantity(limit)
+    if method is not None:
+        _STRING.validate(method)
+
+
+def profile_start_input(pubkey, mode, requests, seconds, methods):
+    admin_input(pubkey)
+    _PROFILE_MODE.validate(mode)
+    if requests is not None:
+        validate.is_quantity(requests)
+    if seconds is not None:
+        _SECONDS.validate(seconds)
+    if methods is not None:
+        _STRINGS.validate(methods)
+
+
+def profile_results_input(pubkey, stop, save):
+    admin_input(pubkey)
+    _BOOLEAN.validate(stop)
+    _BOOLEAN.validate(save)
 
 
 def request_input(asset, pubkey, spend_secret_hash, hub_rpc_url):
@@ -193,17 +293,20 @@ def deposit_input(handle, deposit_script,
 
 
 def sync_input(handle, next_revoke_secret_hash, client_pubkey,
-               payments, commit, revokes):
+               payments, commit, revokes, rebalance=None):
     connection = hub_connection(handle)
     validate.hash160(next_revoke_secret_hash)
     _channel_client(handle, client_pubkey)
 
+    if rebalance is not None:
+        _REBALANCE.validate(rebalance)
+
     if revokes:
-        jsonschema.validate(revokes, REVOKES_SCHEMA)
+        _REVOKES.validate(revokes)
         # TODO check revokes match commits?
 
     if commit:
-        jsonschema.validate(commit, COMMIT_SCHEMA)
+        _COMMIT.validate(commit)
         c2h_commit(handle, commit["rawtx"], commit["script"])
 
     payments = copy.deepcopy(payments) or []
@@ -213,14 +316,20 @@ def sync_input(handle, next_revoke_secret_hash, client_pubkey,
         "amount": connection_terms["sync_fee"],
         "token": "deadbeef"  # sync_fee
     })
-    jsonschema.validate(payments, PAYMENT_SCHEMA)
+    _PAYMENTS.validate(payments)
     payer = _check_payment_payer(handle, payments, commit, revokes)
-    for payment in payments:
-        validate.is_hex(payment["token"])
-        validate.is_quantity(payment["amount"])
-        if payment["payee_handle"] is not None:
-            validate.is_hex(payment["payee_handle"])
-        _check_payment_payee(payer, payment)
+    _check_payments(payer, payments)
+
+
+def sync_batch_input(syncs):
+    _sync_batch_validator().validate(syncs)
+
+
+def wait_input(handle, client_pubkey, timeout):
+    hub_connection(handle)
+    _channel_client(handle, client_pubkey)
+    if timeout is not None:
+        _SECONDS.validate(timeout)
 
 
 def close_input(handle, client_pubkey, spend_secret):
@@ -232,6 +341,8 @@ def close_input(handle, client_pubkey, spend_secret):
         validate.is_string(spend_secret)
         spend_secret_hash = util.hash160hex(spend_secret)
         deposit_script = db.h2c_channel(handle=handle)["deposit_script"]
-        expected_hash = scripts.get_deposit_spend_secret_hash(deposit_script)
+        expected_hash = scriptcache.deposit(deposit_script)[
+            "spend_secret_hash"
+        ]
         if expected_hash != spend_secret_hash:
             raise err.InvalidSpendSecret(expected_hash, spend_secret)
@@ -0,0 +1,91 @@
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+import os
+import threading
+import picopayments_cli
+from micropayment_core import keys
+from picopayments_cli import auth
+from picopayments_hub import crypto
+
+
+_lock = threading.Lock()
+_key = None  # decoded hub key material, see load
+_retired = {}  # pubkey -> key material of replaced hub keys
+
+
+def _key_material(wif):
+    return {
+        "wif": wif,
+        "privkey": keys.wif_to_privkey(wif),
+        "pubkey": keys.pubkey_from_wif(wif),
+        "address": keys.address_from_wif(wif),
+    }
+
+
+def _retired_path():
+    return picopayments_cli.etc.wallet_path + ".retired"
+
+
+def _load_retired():
+    path = _retired_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        wifs = [line.strip() for line in fp if line.strip()]
+    return {key["pubkey"]: key for key in map(_key_material, wifs)}
+
+
+def load():
+    """Read the hub wallet (created if needed) and cache its key material.
+
+    Call again to pick up a changed wallet file. A replaced key is kept in
+    the retired file, existing channels have it in their deposit scripts.
+    """
+    global _key, _retired
+    key = _key_material(auth.load_wif())
+    with _lock:
+        retired = _load_retired()
+        previous = _key
+        if previous is not None and previous["pubkey"] != key["pubkey"]:
+            if previous["pubkey"] not in retired:
+                with open(_retired_path(), "a") as fp:
+                    fp.write(previous["wif"] + "\n")
+            retired[previous["pubkey"]] = previous
+        _key = key
+        _retired = retired
+    return key
+
+
+def _get():
+    return _key or load()
+
+
+def wif():
+    return _get()["wif"]
+
+
+def pubkey():
+    return _get()["pubkey"]
+
+
+def address():
+    return _get()["address"]
+
+
+def get_wif(pubkey):
+    key = _get()
+    if pubkey != key["pubkey"]:
+        key = _retired.get(pubkey)
+    assert(key is not None)
+    return key["wif"]
+
+
+def sign_json(json_data, auth_wif=None):
+    """Sign with the cached hub key, other wifs are parsed as usual."""
+    key = _get()
+    if auth_wif is not None and auth_wif != key["wif"]:
+        return crypto.sign_json(json_data, auth_wif)
+    return crypto.sign_json_key(json_data, key["privkey"], key["pubkey"])
@@ -101,3 +101,34 @@ def test_validate_deposit_not_already_given():
         assert False
     except err.DepositAlreadyGiven:
         assert True
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_retry_returns_cached_response():
+    wif = keys.generate_wif(etc.netcode)
+    client_pubkey = keys.pubkey_from_wif(wif)
+    h2c_spend_secret_hash = util.hash160hex(util.b2h(os.urandom(32)))
+    params = {"asset": "XCP", "spend_secret_hash": h2c_spend_secret_hash}
+    result = api.mph_request(**auth.sign_json(params, wif))
+
+    c2h_deposit_script = compile_deposit_script(
+        client_pubkey, result["pubkey"], result["spend_secret_hash"], 1337
+    )
+    params = {
+        "handle": result["handle"],
+        "deposit_script": c2h_deposit_script,
+        "next_revoke_secret_hash": util.hash160hex(util.b2h(os.urandom(32)))
+    }
+    params = auth.sign_json(params, wif)
+    result = api.mph_deposit(**dict(params))
+
+    # same request again gets the original response
+    assert api.mph_deposit(**dict(params)) == result
+
+    # a new request is processed and rejected
+    params.pop("signature")
+    params["next_revoke_secret_hash"] = util.hash160hex(
+        util.b2h(os.urandom(32))
+    )
+    with pytest.raises(err.DepositAlreadyGiven):
+        api.mph_deposit(**auth.sign_json(params, wif))
@@ -95,3 +95,14 @@ def test_validate_url():
         assert False
     except err.InvalidUrl:
         assert True
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_forged_signature():
+    wif = keys.generate_wif(etc.netcode)
+    secret_hash = util.hash160hex(util.b2h(os.urandom(32)))
+    params = {"asset": "XCP", "spend_secret_hash": secret_hash}
+    params = auth.sign_json(params, wif)
+    params["asset"] = "BTC"  # no longer matches the signature
+    with pytest.raises(err.InvalidSignature):
+        api.mph_request(**params)
@@ -0,0 +1,93 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import api
+from picopayments_hub import cron
+from picopayments_hub import db
+from picopayments_hub import etc
+from picopayments_hub import lib
+from picopayments_hub import sql
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_status_filter_assets(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    connections = api.mph_status()["connections"]
+    assert len(connections) == 6
+
+    connections = api.mph_status(assets=["XCP"])["connections"]
+    assert set(connections.keys()) == set([
+        alice.handle, bob.handle, charlie.handle
+    ])
+    for status in connections.values():
+        assert status["asset"] == "XCP"
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_status_pagination(connected_clients):
+    handles = set([client.handle for client in connected_clients])
+
+    seen = []
+    after = None
+    while True:
+        status = api.mph_status(after=after, limit=4)
+        assert len(status["connections"]) <= 4
+        seen += list(status["connections"].keys())
+        after = status["connections_next"]
+        if after is None:
+            break
+
+    assert len(seen) == len(handles)
+    assert set(seen) == handles
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_status_updated_by_cron(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    cron.update_status(budget=0)
+    before = api.mph_status()["connections"][alice.handle]
+    alice.micro_send(bob.handle, 1337, "0000")
+    alice.sync()
+
+    # syncs make no counterparty lookups, status is refreshed by cron
+    assert api.mph_status()["connections"][alice.handle] == before
+    cron.update_status(budget=0)
+    after = api.mph_status()["connections"][alice.handle]
+    assert after["balance"] < before["balance"]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_status_not_saved_after_close(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    hub_connection = db.hub_connection(handle=alice.handle)
+    with sql.read_cursor() as cursor:
+        status = lib.get_status(hub_connection, cursor=cursor)
+    db.set_connection_closed(handle=alice.handle)
+
+    # closed while the status was looked up
+    with etc.database_lock:
+        lib.save_status(hub_connection, status)
+    assert alice.handle not in api.mph_status()["connections"]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_status_backfilled(connected_clients):
+    before = api.mph_status()["connections"]
+
+    # connections opened before status was materialized
+    sql.execute("DELETE FROM ConnectionStatus;")
+    assert api.mph_status()["connections"] == {}
+
+    lib.backfill_status()
+    assert api.mph_status()["connections"] == before
@@ -0,0 +1,137 @@
+import copy
+import tempfile
+import pytest
+import jsonschema
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import api
+from picopayments_hub import db
+from picopayments_hub import etc
+from picopayments_cli import auth
+from micropayment_core import keys
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _sync_params(client, wif=None, handle=None):
+    """Sync paying only the sync fee, committed by the client."""
+    sync_fee = client.channel_terms["sync_fee"]
+    result = client.create_signed_commit(
+        client.api.auth_wif, client.c2h_state, sync_fee,
+        client.c2h_next_revoke_secret_hash, client.c2h_commit_delay_time
+    )
+    client.c2h_state = result["state"]
+    next_revoke_secret_hash = client._gen_secret()
+    client._add_to_commits_requested(next_revoke_secret_hash)
+    return auth.sign_json({
+        "handle": handle or client.handle,
+        "sends": [],
+        "commit": result["commit"],
+        "revokes": None,
+        "next_revoke_secret_hash": next_revoke_secret_hash
+    }, wif or client.api.auth_wif)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_batch(connected_clients):
+    clients = connected_clients[:3]
+    syncs = [_sync_params(c) for c in clients]
+    result = api.mph_sync_batch(syncs=syncs)
+    assert auth.verify_json(result)
+
+    results = result["results"]
+    assert [r["handle"] for r in results] == [c.handle for c in clients]
+    for client, entry in zip(clients, results):
+        assert "error" not in entry
+        assert entry["result"]["receive"] == []
+        connection = db.hub_connection(handle=client.handle)
+        assert connection["sync_fees"] == client.channel_terms["sync_fee"]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_retry(connected_clients):
+    clients = connected_clients[:3]
+    syncs = [_sync_params(c) for c in clients]
+    result = api.mph_sync_batch(syncs=copy.deepcopy(syncs))
+
+    # retried entries get the original results without processing again
+    retried = api.mph_sync_batch(syncs=copy.deepcopy(syncs))
+    assert retried["results"] == result["results"]
+    for client in clients:
+        connection = db.hub_connection(handle=client.handle)
+        assert connection["sync_fees"] == client.channel_terms["sync_fee"]
+
+    # shared with mph_sync
+    response = api.mph_sync(**copy.deepcopy(syncs[0]))
+    assert auth.verify_json(response)
+    assert response["commit"] == result["results"][0]["result"]["commit"]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_errors_per_handle(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    wif = keys.generate_wif(netcode=etc.netcode)
+    syncs = [
+        _sync_params(alice),
+        _sync_params(bob, wif=wif),  # wrong client key
+        _sync_params(charlie, handle="deadbeef"),  # unknown handle
+        _sync_params(alice),  # duplicate
+        _sync_params(david),
+    ]
+    syncs[-1]["revokes"] = []  # no longer matches the signature
+    results = api.mph_sync_batch(syncs=syncs)["results"]
+
+    assert "result" in results[0]
+    errors = [r["error"]["type"] for r in results[1:]]
+    assert errors == [
+        "ClientPubkeyMissmatch", "HandleNotFound", "DuplicateHandle",
+        "InvalidSignature"
+    ]
+
+    # failed entries do not affect the rest of the batch
+    sync_fee = alice.channel_terms["sync_fee"]
+    assert db.hub_connection(handle=alice.handle)["sync_fees"] == sync_fee
+    assert db.hub_connection(handle=bob.handle)["sync_fees"] == 0
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_unexpected_error_aborts(connected_clients, monkeypatch):
+    alice, bob = connected_clients[:2]
+    syncs = [_sync_params(alice), _sync_params(bob)]
+    sync = api._sync
+
+    def _failing_sync(kwargs):
+        if kwargs["handle"] == bob.handle:
+            raise RuntimeError("boom")
+        return sync(kwargs)
+
+    monkeypatch.setattr(api, "_sync", _failing_sync)
+    with pytest.raises(RuntimeError):
+        api.mph_sync_batch(syncs=syncs)
+
+    # nothing of the batch was committed
+    for client in [alice, bob]:
+        assert db.hub_connection(handle=client.handle)["sync_fees"] == 0
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_batch_limits(connected_clients):
+    with pytest.raises(jsonschema.exceptions.ValidationError):
+        api.mph_sync_batch(syncs=[])
+
+    sync_batch_max = etc.sync_batch_max
+    etc.sync_batch_max = 1
+    try:
+        alice, bob = connected_clients[:2]
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            api.mph_sync_batch(syncs=[
+                _sync_params(alice),
+                _sync_params(bob),
+            ])
+    finally:
+        etc.sync_batch_max = sync_batch_max
@@ -1,3 +1,4 @@
+import copy
 import tempfile
 import pytest
 import jsonschema
@@ -7,6 +8,7 @@ import jsonschema
 
 from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
 from counterpartylib.test import util_test
+from picopayments_hub import db
 from picopayments_hub import lib
 from picopayments_hub import api
 from picopayments_hub import err
@@ -49,6 +51,24 @@ def test_pubkey_missmatch(connected_clients):
         assert True
 
 
+@pytest.mark.usefixtures("picopayments_server")
+def test_forged_signature(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    secret = lib.create_secret()
+    params = auth.sign_json({
+        "handle": alice.handle,
+        "sends": [],
+        "commit": None,
+        "revokes": None,
+        "next_revoke_secret_hash": secret["secret_hash"]
+    }, alice.api.auth_wif)
+    params["sends"] = [{  # no longer matches the signature
+        "payee_handle": bob.handle, "amount": 1337, "token": "deadbeef"
+    }]
+    with pytest.raises(err.InvalidSignature):
+        api.mph_sync(**params)
+
+
 @pytest.mark.usefixtures("picopayments_server")
 def test_validate_handles_exist(connected_clients):
     alice, bob, charlie, david, eric, fred = connected_clients
@@ -423,3 +443,84 @@ def test_c2h_revoke_commit(connected_clients, server_db):
 def test_h2c_revoke_commit(connected_clients, server_db):
     alice, bob, charlie, david, eric, fred = connected_clients
     # FIXME test it
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_sync_fees_aggregated(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    sync_fee = alice.channel_terms["sync_fee"]
+
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    alice.sync()
+
+    # fees counted per connection, not stored as payments
+    connection = db.hub_connection(handle=alice.handle)
+    assert connection["sync_fees"] == sync_fee * 2
+    assert db.send_payments_sum(handle=alice.handle) == 5 + sync_fee * 2
+    payments = db.unnotified_payments(payee_handle=bob.handle)
+    assert len(payments) == 1
+    assert payments[0]["amount"] == 5
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_retry_returns_cached_response(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    sync_fee = alice.channel_terms["sync_fee"]
+    commit = _create_commit(alice, 5 + sync_fee)
+    params = {
+        "handle": alice.handle,
+        "sends": [{"payee_handle": bob.handle, "amount": 5,
+                   "token": "deadbeef"}],
+        "commit": commit,
+        "revokes": None,
+        "next_revoke_secret_hash": alice._gen_secret()
+    }
+    params = auth.sign_json(params, alice.api.auth_wif)
+    result = api.mph_sync(**copy.deepcopy(params))
+    retried = api.mph_sync(**copy.deepcopy(params))
+    assert retried == result
+
+    # processed once
+    connection = db.hub_connection(handle=alice.handle)
+    assert connection["sync_fees"] == sync_fee
+    assert len(db.unnotified_payments(payee_handle=bob.handle)) == 1
+
+
+def test_payments_verified_per_payee(monkeypatch):
+    from picopayments_hub import verify
+    loaded = []
+
+    def load_connection_data(handle, cursor=None):
+        loaded.append(handle)
+        return {
+            "connection": {"asset": "XCP"},
+            "h2c_expired": False,
+            "c2h_expired": False,
+            "receivable_amount": 10,
+        }
+    monkeypatch.setattr(lib, "load_connection_data", load_connection_data)
+    monkeypatch.setattr(db, "existing_handles",
+                        lambda handles, cursor=None: set(handles))
+
+    payer = {"connection": {"asset": "XCP"}}
+    payments = [
+        {"payee_handle": "aa", "amount": 4, "token": "01"},
+        {"payee_handle": "bb", "amount": 4, "token": "02"},
+        {"payee_handle": "aa", "amount": 4, "token": "03"},
+    ]
+    verify._check_payments(payer, payments)
+    assert loaded == ["aa", "bb"]  # every payee loaded once
+
+    # receivable is checked against the payee total
+    payments.append({"payee_handle": "aa", "amount": 4, "token": "04"})
+    with pytest.raises(err.PaymentExceedsReceivable):
+        verify._check_payments(payer, payments)
+
+    # unknown payees are resolved in one query before loading any payee
+    monkeypatch.setattr(db, "existing_handles",
+                        lambda handles, cursor=None: {"aa"})
+    del loaded[:]
+    with pytest.raises(err.HandleNotFound):
+        verify._check_payments(payer, payments)
+    assert loaded == []
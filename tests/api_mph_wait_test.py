@@ -0,0 +1,112 @@
+import time
+import tempfile
+import threading
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import api
+from picopayments_hub import err
+from picopayments_hub import etc
+from picopayments_hub import eventbus
+from picopayments_cli import auth
+from micropayment_core import keys
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _wait(client, timeout):
+    params = auth.sign_json({
+        "handle": client.handle, "timeout": timeout
+    }, client.api.auth_wif)
+    return api.mph_wait(**params)
+
+
+def test_eventbus_wait():
+    eventbus.clear()
+    since = eventbus.version(["a"])
+    assert not eventbus.wait(["a"], since, 0.01)
+
+    # only committed changes wake waiters
+    eventbus.publish("a")
+    eventbus.on_rollback()
+    assert eventbus.version(["a"]) == since
+    eventbus.publish("a")
+    eventbus.on_commit()
+    assert eventbus.version(["a"]) == since  # commit not yet returned
+    eventbus.on_committed()
+    assert eventbus.wait(["a"], since, 0)
+    assert eventbus.version(["b"]) == (0,)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_timeout_without_notifications(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    begin = time.time()
+    result = _wait(bob, 0.2)
+    assert time.time() - begin >= 0.2
+    assert result["payments"] == 0
+    assert result["commit"] is False
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_returns_pending_payments(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    begin = time.time()
+    result = _wait(bob, 10)
+    assert time.time() - begin < 5
+    assert result["payments"] == 1
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_wakes_on_payment(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(_wait(bob, 10)))
+    waiter.start()
+    time.sleep(0.2)
+    begin = time.time()
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    waiter.join()
+    assert time.time() - begin < 5
+    assert results[0]["payments"] == 1
+
+    # receiving clears the notifications
+    bob.sync()
+    assert _wait(bob, 0)["payments"] == 0
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_pubkey_missmatch(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    wif = keys.generate_wif(netcode=etc.netcode)
+    params = auth.sign_json({"handle": bob.handle}, wif)
+    with pytest.raises(err.ClientPubkeyMissmatch):
+        api.mph_wait(**params)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_null_timeout(connected_clients, monkeypatch):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    monkeypatch.setattr(etc, "wait_timeout", 0.2)
+    begin = time.time()
+    result = _wait(bob, None)
+    assert time.time() - begin >= 0.2
+    assert result["payments"] == 0
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_forged_signature(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    params = auth.sign_json({"handle": bob.handle, "timeout": 0},
+                            bob.api.auth_wif)
+    params["timeout"] = 1  # no longer matches the signature
+    with pytest.raises(err.InvalidSignature):
+        api.mph_wait(**params)
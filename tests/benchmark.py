@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import pytest
+import platform
+import functools
+import contextlib
+import subprocess
+from collections import defaultdict
+
+
+# append results as json lines to this file, benchmarks skipped if not set
+RESULTS_PATH = os.environ.get("PICOPAYMENTS_BENCHMARK")
+
+
+enabled = pytest.mark.skipif(
+    not RESULTS_PATH,
+    reason="set PICOPAYMENTS_BENCHMARK=<results.jsonl> to run benchmarks"
+)
+
+
+def percentile(samples, percent):
+    """Nearest rank percentile of the given samples."""
+    ordered = sorted(samples)
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "total": total,
+        "throughput": len(samples) / total if total else None,  # per second
+        "min": min(samples),
+        "p50": percentile(samples, 50),
+        "p90": percentile(samples, 90),
+        "p99": percentile(samples, 99),
+        "max": max(samples),
+    }
+
+
+def _git_commit():
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         stderr=subprocess.STDOUT)
+        return output.decode("utf-8").strip()
+    except Exception:
+        return None
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.samples = defaultdict(list)  # name -> [seconds]
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - begin)
+
+    def patch(self, monkeypatch, module, name, label=None):
+        """Record calls of module.name, optionally labeled by arguments."""
+        func = getattr(module, name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = label(kwargs) if label else name
+            with self.measure(key):
+                return func(*args, **kwargs)
+        monkeypatch.setattr(module, name, wrapper)
+
+    def results(self):
+        return {k: summarize(v) for k, v in self.samples.items()}
+
+    def save(self, benchmark, **params):
+        entry = {
+            "benchmark": benchmark,
+            "params": params,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+            "results": self.results(),
+        }
+        with open(RESULTS_PATH, "a") as fp:
+            fp.write(json.dumps(entry, sort_keys=True) + "\n")
+        return entry
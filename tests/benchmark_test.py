@@ -0,0 +1,94 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import api
+from picopayments_hub import cron
+from tests import benchmark
+from tests import util
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+ASSET = "XCP"
+CONNECTIONS = [1, 10, 50]
+SYNC_PAYMENTS = [0, 1, 100]
+STATUS_CALLS = 20
+CRON_PASSES = 5
+CRON_JOBS = [
+    "fund_deposits", "publish_commits", "recover_funds",
+    "update_status", "collect_garbage", "run_all"
+]
+
+
+def _sync_label(kwargs):
+    return "mph_sync[{0} payments]".format(len(kwargs.get("sends") or []))
+
+
+@benchmark.enabled
+@pytest.mark.parametrize("connections", CONNECTIONS)
+@pytest.mark.usefixtures("picopayments_server")
+def test_benchmark_hot_paths(connections, monkeypatch):
+    recorder = benchmark.Recorder()
+    for name in ["mph_request", "mph_deposit", "mph_close", "mph_status"]:
+        recorder.patch(monkeypatch, api, name)
+    recorder.patch(monkeypatch, api, "mph_sync", label=_sync_label)
+    for name in CRON_JOBS:
+        recorder.patch(monkeypatch, cron, name, label=lambda k, n=name: (
+            "cron.{0}".format(n)
+        ))
+
+    # mph_request and mph_deposit
+    util.fund_hub(ASSET, connections + 1)
+    clients = util.connect_clients(ASSET, connections)
+
+    # mph_sync
+    for payments in SYNC_PAYMENTS:
+        for index, client in enumerate(clients):
+            payee = clients[(index + 1) % len(clients)]
+            for i in range(payments):
+                client.micro_send(payee.handle, 1)
+            client.sync()
+
+    # mph_status
+    for i in range(STATUS_CALLS):
+        api.mph_status()
+
+    # cron jobs
+    for i in range(CRON_PASSES):
+        for name in CRON_JOBS:
+            getattr(cron, name)()
+
+    # mph_close
+    for client in clients:
+        client.close()
+
+    entry = recorder.save("hot_paths", connections=connections)
+    for payments in SYNC_PAYMENTS:
+        key = "mph_sync[{0} payments]".format(payments)
+        assert entry["results"][key]["count"] == connections
+
+
+@benchmark.enabled
+@pytest.mark.usefixtures("picopayments_server")
+def test_benchmark_sync_payments(monkeypatch):
+    """Payments to one payee are verified together, cost per sync should
+    barely grow with the number of payments."""
+    recorder = benchmark.Recorder()
+    recorder.patch(monkeypatch, api, "mph_sync", label=_sync_label)
+
+    util.fund_hub(ASSET, 3)
+    payer, payee = util.connect_clients(ASSET, 2)
+    for payments in [1, 1000]:
+        for i in range(payments):
+            payer.micro_send(payee.handle, 1)
+        payer.sync()
+        payee.sync()
+
+    entry = recorder.save("sync_payments")
+    assert entry["results"]["mph_sync[1000 payments]"]["count"] == 1
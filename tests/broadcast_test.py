@@ -0,0 +1,191 @@
+import os
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from micropayment_core import util
+from picopayments_hub import api
+from picopayments_hub import etc
+from picopayments_hub import sql
+from picopayments_hub import broadcast
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _rawtx(previous_hash=None):
+    # one input spending output 0 of a random previous tx, one empty output
+    return (
+        "01000000" "01" + (previous_hash or util.b2h(os.urandom(32))) +
+        "00000000" "00" "ffffffff" "01" "e803000000000000" "00" "00000000"
+    )
+
+
+def _entry(txid):
+    return sql.fetchone("SELECT * FROM BroadcastQueue WHERE txid = :txid;",
+                        {"txid": txid})
+
+
+class _Backend(object):
+
+    def __init__(self):
+        self.fail = False
+        self.unavailable = False
+        self.sent = []
+        self.confirmations = {}
+
+    def sendrawtransaction(self, tx_hex):
+        if self.fail:
+            raise Exception("Connection refused")
+        txid = util.gettxid(tx_hex)
+        self.sent.append(txid)
+        self.confirmations[txid] = 0
+        return txid
+
+    def getrawtransaction(self, tx_hash, verbose=False):
+        if self.unavailable:
+            raise Exception("Connection refused")
+        if tx_hash not in self.confirmations:
+            raise Exception(broadcast.NOT_FOUND)
+        return {"txid": tx_hash, "confirmations": self.confirmations[tx_hash]}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = _Backend()
+    monkeypatch.setattr(api, "sendrawtransaction", backend.sendrawtransaction)
+    monkeypatch.setattr(api, "getrawtransaction", backend.getrawtransaction)
+    return backend
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_enqueue_dedupe(backend):
+    rawtx = _rawtx()
+    txid = broadcast.enqueue(rawtx, "recover")
+    assert broadcast.enqueue(rawtx, "recover") == txid
+    assert broadcast.depth() == {"pending": 1, "published": 0, "failed": 0}
+    assert broadcast.process() == [txid]
+    assert broadcast.process() == []  # not published again
+    assert backend.sent == [txid]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_retry_with_backoff(backend):
+    txid = broadcast.enqueue(_rawtx(), "deposit", handle="ab" * 32)
+    assert broadcast.is_pending("ab" * 32, "deposit")
+
+    backend.fail = True
+    assert broadcast.process() == []
+    entry = _entry(txid)
+    assert entry["status"] == "pending"
+    assert entry["attempts"] == 1
+    assert "Connection refused" in entry["last_error"]
+    assert broadcast.process() == []  # not yet due
+    assert backend.sent == []
+
+    sql.execute("UPDATE BroadcastQueue SET next_attempt = 0;")
+    assert broadcast.process() == []  # due, fails again
+    entry = _entry(txid)
+    assert entry["attempts"] == 2
+    assert entry["next_attempt"] - entry["unixtimestamp"] >= 20  # doubled
+
+    sql.execute("UPDATE BroadcastQueue SET next_attempt = 0;")
+    backend.fail = False
+    assert broadcast.process() == [txid]
+    assert not broadcast.is_pending("ab" * 32, "deposit")
+    assert _entry(txid)["status"] == "published"
+
+
+def test_retry_delay(monkeypatch):
+    monkeypatch.setattr(etc, "broadcast_retry_delay", 10)
+    monkeypatch.setattr(etc, "broadcast_max_retry_delay", 600)
+    delays = [broadcast._retry_delay(a) for a in range(1, 9)]
+    assert delays == [10, 20, 40, 80, 160, 320, 600, 600]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_max_attempts(backend, monkeypatch):
+    monkeypatch.setattr(etc, "broadcast_retry_delay", 0)
+    monkeypatch.setattr(etc, "broadcast_max_retry_delay", 0)
+    monkeypatch.setattr(etc, "broadcast_max_attempts", 2)
+    txid = broadcast.enqueue(_rawtx(), "commit")
+    backend.fail = True
+    broadcast.process()
+    broadcast.process()
+    assert _entry(txid)["status"] == "failed"
+    assert broadcast.depth()["failed"] == 1
+    assert broadcast.process() == []
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_track_confirmations(backend, monkeypatch):
+    monkeypatch.setattr(etc, "broadcast_confirm_interval", 0)
+    txid = broadcast.enqueue(_rawtx(), "recover")
+    assert broadcast.process() == [txid]
+
+    broadcast.process()
+    assert _entry(txid)["status"] == "published"  # still unconfirmed
+
+    # backend errors are not taken as the transaction being dropped
+    backend.unavailable = True
+    broadcast.process()
+    entry = _entry(txid)
+    assert entry["status"] == "published"
+    assert "Connection refused" in entry["last_error"]
+    assert backend.sent == [txid]
+    backend.unavailable = False
+
+    # dropped by the backend, published again
+    del backend.confirmations[txid]
+    broadcast.process()
+    assert _entry(txid)["status"] == "pending"
+    assert broadcast.process() == [txid]
+    assert backend.sent == [txid, txid]
+
+    backend.confirmations[txid] = 1
+    broadcast.process()
+    entry = _entry(txid)
+    assert entry["status"] == "confirmed"
+    assert entry["confirmations"] == 1
+    assert broadcast.depth() == {"pending": 0, "published": 0, "failed": 0}
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_already_published(backend):
+    rawtx = _rawtx()
+    txid = broadcast.enqueue(rawtx, "recover")
+    backend.sendrawtransaction(rawtx)  # i.e. status update lost in crash
+    backend.fail = True
+    assert broadcast.process() == [txid]
+    assert _entry(txid)["status"] == "published"
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_publish_failure_with_backend_down(backend):
+    txid = broadcast.enqueue(_rawtx(), "recover")
+    backend.fail = True
+    backend.unavailable = True
+    assert broadcast.process() == []
+    entry = _entry(txid)
+    assert entry["status"] == "pending"
+    assert entry["attempts"] == 1
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_spent_outputs(backend, monkeypatch):
+    monkeypatch.setattr(etc, "broadcast_confirm_interval", 0)
+    txid = broadcast.enqueue(_rawtx("11" * 31 + "22"), "deposit")
+    broadcast.enqueue(_rawtx("33" * 32), "recover")
+    spent = "22" + "11" * 31 + ":0"  # txids are byte reversed
+    assert broadcast.spent_outputs("deposit") == {spent}
+
+    assert txid in broadcast.process()
+    assert broadcast.spent_outputs("deposit") == {spent}  # unconfirmed
+
+    backend.confirmations[txid] = 1
+    broadcast.process()
+    assert broadcast.spent_outputs("deposit") == set()
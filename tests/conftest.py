@@ -7,8 +7,10 @@ import tempfile
 from jsonrpc import dispatcher
 from picopayments_hub import srv
 from picopayments_hub import api
+from picopayments_hub import etc
 from picopayments_hub import lib
 from picopayments_hub import cron
+from picopayments_hub import broadcast
 from picopayments_cli.mph import Mph
 from micropayment_core.keys import address_from_wif
 from counterpartylib.lib import config
@@ -16,6 +18,7 @@ from counterpartylib.test import util_test
 from counterpartylib.test.fixtures.params import DP
 from counterpartylib.lib.micropayments import validate
 from tests import util
+from tests.standin import CounterpartyStandin
 from micropayment_core import scripts
 
 
@@ -56,6 +59,26 @@ def picopayments_server(request, server_db):
     request.addfinalizer(tear_down)
 
 
+@pytest.fixture(scope="function")
+def cplib_standin(request, picopayments_server):
+
+    # route counterparty calls through a local latency injecting server
+    standin = CounterpartyStandin.from_environ(
+        config.RPC, username=config.RPC_USER, password=config.RPC_PASSWORD,
+        handlers={"sendrawtransaction": api.sendrawtransaction}
+    )
+    counterparty_url = etc.counterparty_url
+    etc.counterparty_url = standin.start()
+    api.sendrawtransaction = api._make_cplib_call("sendrawtransaction")
+
+    def tear_down():
+        etc.counterparty_url = counterparty_url
+        standin.stop()
+
+    request.addfinalizer(tear_down)
+    return standin
+
+
 @pytest.fixture(scope="function")
 def connected_clients():
 
@@ -104,5 +127,6 @@ def connected_clients():
         clients.append(client)
 
     cron.fund_deposits()
+    broadcast.process()
 
     return clients
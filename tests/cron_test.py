@@ -9,7 +9,9 @@ from counterpartylib.test import util_test
 from picopayments_hub import api
 from picopayments_cli.mph import Mph
 from picopayments_hub import cron
+from picopayments_hub import broadcast
 from picopayments_hub import err
+from picopayments_hub import lib
 from tests import util
 
 
@@ -58,6 +60,7 @@ def test_cron_check_for_expire_before_commit(connected_clients, server_db):
     rawtxs = fred.update()
 
     rawtxs = cron.recover_funds()
+    broadcast.process()
     assert rawtxs is not None
     assert len(rawtxs["change"]) == 0
     assert len(rawtxs["commit"]) == 0
@@ -70,6 +73,7 @@ def test_cron_check_for_expire_before_commit(connected_clients, server_db):
         util_test.create_next_block(server_db)
 
     rawtxs = cron.recover_funds()
+    broadcast.process()
     assert rawtxs is not None
     assert len(rawtxs["change"]) == 0
     assert len(rawtxs["commit"]) == 0
@@ -115,3 +119,37 @@ def test_cron_check_for_expire_before_commit(connected_clients, server_db):
 
     rawtxs = cron.publish_commits()
     assert rawtxs == []
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_fund_deposits_resumes_interrupted_pass(monkeypatch):
+    util.fund_hub("XCP", 3)
+    for i in range(2):
+        wif = util.gen_funded_wif("XCP", 1000000, 1000000)
+        client = Mph(util.MockAPI(auth_wif=wif))
+        client.connect(1000000, expire_time=42, asset="XCP")
+
+    # hub stops after the first deposit was queued
+    send_funds = lib.send_funds
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        if calls:
+            raise Exception("Hub stopped")
+        calls.append(args)
+        return send_funds(*args, **kwargs)
+
+    monkeypatch.setattr(lib, "send_funds", interrupted)
+    with pytest.raises(Exception):
+        cron.fund_deposits()
+    assert broadcast.depth()["pending"] == 1
+
+    # resumed pass keeps the queued deposit and funds the other connection
+    monkeypatch.setattr(lib, "send_funds", send_funds)
+    deposits = cron.fund_deposits()
+    assert len(deposits) == 2
+    assert deposits[0]["address"] == calls[0][0]
+    assert broadcast.depth()["pending"] == 2
+
+    # next pass starts over, deposits are queued already
+    assert cron.fund_deposits() == []
@@ -0,0 +1,56 @@
+import pytest
+from micropayment_core import keys
+from picopayments_cli import auth
+from picopayments_hub import crypto
+
+
+BACKENDS = sorted(crypto.BACKENDS)
+DATA = {"handle": "ab" * 32, "sends": [], "amount": 42}
+
+
+@pytest.fixture
+def restore_backend(request):
+    name = crypto.backend()
+    request.addfinalizer(lambda: crypto.initialize(name))
+
+
+@pytest.mark.usefixtures("restore_backend")
+@pytest.mark.parametrize("signer", BACKENDS)
+@pytest.mark.parametrize("verifier", BACKENDS)
+def test_cross_check(signer, verifier):
+    wif = keys.generate_wif("XTN")
+    crypto.initialize(signer)
+    signed = crypto.sign_json(dict(DATA), wif)
+    assert signed["pubkey"] == keys.pubkey_from_wif(wif)
+
+    crypto.initialize(verifier)
+    assert crypto.verify_json(signed)
+    tampered = dict(signed, amount=43)
+    assert not crypto.verify_json(tampered)
+
+
+@pytest.mark.usefixtures("restore_backend")
+@pytest.mark.parametrize("name", BACKENDS)
+def test_compatible_with_client_auth(name):
+    crypto.initialize(name)
+    wif = keys.generate_wif("XTN")
+    assert auth.verify_json(crypto.sign_json(dict(DATA), wif))
+    assert crypto.verify_json(auth.sign_json(dict(DATA), wif))
+
+
+@pytest.mark.usefixtures("restore_backend")
+def test_auto_backend():
+    expected = "secp256k1" if "secp256k1" in BACKENDS else "python"
+    assert crypto.initialize("auto") == expected
+    with pytest.raises(ValueError):
+        crypto.initialize("unknown")
+
+
+@pytest.mark.usefixtures("restore_backend")
+@pytest.mark.skipif("secp256k1" not in BACKENDS, reason="needs coincurve")
+def test_malformed_signature():
+    crypto.initialize("secp256k1")
+    wif = keys.generate_wif("XTN")
+    signed = crypto.sign_json(dict(DATA), wif)
+    assert not crypto.verify_json(dict(signed, signature="deadbeef"))
+    assert not crypto.verify_json(dict(signed, signature="not hex"))
@@ -1,3 +1,5 @@
+import apsw
+import shutil
 import tempfile
 import pytest
 
@@ -8,6 +10,8 @@ from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
 import os
 from pycoin.serialize import b2h
 from picopayments_hub import db
+from picopayments_hub import etc
+from picopayments_hub import sql
 from picopayments_hub import api
 from picopayments_hub import lib
 
@@ -87,3 +91,140 @@ def test_saves_state_revoked(connected_clients):
     assert len(saved_c2h_state["commits_active"]) == 0
     assert len(saved_c2h_state["commits_revoked"]) == 1
     assert updated_c2h_state == saved_c2h_state
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_read_cursor_snapshot(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    with sql.read_cursor() as cursor:
+        before = db.connections_status(cursor=cursor)
+        assert len(before) == 6
+
+        # writes are not visible within the snapshot
+        db.set_connection_closed(handle=alice.handle)
+        assert db.connections_status(cursor=cursor) == before
+
+    # new snapshot sees committed writes
+    with sql.read_cursor() as cursor:
+        assert len(db.connections_status(cursor=cursor)) == 5
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_group_commit(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    with etc.database_lock:
+        with sql.group_commit() as ack:
+            db.set_connection_closed(handle=alice.handle)
+
+        # failed writes are rolled back without affecting the batch
+        try:
+            with sql.group_commit():
+                db.set_connection_closed(handle=bob.handle)
+                raise Exception("failed write")
+        except Exception:
+            pass
+
+    # not visible to readers before the batch is committed
+    if etc.group_commit_window:
+        with sql.read_cursor() as cursor:
+            assert len(db.connections_status(cursor=cursor)) == 6
+
+    ack.wait()
+    with sql.read_cursor() as cursor:
+        assert len(db.connections_status(cursor=cursor)) == 5
+    assert db.hub_connection(handle=alice.handle)["closed"]
+    assert not db.hub_connection(handle=bob.handle)["closed"]
+
+
+def test_hex_to_blob():
+    assert sql.hex_to_blob("00ff") == b"\x00\xff"
+    assert sql.hex_to_blob("") == b""
+
+    # only canonical hex is converted so values read back as written
+    assert sql.hex_to_blob("00FF") == "00FF"
+    assert sql.hex_to_blob("abc") == "abc"
+    assert sql.hex_to_blob("sync_fee") == "sync_fee"
+    assert sql.hex_to_blob(None) is None
+    assert sql.hex_to_blob(42) == 42
+    assert sql.blob_to_hex(sql.hex_to_blob("00ff")) == "00ff"
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_hex_stored_as_blob(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+
+    cursor = sql.get_cursor()
+    types = cursor.execute(
+        "SELECT typeof(handle), typeof(next_revoke_secret_hash) "
+        "FROM HubConnection WHERE handle = ?;",
+        (sql.hex_to_blob(alice.handle),)
+    ).fetchone()
+    assert types == ("blob", "blob")
+    types = cursor.execute(
+        "SELECT DISTINCT typeof(rawtx), typeof(script) FROM CommitActive;"
+    ).fetchall()
+    assert types == [("blob", "blob")]
+
+    # db api still takes and returns hex
+    connection = db.hub_connection(handle=alice.handle)
+    assert connection["handle"] == alice.handle
+    payments = db.unnotified_payments(payee_handle=bob.handle)
+    assert [p["payer_handle"] for p in payments] == [alice.handle]
+    entries = db.connections_status(after=alice.handle)
+    assert all(e["handle"] > alice.handle for e in entries)
+
+
+def test_migrate_hex_to_blob():
+    tempdir = tempfile.mkdtemp(prefix="picopayments_test_")
+    database_path = etc.database_path
+    database_connection = etc.database_connection
+    etc.database_path = os.path.join(tempdir, "hub.db")
+    try:
+
+        # database as it was before migration 8
+        connection = apsw.Connection(etc.database_path)
+        cursor = connection.cursor()
+        for version in range(8):
+            cursor.execute(db._MIGRATIONS[version])
+        cursor.execute("PRAGMA user_version = 8;")
+        secret_hash = b2h(os.urandom(20))
+        cursor.execute("INSERT INTO Secrets (hash, value) VALUES (?, ?);",
+                       (secret_hash, "not hex"))
+        connection.close()
+
+        db.setup()
+        cursor = sql.get_cursor()
+        types = cursor.execute(
+            "SELECT typeof(hash), typeof(value) FROM Secrets;"
+        ).fetchone()
+        assert types == ("blob", "text")
+        secret = db.get_secret(hash=secret_hash)
+        assert secret["hash"] == secret_hash
+        assert secret["value"] == "not hex"
+    finally:
+        etc.database_connection.close()
+        etc.database_path = database_path
+        etc.database_connection = database_connection
+        shutil.rmtree(tempdir)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_end_batch(connected_clients, monkeypatch):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    monkeypatch.setattr(etc, "group_commit_window", 60)
+
+    with etc.database_lock:
+        with sql.group_commit() as ack:
+            db.set_connection_closed(handle=alice.handle)
+
+        # writers outside of requests commit the batch and their own writes
+        sql.end_batch()
+        db.set_connection_closed(handle=bob.handle)
+
+    with sql.read_cursor() as cursor:
+        assert len(db.connections_status(cursor=cursor)) == 4
+    ack.wait()  # acknowledged without waiting for the window
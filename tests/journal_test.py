@@ -0,0 +1,162 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import db
+from picopayments_hub import err
+from picopayments_hub import etc
+from picopayments_hub import sql
+from picopayments_hub import journal
+from picopayments_hub import statecache
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _commit(script, notified=1):
+    return {"rawtx": "ff" + script, "script": script,
+            "payee_notified": notified}
+
+
+def _replay(previous, state):
+    diff = []
+    for name in journal.LISTS:
+        diff += journal._diff(name, previous[name], state[name])
+    result = journal.empty_state()
+    result.update(previous)
+    for kind, data in diff:
+        journal.apply(result, kind, data)
+    return result
+
+
+def test_diff_replays():
+    previous = journal.empty_state()
+    previous["commits_active"] = [_commit("aa"), _commit("bb", 0)]
+    previous["commits_requested"] = ["01"]
+
+    state = journal.empty_state()
+    state["commits_active"] = [_commit("aa"), _commit("cc", 0),
+                               _commit("bb")]
+    state["commits_revoked"] = [{"script": "dd", "revoke_secret": "02",
+                                 "payee_notified": 0}]
+    assert _replay(previous, state) == state
+
+    # reordered entries cannot be expressed as inserts
+    reordered = dict(previous, commits_active=previous["commits_active"][::-1])
+    assert journal._diff("commits_active", previous["commits_active"],
+                         reordered["commits_active"]) is None
+
+
+def test_diff_updates():
+    old = [_commit("aa", 0), _commit("bb", 0)]
+    new = [_commit("bb", 1), _commit("cc", 0)]
+    removed, added, updated = journal.changes("commits_active", old, new)
+    assert removed == [_commit("aa", 0)]
+    assert added == [(1, _commit("cc", 0))]
+    assert updated == [_commit("bb", 1)]
+
+    kinds = [kind for kind, data in journal._diff("commits_active", old, new)]
+    assert kinds == ["commit_removed", "commit_updated", "commit_added"]
+
+    # repeated keys cannot be expressed as keyed changes
+    assert journal.changes("commits_requested", ["01"], ["01", "01"]) is None
+
+
+def test_apply_notified():
+    state = journal.empty_state()
+    state["commits_active"] = [_commit("aa", 0)]
+    journal.apply(state, "commit_notified", {"script": "aa"})
+    assert state["commits_active"][0]["payee_notified"] == 1
+
+
+def _stored(channel_id):
+    return db._journal_state(channel_id, sql.get_cursor())
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_replay_matches_tables(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    for i in range(3):
+        alice.micro_send(bob.handle, 5)
+        alice.sync()
+        bob.sync()
+
+    for client in [alice, bob]:
+        connection = db.hub_connection(handle=client.handle)
+        for key in ["c2h_channel_id", "h2c_channel_id"]:
+            channel_id = connection[key]
+            assert journal.replay(channel_id) == _stored(channel_id)
+
+            # journaled as keyed changes, not as state resets
+            kinds = [e["kind"] for e in journal.events(channel_id)]
+            assert "state_reset" not in kinds
+
+    # payments and notifications are journaled by connection
+    kinds = [e["kind"] for e in journal.events(handle=bob.handle)]
+    assert kinds.count("payment_recorded") == 3
+    assert "payments_notified" in kinds
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_snapshots(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    connection = db.hub_connection(handle=alice.handle)
+    channel_id = connection["c2h_channel_id"]
+
+    snapshot_interval = etc.journal_snapshot_interval
+    etc.journal_snapshot_interval = 1
+    try:
+        for i in range(3):
+            alice.micro_send(bob.handle, 5)
+            alice.sync()
+    finally:
+        etc.journal_snapshot_interval = snapshot_interval
+
+    cursor = sql.get_cursor()
+    count = cursor.execute(
+        "SELECT count(*) FROM ChannelSnapshot WHERE channel_id = ?;",
+        (channel_id,)
+    ).fetchone()[0]
+    assert 1 < count <= etc.journal_snapshots_kept
+    assert journal.replay(channel_id) == _stored(channel_id)
+
+    # events before the oldest kept snapshot were pruned
+    oldest = cursor.execute(
+        "SELECT min(event_id) FROM ChannelSnapshot WHERE channel_id = ?;",
+        (channel_id,)
+    ).fetchone()[0]
+    assert all(e["id"] > oldest for e in journal.events(channel_id))
+    with pytest.raises(err.JournalPruned):
+        journal.replay(channel_id, until=oldest - 1)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_restore(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    connection = db.hub_connection(handle=alice.handle)
+    channel_id = connection["c2h_channel_id"]
+    expected = _stored(channel_id)
+    assert len(expected["commits_active"]) == 1
+
+    # lose current rows, i.e. crash mid sync
+    cursor = sql.get_cursor()
+    cursor.execute("DELETE FROM CommitActive WHERE channel_id = ?;",
+                   (channel_id,))
+    statecache.clear()
+
+    assert db.restore_channel_state(channel_id) == expected
+    assert _stored(channel_id) == expected
+    assert journal.replay(channel_id) == expected
+
+    # point in time, before the commit was added
+    events = journal.events(channel_id=channel_id)
+    added = [e["id"] for e in events if e["kind"] == "commit_added"]
+    state = db.restore_channel_state(channel_id, until=added[0] - 1)
+    assert state["commits_active"] == []
+    assert _stored(channel_id) == state
@@ -0,0 +1,78 @@
+import json
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from picopayments_hub import jsoncodec
+from picopayments_hub import srv
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+CODECS = sorted(jsoncodec.CODECS)
+DATA = {"handle": "ab" * 32, "payments": [{"amount": 5, "token": "ff"}],
+        "commit": None, "rebalance": True, "ratio": 0.5}
+
+
+@pytest.fixture
+def restore_codec(request):
+    name = jsoncodec.codec()
+    request.addfinalizer(lambda: jsoncodec.initialize(name))
+
+
+@pytest.mark.usefixtures("restore_codec")
+@pytest.mark.parametrize("name", CODECS)
+def test_roundtrip(name):
+    jsoncodec.initialize(name)
+    encoded = jsoncodec.dumps(DATA)
+    assert json.loads(encoded) == DATA
+    assert jsoncodec.loads(encoded) == DATA
+    assert jsoncodec.loads(encoded.encode("utf-8")) == DATA
+    with pytest.raises(ValueError):
+        jsoncodec.loads(b"{invalid")
+    with pytest.raises(ValueError):
+        jsoncodec.loads(b"\xff")
+
+    # values some codecs cannot encode natively
+    unusual = {1: 2 ** 70}
+    assert json.loads(jsoncodec.dumps(unusual)) == {"1": 2 ** 70}
+
+
+@pytest.mark.usefixtures("restore_codec")
+def test_auto_codec():
+    expected = next(n for n in ["orjson", "ujson", "json"] if n in CODECS)
+    assert jsoncodec.initialize("auto") == expected
+    with pytest.raises(ValueError):
+        jsoncodec.initialize("unknown")
+
+
+def _post(client, data):
+    response = client.post("/api/", data=data,
+                           content_type="application/json")
+    return json.loads(response.get_data(as_text=True))
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_application_decodes_once():
+    client = Client(srv.application, Response)
+
+    # parse error and invalid request as json-rpc would answer
+    assert _post(client, b"{invalid")["error"]["code"] == -32700
+    assert _post(client, b"[]")["error"]["code"] == -32600
+
+    request = {"method": "mph_status", "params": {}, "jsonrpc": "2.0"}
+    response = _post(client, json.dumps(dict(request, id=7)))
+    assert response["id"] == 7
+    assert "result" in response
+
+    # batch, notifications get no response
+    batch = [dict(request, id=1), request, dict(request, id=2)]
+    responses = _post(client, json.dumps(batch))
+    assert [r["id"] for r in responses] == [1, 2]
@@ -0,0 +1,82 @@
+import json
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from picopayments_hub import etc
+from picopayments_hub import metrics
+from picopayments_hub import srv
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def test_render_histogram():
+    metrics.reset()
+    metrics.observe("test_seconds", 0.003, method="foo")
+    metrics.observe("test_seconds", 42.0, method="foo")
+    text = metrics.render()
+    assert "# TYPE picopayments_hub_test_seconds histogram" in text
+    assert 'test_seconds_bucket{method="foo",le="0.0025"} 0' in text
+    assert 'test_seconds_bucket{method="foo",le="0.005"} 1' in text
+    assert 'test_seconds_bucket{method="foo",le="+Inf"} 2' in text
+    assert 'test_seconds_sum{method="foo"} 42.003' in text
+    assert 'test_seconds_count{method="foo"} 2' in text
+
+
+def test_timed_lock_outermost_hold():
+    metrics.reset()
+    lock = metrics.TimedLock("test")
+    with lock:
+        with lock:
+            pass
+    text = metrics.render()
+    assert 'lock_wait_seconds_count{lock="test"} 1' in text
+    assert 'lock_hold_seconds_count{lock="test"} 1' in text
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(etc, "metrics_enabled", True)
+    metrics.reset()
+    client = Client(srv.application, Response)
+    payload = {"method": "mph_status", "params": {}, "jsonrpc": "2.0",
+               "id": 0}
+    response = client.post("/api/", data=json.dumps(payload),
+                           content_type="application/json")
+    assert "result" in json.loads(response.get_data(as_text=True))
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'rpc_request_seconds_count{method="mph_status"} 1' in text
+    assert 'rpc_counterparty_calls_count{method="mph_status"} 1' in text
+    assert 'query_seconds_count{query="connections_status"} 1' in text
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_metrics_disabled(monkeypatch):
+    monkeypatch.setattr(etc, "metrics_enabled", False)
+    client = Client(srv.application, Response)
+    assert client.get("/metrics").status_code == 404
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_unknown_methods_share_label(monkeypatch):
+    monkeypatch.setattr(etc, "metrics_enabled", True)
+    metrics.reset()
+    client = Client(srv.application, Response)
+    for method in ["foo", "bar", ["list"]]:
+        payload = {"method": method, "params": {}, "jsonrpc": "2.0", "id": 0}
+        client.post("/api/", data=json.dumps(payload),
+                    content_type="application/json")
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'rpc_request_seconds_count{method="unknown"} 3' in text
+    assert 'method="foo"' not in text
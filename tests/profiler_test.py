@@ -0,0 +1,88 @@
+import os
+import time
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from micropayment_core.keys import generate_wif
+from picopayments_cli import auth
+from picopayments_hub import api
+from picopayments_hub import err
+from picopayments_hub import etc
+from picopayments_hub import lib
+from picopayments_hub import profiler
+from picopayments_hub import wallet
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _admin_call(method, **kwargs):
+    return getattr(api, method)(**auth.sign_json(kwargs, lib.load_wif()))
+
+
+def _busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_cprofile_next_requests():
+    result = _admin_call("mph_profile_start", requests=1,
+                         methods=["mph_status"])
+    assert result["finished"] is False
+
+    for i in range(2):
+        with profiler.request("mph_status"):
+            api.mph_status()
+
+    result = _admin_call("mph_profile_results", save=True)
+    assert result["finished"] is True
+    assert result["requests"] == {"mph_status": 1}
+    assert "mph_status" in result["pstats"]["mph_status"]
+    assert len(result["files"]) == 1
+    assert os.path.exists(result["files"][0])
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_sample_time_window():
+    _admin_call("mph_profile_start", mode="sample", seconds=60,
+                methods=["busy"])
+    with profiler.request("busy"):
+        _busy(0.2)
+    result = _admin_call("mph_profile_results", stop=True)
+    assert result["finished"] is True
+    assert "profiler_test.py:_busy" in result["collapsed"]["busy"]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_profile_admin_only():
+    wif = generate_wif(netcode=etc.netcode)
+    with pytest.raises(err.NotAdmin):
+        api.mph_profile_start(**auth.sign_json({}, wif))
+    with pytest.raises(err.NotAdmin):
+        api.mph_profile_results(**auth.sign_json({}, wif))
+
+    # hub pubkey is public, signature must be valid
+    forged = auth.sign_json({"stop": True}, wallet.wif())
+    for method in [api.mph_profile_start, api.mph_profile_results]:
+        params = auth.sign_json({}, wallet.wif())
+        params["signature"] = forged["signature"]
+        with pytest.raises(err.InvalidSignature):
+            method(**params)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_save_stays_in_profiles_dir():
+    profiler.start(requests=1, methods=["../../escape"])
+    with profiler.request("../../escape"):
+        pass
+    paths = profiler.save()
+    assert len(paths) == 1
+    dirname = os.path.join(etc.basedir, "profiles")
+    assert os.path.dirname(os.path.dirname(paths[0])) == dirname
@@ -0,0 +1,132 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import db
+from picopayments_hub import etc
+from picopayments_hub import sql
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_defer_small_transfers(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    etc.rebalance_min_delta = 1000
+    try:
+        alice.micro_send(bob.handle, 5)
+        alice.sync()
+
+        # bob is notified of payment but hub defers commit
+        h2c_commits = len(bob.h2c_state["commits_active"])
+        assert len(bob.sync()) == 1
+        assert len(bob.h2c_state["commits_active"]) == h2c_commits
+        assert bob.get_status()["send_balance"] == 1000000 - 1
+        connection = db.hub_connection(handle=bob.handle)
+        assert connection["rebalance_pending_since"] is not None
+    finally:
+        etc.rebalance_min_delta = 0
+
+    # deferred funds netted into the next commit
+    assert bob.sync() == []
+    assert bob.get_status()["send_balance"] == 1000000 + 5 - 2
+    connection = db.hub_connection(handle=bob.handle)
+    assert connection["rebalance_pending_since"] is None
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_staleness_forces_rebalance(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    etc.rebalance_min_delta = 1000
+    etc.rebalance_max_staleness = 1
+    try:
+        alice.micro_send(bob.handle, 5)
+        alice.sync()
+        bob.sync()
+        connection = db.hub_connection(handle=bob.handle)
+        assert connection["rebalance_pending_since"] is not None
+
+        # pretend funds have been deferred long enough
+        cursor = sql.get_cursor()
+        cursor.execute(
+            "UPDATE HubConnection SET rebalance_pending_since = 0 "
+            "WHERE handle = ?;", (sql.hex_to_blob(bob.handle),)
+        )
+        bob.sync()
+        assert bob.get_status()["send_balance"] == 1000000 + 5 - 2
+    finally:
+        etc.rebalance_min_delta = 0
+        etc.rebalance_max_staleness = 0
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_expiry_forces_rebalance(connected_clients, monkeypatch):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    monkeypatch.setattr(etc, "rebalance_min_delta", 1000)
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    bob.sync()
+    connection = db.hub_connection(handle=bob.handle)
+    assert connection["rebalance_pending_since"] is not None
+
+    # h2c deposit about to expire, no staleness limit
+    monkeypatch.setattr(etc, "expire_clearance", 21)
+    bob.sync()
+    connection = db.hub_connection(handle=bob.handle)
+    assert connection["rebalance_pending_since"] is None
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_close_flushes_deferred_funds(connected_clients, monkeypatch):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    monkeypatch.setattr(etc, "rebalance_min_delta", 1000)
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    bob.sync()
+    connection = db.hub_connection(handle=bob.handle)
+    h2c_state = db.load_channel_state(connection["h2c_channel_id"],
+                                      connection["asset"])
+    h2c_commits = len(h2c_state["commits_active"])
+
+    bob.close()
+    connection = db.hub_connection(handle=bob.handle)
+    assert connection["closed"]
+    assert connection["rebalance_pending_since"] is None
+    h2c_state = db.load_channel_state(connection["h2c_channel_id"],
+                                      connection["asset"])
+    assert len(h2c_state["commits_active"]) == h2c_commits + 1
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_close_returns_flushed_commit(connected_clients, monkeypatch):
+    alice, bob, charlie, david, eric, fred = connected_clients
+
+    monkeypatch.setattr(etc, "rebalance_min_delta", 1000)
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    bob.sync()
+    h2c_commits = len(bob.h2c_state["commits_active"])
+
+    result = bob.api.mph_close(handle=bob.handle)
+    assert result["commit"] is not None
+    assert result["revokes"] == []
+    bob.h2c_state = bob.api.mpc_add_commit(
+        state=bob.h2c_state,
+        commit_rawtx=result["commit"]["rawtx"],
+        commit_script=result["commit"]["script"]
+    )
+    assert len(bob.h2c_state["commits_active"]) == h2c_commits + 1
+    scripts = [c["script"] for c in bob.h2c_state["commits_active"]]
+    assert result["commit"]["script"] in scripts
+
+    # sent only once
+    assert bob.api.mph_close(handle=bob.handle)["commit"] is None
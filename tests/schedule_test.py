@@ -0,0 +1,234 @@
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import api
+from picopayments_hub import db
+from picopayments_hub import err
+from picopayments_hub import etc
+from picopayments_hub import cron
+from picopayments_hub import lib
+from picopayments_hub import sql
+from picopayments_hub import schedule
+from picopayments_hub import broadcast
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _connections():
+    # as returned by hub_connections_complete, nearest expiry first
+    return [
+        {"id": 4, "ttl": 2},
+        {"id": 2, "ttl": 10},
+        {"id": 1, "ttl": 100},
+        {"id": 5, "ttl": 200},
+        {"id": 3, "ttl": None},  # closed
+    ]
+
+
+def _ids(connections):
+    return [c["id"] for c in connections]
+
+
+def _output_rows(name):
+    return sql.fetchone(
+        "SELECT count(*) AS count FROM CronJobOutput WHERE job = :job;",
+        {"job": name}
+    )["count"]
+
+
+def _run(job, fail_at=None, slow_at=None, budget=0):
+    """Process connections as cron does, recording their ids as outputs."""
+    processed = []
+    for connection in schedule.scheduled(job, _connections(), budget):
+        with sql.transaction():
+            if connection["id"] == fail_at:
+                raise Exception("Hub stopped")
+            job.checkpoint(connection, connection["id"])
+        processed.append(connection["id"])
+        if connection["id"] == slow_at:
+            time.sleep(0.1)  # exceed budget
+    return processed
+
+
+def test_urgent_first():
+    ordered = schedule.order(_connections())
+    assert _ids(ordered) == [4, 2, 1, 3, 5]
+    assert _ids(schedule.order(_connections(), after=3)) == [4, 2, 5]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_complete_pass_finishes():
+    job = schedule.Job("job")
+    assert _run(job) == [4, 2, 1, 3, 5]
+    job = schedule.Job("job")
+    assert not job.running
+    assert job.position == 0
+    assert job.outputs == []
+    assert _output_rows("job") == 0
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_budget_resumes_pass():
+    job = schedule.Job("job")
+    assert _run(job, slow_at=1, budget=0.05) == [4, 2, 1]
+    assert _output_rows("job") == 3  # one per connection
+
+    # urgent connections first again, then those not yet processed
+    job = schedule.Job("job")
+    assert job.running
+    assert job.position == 1
+    assert job.outputs == [4, 2, 1]
+    assert _run(job) == [4, 2, 3, 5]
+    assert job.outputs == [4, 2, 1, 4, 2, 3, 5]
+
+    # next pass starts over
+    job = schedule.Job("job")
+    assert _run(job) == [4, 2, 1, 3, 5]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_interrupted_pass_resumes():
+    job = schedule.Job("job")
+    with pytest.raises(Exception):
+        _run(job, fail_at=3)
+
+    # work of the failed connection was rolled back with its checkpoint
+    job = schedule.Job("job")
+    assert job.running
+    assert job.position == 1
+    assert job.outputs == [4, 2, 1]
+    assert _run(job) == [4, 2, 3, 5]
+
+    # job state is per job
+    other = schedule.Job("other")
+    assert not other.running
+    assert _run(other) == [4, 2, 1, 3, 5]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_at_least_one_per_call(monkeypatch):
+    monkeypatch.setattr(etc, "cron_pass_budget", 1e-9)
+    job = schedule.Job("job")
+    processed = []
+    for connection in schedule.scheduled(job, _connections()):
+        processed.append(connection["id"])
+        job.checkpoint(connection)
+        time.sleep(0.001)
+    assert processed == [4]
+
+
+def _handles(connections):
+    return [c["handle"] for c in connections]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_closed_by_recovery_deadline(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    db.save_connection_status(handle=alice.handle, asset="XCP", balance=0,
+                              ttl=5, status="open")
+    db.set_connection_closed(handle=alice.handle)
+
+    # deadline kept when the status is removed, estimated in blocks
+    connections = db.hub_connections_recoverable()
+    closed = connections[_handles(connections).index(alice.handle)]
+    assert 4 <= closed["ttl"] <= 5
+    assert schedule.is_urgent(closed)
+    ordered = schedule.order(connections)
+    assert ordered.index(closed) < min(
+        ordered.index(c) for c in ordered if not schedule.is_urgent(c)
+    )
+
+    # fully recovered connections are done
+    db.set_connection_recovered(handle=alice.handle)
+    assert alice.handle not in _handles(db.hub_connections_recoverable())
+    assert alice.handle in _handles(db.hub_connections_complete())
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_is_recovered(connected_clients, monkeypatch):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    connection = db.hub_connection(handle=alice.handle)
+    c2h_state = db.load_channel_state(connection["c2h_channel_id"],
+                                      connection["asset"])
+    h2c_state = db.load_channel_state(connection["h2c_channel_id"],
+                                      connection["asset"])
+    cursor = sql.get_cursor()
+
+    utxos = [{"txid": "00" * 32, "vout": 0, "amount": 0.0001}]
+    monkeypatch.setattr(api, "get_unspent_txouts", lambda **kw: utxos)
+    assert not lib._is_recovered(alice.handle, c2h_state, h2c_state, cursor)
+
+    utxos = []
+    assert lib._is_recovered(alice.handle, c2h_state, h2c_state, cursor)
+
+    # queued transactions must confirm first
+    broadcast.enqueue("01000000" "01" + "11" * 32 + "00000000" "00"
+                      "ffffffff" "01" "e803000000000000" "00" "00000000",
+                      "recover", handle=alice.handle)
+    assert not lib._is_recovered(alice.handle, c2h_state, h2c_state, cursor)
+
+
+def _lease_owner(name):
+    return sql.fetchone("SELECT lease_owner FROM CronJob WHERE name = :name;",
+                        {"name": name})["lease_owner"]
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_leased_to_other_process():
+    sql.execute(
+        "INSERT INTO CronJob (name, lease_owner, lease_expires) "
+        "VALUES ('update_status', 'other', :expires);",
+        {"expires": int(time.time()) + 60}
+    )
+    with pytest.raises(err.CronJobLeased):
+        schedule.Job("update_status")
+    with pytest.raises(err.CronJobLeased):
+        cron.run_job("all")
+    assert _lease_owner("update_status") == "other"
+    assert _lease_owner("fund_deposits") is None  # released again
+
+    # expired leases are taken over, checkpoints renew them
+    sql.execute("UPDATE CronJob SET lease_expires = 0;")
+    job = schedule.Job("update_status")
+    assert _lease_owner("update_status") == schedule.OWNER
+    job.checkpoint({"id": 1, "ttl": None})
+    expires = sql.fetchone(
+        "SELECT lease_expires FROM CronJob WHERE name = 'update_status';"
+    )["lease_expires"]
+    assert expires > time.time()
+    schedule.release()
+    assert _lease_owner("update_status") is None
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_lease_of_crashed_process_taken_over():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    owner = "{0}:{1}:00".format(socket.gethostname(), process.pid)
+    sql.execute(
+        "INSERT INTO CronJob (name, lease_owner, lease_expires) "
+        "VALUES ('update_status', :owner, :expires);",
+        {"owner": owner, "expires": int(time.time()) + 60}
+    )
+    schedule.acquire(["update_status"])
+    assert _lease_owner("update_status") == schedule.OWNER
+    schedule.release()
+
+    # running processes keep their lease, i.e. init
+    sql.execute(
+        "UPDATE CronJob SET lease_owner = :owner, lease_expires = :expires;",
+        {"owner": "{0}:1:00".format(socket.gethostname()),
+         "expires": int(time.time()) + 60}
+    )
+    with pytest.raises(err.CronJobLeased):
+        schedule.acquire(["update_status"])
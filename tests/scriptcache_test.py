@@ -0,0 +1,56 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from micropayment_core import scripts
+from micropayment_core import util
+from picopayments_hub import etc
+from picopayments_hub import metrics
+from picopayments_hub import scriptcache
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_deposit_data_cached(connected_clients):
+    alice = connected_clients[0]
+    script = alice.c2h_state["deposit_script"]
+    scriptcache.clear()
+
+    data = scriptcache.deposit(script)
+    assert data == {
+        "payer_pubkey": scripts.get_deposit_payer_pubkey(script),
+        "payee_pubkey": scripts.get_deposit_payee_pubkey(script),
+        "expire_time": scripts.get_deposit_expire_time(script),
+        "spend_secret_hash": scripts.get_deposit_spend_secret_hash(script),
+        "address": util.script_address(script, netcode=etc.netcode),
+    }
+    assert scriptcache.deposit(script) is data
+    stats = scriptcache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert "picopayments_hub_script_cache_hits 1" in metrics.render()
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_lru_bounded(connected_clients):
+    scripts_hex = [c.c2h_state["deposit_script"] for c in connected_clients]
+    scriptcache.clear()
+    size = etc.script_cache_size
+    etc.script_cache_size = 2
+    try:
+        for script in scripts_hex[:3]:
+            scriptcache.address(script)
+        assert scriptcache.stats()["size"] == 2
+        scriptcache.address(scripts_hex[2])  # most recent kept
+        assert scriptcache.stats()["hits"] == 1
+        scriptcache.address(scripts_hex[0])  # least recent evicted
+        assert scriptcache.stats()["misses"] == 4
+    finally:
+        etc.script_cache_size = size
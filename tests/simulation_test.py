@@ -1,3 +1,6 @@
+import os
+import time
+import random
 import tempfile
 import pytest
 
@@ -5,68 +8,109 @@ import pytest
 # from counterpartylib.test import conftest
 
 from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
-from counterpartylib.test.fixtures.params import DP
-from micropayment_core.keys import address_from_wif
-from micropayment_core import scripts
-from picopayments_cli.mph import Mph
 from picopayments_hub import api
-from picopayments_hub import lib
+from picopayments_hub import etc
 from picopayments_hub import cron
+from tests import benchmark
 from tests import util
 
 
-# from tests.util import MockAPI
-
-
 FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
 FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
 
 
 ASSET = "XCP"
-FUNDING_WIF = DP["addresses"][0][2]  # XTC: 91950000000, BTC: 199909140
-FUNDING_ADDRESS = address_from_wif(FUNDING_WIF)
+QUANTITY = 1000000
 
+# load generator settings, defaults keep the simulation fast for the suite
+CLIENTS = int(os.environ.get("PICOPAYMENTS_SIMULATION_CLIENTS", 4))
+ROUNDS = int(os.environ.get("PICOPAYMENTS_SIMULATION_ROUNDS", 4))
+MAX_PAYMENTS = int(os.environ.get("PICOPAYMENTS_SIMULATION_PAYMENTS", 5))
+MAX_AMOUNT = int(os.environ.get("PICOPAYMENTS_SIMULATION_AMOUNT", 10))
+CRON_INTERVAL = int(os.environ.get("PICOPAYMENTS_SIMULATION_CRON", 2))
+SEED = int(os.environ.get("PICOPAYMENTS_SIMULATION_SEED", 0))
 
-def get_txs(txids):
-    return api.getrawtransaction_batch(txhash_list=txids)
 
+def _database_size():
+    size = 0
+    for suffix in ["", "-wal"]:
+        path = etc.database_path + suffix
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
 
-@pytest.mark.usefixtures("picopayments_server")
-def test_simulation_xcp():
-
-    # fund server
-    for i in range(2):
-        address = lib.get_funding_address()
-        unsigned_rawtx = api.create_send(**{
-            'source': FUNDING_ADDRESS,
-            'destination': address,
-            'asset': ASSET,
-            'quantity': 1000000,
-            'regular_dust_size': 1000000
-        })
-        signed_rawtx = scripts.sign_deposit(
-            get_txs, FUNDING_WIF, unsigned_rawtx)
-        api.sendrawtransaction(tx_hex=signed_rawtx)
-
-    # connect clients
-    clients = []
-    for i in range(2):
-        bob_wif = util.gen_funded_wif(ASSET, 1000000, 1000000)
-        client = Mph(util.MockAPI(auth_wif=bob_wif))
-        txid = client.connect(1000000, 65535, asset=ASSET)
-        assert txid is not None
 
-        status = client.get_status()
-        assert status["send_balance"] == 1000000
-        assert status["send_deposit_ttl"] is not None
-        assert status["recv_deposit_ttl"] is None  # hub deposit not yet made
+def _queue_payments(rand, clients):
+    sent = []
+    for client in clients:
+        for i in range(rand.randint(0, MAX_PAYMENTS)):
+            payee = rand.choice([c for c in clients if c is not client])
+            amount = rand.randint(1, MAX_AMOUNT)
+            sent.append(client.micro_send(payee.handle, amount))
+    return sent
 
-        clients.append(client)
 
-    # server funds deposits
-    cron.run_all()
+def _sync_all(rand, clients, recorder):
+    received = []
+    for client in rand.sample(clients, len(clients)):
+        with recorder.measure("sync"):
+            payments = client.sync()
+        received += [p["token"] for p in payments]
+    return received
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_simulation_xcp(monkeypatch):
+    rand = random.Random(SEED)
+    recorder = benchmark.Recorder()
+
+    # fund hub and connect clients
+    util.fund_hub(ASSET, CLIENTS)
+    clients = util.connect_clients(ASSET, CLIENTS, quantity=QUANTITY,
+                                   expire_time=65535)
     for client in clients:
         status = client.get_status()
-        assert status["recv_deposit_ttl"] is not None  # hub deposit now made
-
-    # FIXME implement simulation test
+        assert status["send_balance"] == QUANTITY
+        assert status["recv_deposit_ttl"] is not None  # hub deposit made
+
+    # drive randomized payment traffic between handles
+    recorder.patch(monkeypatch, api, "_cplib_call",
+                   label=lambda kwargs: "cplib." + kwargs["method"])
+    recorder.patch(monkeypatch, api, "sendrawtransaction",
+                   label=lambda kwargs: "cplib.sendrawtransaction")
+    initial_size = _database_size()
+    sent = []
+    received = []
+    begin = time.perf_counter()
+    for round_number in range(1, ROUNDS + 1):
+        sent += _queue_payments(rand, clients)
+        received += _sync_all(rand, clients, recorder)
+        if round_number % CRON_INTERVAL == 0:
+            with recorder.measure("cron"):
+                cron.run_all()
+
+    # deliver payments still waiting for the payee to sync
+    received += _sync_all(rand, clients, recorder)
+    elapsed = time.perf_counter() - begin
+    assert sorted(received) == sorted(sent)
+
+    # report
+    results = recorder.results()
+    cplib_calls = {
+        k[len("cplib."):]: v["count"]
+        for k, v in results.items() if k.startswith("cplib.")
+    }
+    report = {
+        "clients": CLIENTS,
+        "rounds": ROUNDS,
+        "payments": len(sent),
+        "payments_per_second": len(sent) / elapsed,
+        "sync_p50": results["sync"]["p50"],
+        "sync_p99": results["sync"]["p99"],
+        "db_growth": _database_size() - initial_size,
+        "cplib_calls": cplib_calls,
+    }
+    assert results["sync"]["count"] == CLIENTS * (ROUNDS + 1)
+    assert report["sync_p50"] <= report["sync_p99"]
+    if benchmark.RESULTS_PATH:
+        recorder.save("simulation", elapsed=elapsed, **report)
@@ -13,6 +13,7 @@ from picopayments_hub import api
 from picopayments_hub import lib
 from picopayments_hub import db
 from picopayments_hub import cron
+from picopayments_hub import broadcast
 from micropayment_core import scripts
 from tests import util
 
@@ -95,7 +96,8 @@ def test_standard_usage(server_db):
 
     # server funds deposits
     assert len(cron.fund_deposits()) == 4
-    assert len(cron.fund_deposits()) == 0
+    assert len(cron.fund_deposits()) == 0  # queued, not funded twice
+    assert len(broadcast.process()) == 4
     for client in clients:
         status = client.get_status()
         assert status["recv_deposit_ttl"] is not None  # hub deposit now made
@@ -268,7 +270,8 @@ def test_user_doesnt_publish_commit(server_db):
 
     # server funds deposits
     assert len(cron.fund_deposits()) == 2
-    assert len(cron.fund_deposits()) == 0
+    assert len(cron.fund_deposits()) == 0  # queued, not funded twice
+    assert len(broadcast.process()) == 2
     for client in clients:
         status = client.get_status()
         assert status["recv_deposit_ttl"] is not None  # hub deposit now made
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import Counter
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+from picopayments_cli.rpc import jsonrpc_call
+from picopayments_cli.rpc import JsonRpcCallFailed
+
+
+def _parse_method_latency(text):
+    """Parse "method=seconds,method=seconds" into a dict."""
+    method_latency = {}
+    for item in filter(None, (text or "").split(",")):
+        method, seconds = item.split("=")
+        method_latency[method.strip()] = float(seconds)
+    return method_latency
+
+
+class CounterpartyStandin(object):
+    """Local counterparty json-rpc server with latency and failure injection.
+
+    Calls are forwarded to the upstream counterparty api (the test fixture
+    chain) unless a local handler for the method is given.
+    """
+
+    def __init__(self, upstream_url, username=None, password=None,
+                 handlers=None, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 method_latency=None, seed=None):
+        self.upstream_url = upstream_url
+        self.username = username
+        self.password = password
+        self.handlers = handlers or {}
+        self.latency = latency  # seconds added to every call
+        self.jitter = jitter  # seconds of uniform random extra delay
+        self.failure_rate = failure_rate  # fraction of calls failing
+        self.method_latency = method_latency or {}  # overrides latency
+        self.calls = Counter()  # method -> calls received
+        self.failures = Counter()  # method -> failures injected
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @classmethod
+    def from_environ(cls, upstream_url, **kwargs):
+        env = os.environ
+        kwargs.setdefault("latency", float(env.get("CP_STANDIN_LATENCY", 0)))
+        kwargs.setdefault("jitter", float(env.get("CP_STANDIN_JITTER", 0)))
+        kwargs.setdefault("failure_rate",
+                          float(env.get("CP_STANDIN_FAILURE_RATE", 0)))
+        kwargs.setdefault("method_latency", _parse_method_latency(
+            env.get("CP_STANDIN_METHOD_LATENCY")
+        ))
+        return cls(upstream_url, **kwargs)
+
+    def _delay(self, method):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.failure_rate
+        delay = self.method_latency.get(method, self.latency) + jitter
+        return delay, failed
+
+    def _call(self, method, params):
+        handler = self.handlers.get(method)
+        if handler is not None:
+            return handler(**params)
+        return jsonrpc_call(self.upstream_url, method, params=params,
+                            username=self.username, password=self.password)
+
+    def _handle(self, payload):
+        method = payload.get("method")
+        params = payload.get("params") or {}
+        response = {"jsonrpc": "2.0", "id": payload.get("id")}
+        with self._lock:
+            self.calls[method] += 1
+
+        delay, failed = self._delay(method)
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.failures[method] += 1
+            response["error"] = {
+                "code": -32000, "message": "Injected failure: " + method
+            }
+            return response
+
+        try:
+            response["result"] = self._call(method, params)
+        except JsonRpcCallFailed as e:
+            response["error"] = {"code": -32000, "message": str(e)}
+        return response
+
+    @Request.application
+    def application(self, request):
+        payload = json.loads(request.get_data(as_text=True))
+        response = self._handle(payload)
+        return Response(json.dumps(response), mimetype='application/json')
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a background thread, returns the api url."""
+        self._server = make_server(host, port, self.application,
+                                   threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return "http://{0}:{1}/api/".format(host, self._server.server_port)
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
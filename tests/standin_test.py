@@ -0,0 +1,50 @@
+import time
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_cli.rpc import JsonRpcCallFailed
+from picopayments_hub import api
+from picopayments_hub import lib
+from tests import util
+from tests.standin import _parse_method_latency
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def test_parse_method_latency():
+    assert _parse_method_latency(None) == {}
+    assert _parse_method_latency("get_balances=0.1, unpack=2") == {
+        "get_balances": 0.1, "unpack": 2.0
+    }
+
+
+def test_forwards_and_counts(cplib_standin):
+    address = lib.get_funding_address()
+    balances = api.get_balances(filters=[
+        {'field': 'address', 'op': '==', 'value': address},
+    ])
+    assert balances == []
+    util.gen_funded_wif("XCP", 1000000, 1000000)
+    assert cplib_standin.calls["get_balances"] == 1
+    assert cplib_standin.calls["create_send"] == 1
+    assert cplib_standin.calls["sendrawtransaction"] == 1
+
+
+def test_latency(cplib_standin):
+    cplib_standin.method_latency = {"get_balances": 0.2}
+    begin = time.perf_counter()
+    api.get_balances(filters=[])
+    assert time.perf_counter() - begin >= 0.2
+
+
+def test_failure_rate(cplib_standin):
+    cplib_standin.failure_rate = 1.0
+    with pytest.raises(JsonRpcCallFailed):
+        api.get_balances(filters=[])
+    assert cplib_standin.failures["get_balances"] == 1
@@ -0,0 +1,91 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from picopayments_hub import db
+from picopayments_hub import journal
+from picopayments_hub import sql
+from picopayments_hub import statecache
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+def _load_uncached(channel_id, asset):
+    statecache.clear()
+    return db.load_channel_state(channel_id, asset)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_repeat_loads_cached(connected_clients):
+    alice = connected_clients[0]
+    connection = db.hub_connection(handle=alice.handle)
+    channel_id = connection["c2h_channel_id"]
+    statecache.clear()
+
+    state = db.load_channel_state(channel_id, "XCP")
+    state["commits_active"].append("junk")  # callers get copies
+    assert db.load_channel_state(channel_id, "XCP") != state
+    assert statecache.stats()["hits"] == 1
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_write_through(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    alice.micro_send(bob.handle, 5)
+    alice.sync()
+    bob.sync()
+
+    for client in [alice, bob]:
+        connection = db.hub_connection(handle=client.handle)
+        for key in ["c2h_channel_id", "h2c_channel_id"]:
+            cached = db.load_channel_state(connection[key], "XCP")
+            assert cached == _load_uncached(connection[key], "XCP")
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_rollback_invalidates(connected_clients):
+    alice = connected_clients[0]
+    connection = db.hub_connection(handle=alice.handle)
+    channel_id = connection["c2h_channel_id"]
+    state = db.load_channel_state(channel_id, "XCP")
+
+    changed = dict(state, commits_requested=["00" * 20])
+    with pytest.raises(ValueError):
+        with sql.transaction():
+            db.save_channel_state(channel_id, changed)
+            assert db.load_channel_state(channel_id, "XCP") == changed
+            raise ValueError("rollback")
+
+    assert db.load_channel_state(channel_id, "XCP") == state
+    assert _load_uncached(channel_id, "XCP") == state
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_journal_diffs_cached_state(connected_clients, monkeypatch):
+    alice = connected_clients[0]
+    connection = db.hub_connection(handle=alice.handle)
+    channel_id = connection["c2h_channel_id"]
+    state = db.load_channel_state(channel_id, "XCP")
+
+    def uncached(channel_id, cursor):
+        raise AssertionError("previous state queried")
+
+    # previous state of the journal diff comes from the cache
+    monkeypatch.setattr(db, "_journal_state", uncached)
+    requested = state["commits_requested"] + ["00" * 20]
+    db.save_channel_state(channel_id, dict(state,
+                                           commits_requested=requested))
+    db.add_revoke_secret(channel_id, "11" * 20, "22" * 32)
+    monkeypatch.undo()
+
+    assert journal.replay(channel_id) == db._journal_state(
+        channel_id, sql.get_cursor()
+    )
+    assert db.load_channel_state(channel_id, "XCP") == _load_uncached(
+        channel_id, "XCP"
+    )
@@ -11,6 +11,7 @@ from picopayments_cli.mph import Mph
 from picopayments_hub import api
 from picopayments_hub import lib
 from picopayments_hub import cron
+from picopayments_hub import broadcast
 from micropayment_core import scripts
 from tests import util
 
@@ -63,6 +64,7 @@ def test_standard_usage(server_db):
     # server funds deposits
     assert len(cron.fund_deposits()) == 4
     assert len(cron.fund_deposits()) == 0
+    assert len(broadcast.process()) == 4
     for client in clients:
         status = client.get_status()
         assert status["recv_deposit_ttl"] is not None  # hub deposit now made
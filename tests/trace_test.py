@@ -0,0 +1,62 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+from micropayment_core.keys import generate_wif
+from picopayments_cli import auth
+from picopayments_hub import api
+from picopayments_hub import err
+from picopayments_hub import etc
+from picopayments_hub import lib
+from picopayments_hub import trace
+from picopayments_hub import wallet
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_trace_sync(connected_clients):
+    alice, bob, charlie, david, eric, fred = connected_clients
+    etc.trace_sample_rate = 1.0
+
+    alice.micro_send(bob.handle, 5)
+    with trace.request("mph_sync") as sampled:
+        alice.sync()
+    assert sampled is not None
+
+    traces = api.mph_traces(**auth.sign_json({"limit": 1}, lib.load_wif()))
+    assert len(traces["traces"]) == 1
+    result = traces["traces"][0]
+    assert result["trace_id"] == sampled["trace_id"]
+    names = set(span["name"] for span in result["spans"])
+    assert {"verify", "sql", "counterparty", "sign"} <= names
+    assert all("duration" in span for span in result["spans"])
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_not_sampled():
+    etc.trace_sample_rate = 0.0
+    with trace.request("mph_status") as sampled:
+        with trace.span("verify"):
+            pass
+    assert sampled is None
+    assert trace.current_trace_id() is None
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_traces_admin_only():
+    wif = generate_wif(netcode=etc.netcode)
+    with pytest.raises(err.NotAdmin):
+        api.mph_traces(**auth.sign_json({}, wif))
+
+    # hub pubkey is public, signature must be valid
+    params = auth.sign_json({}, wallet.wif())
+    forged = auth.sign_json({"limit": 1}, wallet.wif())
+    params["signature"] = forged["signature"]
+    with pytest.raises(err.InvalidSignature):
+        api.mph_traces(**params)
@@ -1,7 +1,11 @@
 import copy
 from picopayments_hub import api
 from picopayments_hub import etc
+from picopayments_hub import lib
+from picopayments_hub import cron
+from picopayments_hub import broadcast
 from picopayments_cli import auth
+from picopayments_cli.mph import Mph
 from micropayment_core.keys import generate_wif
 from micropayment_core.keys import address_from_wif
 from counterpartylib.test.fixtures.params import DP
@@ -54,3 +58,31 @@ def gen_funded_wif(asset, asset_quantity, btc_quantity):
     signed_rawtx = scripts.sign_deposit(get_txs, src_wif, unsigned_rawtx)
     api.sendrawtransaction(tx_hex=signed_rawtx)
     return dest_wif
+
+
+def fund_hub(asset, count, quantity=1000000):
+    src_wif = DP["addresses"][0][2]
+    src_address = address_from_wif(src_wif)
+    address = lib.get_funding_address()
+    for i in range(count):
+        unsigned_rawtx = api.create_send(**{
+            'source': src_address,
+            'destination': address,
+            'asset': asset,
+            'quantity': quantity,
+            'regular_dust_size': quantity
+        })
+        signed_rawtx = scripts.sign_deposit(get_txs, src_wif, unsigned_rawtx)
+        api.sendrawtransaction(tx_hex=signed_rawtx)
+
+
+def connect_clients(asset, count, quantity=1000000, expire_time=42):
+    clients = []
+    for i in range(count):
+        wif = gen_funded_wif(asset, quantity, quantity)
+        client = Mph(MockAPI(auth_wif=wif))
+        client.connect(quantity, expire_time=expire_time, asset=asset)
+        clients.append(client)
+    cron.fund_deposits()
+    broadcast.process()
+    return clients
@@ -0,0 +1,67 @@
+import tempfile
+import pytest
+
+# this is require near the top to do setup of the test suite
+# from counterpartylib.test import conftest
+
+from counterpartylib.test.util_test import CURR_DIR as CPLIB_TESTDIR
+import picopayments_cli
+from micropayment_core import keys
+from picopayments_cli import auth
+from picopayments_hub import api
+from picopayments_hub import err
+from picopayments_hub import etc
+from picopayments_hub import lib
+from picopayments_hub import wallet
+
+
+FIXTURE_SQL_FILE = CPLIB_TESTDIR + '/fixtures/scenarios/unittest_fixture.sql'
+FIXTURE_DB = tempfile.gettempdir() + '/fixtures.unittest_fixture.db'
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_cached_key_material():
+    wif = auth.load_wif()
+    assert wallet.wif() == wif
+    assert wallet.pubkey() == keys.pubkey_from_wif(wif)
+    assert wallet.address() == keys.address_from_wif(wif)
+    assert lib.get_funding_address() == keys.address_from_wif(wif)
+    assert lib.get_wif(keys.pubkey_from_wif(wif)) == wif
+
+    signed = wallet.sign_json({"foo": "bar"})
+    assert signed["pubkey"] == wallet.pubkey()
+    assert auth.verify_json(signed)
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_reload_wallet():
+    old_wif = wallet.wif()
+    new_wif = keys.generate_wif(netcode=etc.netcode)
+    with open(picopayments_cli.etc.wallet_path, "w") as fp:
+        fp.write(new_wif)
+    assert wallet.wif() == old_wif  # cached until reloaded
+
+    result = api.mph_reload_wallet(**auth.sign_json({}, old_wif))
+    assert result["address"] == keys.address_from_wif(new_wif)
+    assert result["pubkey"] == keys.pubkey_from_wif(new_wif)
+    assert wallet.wif() == new_wif
+
+    with pytest.raises(err.NotAdmin):
+        api.mph_reload_wallet(**auth.sign_json({}, old_wif))
+
+    # existing channels still need the replaced key, also after restart
+    old_pubkey = keys.pubkey_from_wif(old_wif)
+    assert lib.get_wif(old_pubkey) == old_wif
+    wallet._key = None
+    wallet.load()
+    assert lib.get_wif(old_pubkey) == old_wif
+    assert wallet.wif() == new_wif
+
+
+@pytest.mark.usefixtures("picopayments_server")
+def test_reload_wallet_forged_signature():
+    params = auth.sign_json({}, wallet.wif())
+    params["signature"] = auth.sign_json({"foo": "bar"},
+                                         wallet.wif())["signature"]
+    with pytest.raises(err.InvalidSignature):
+        api.mph_reload_wallet(**params)
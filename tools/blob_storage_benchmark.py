@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+"""Database size and page cache hit rate before and after migration_8.
+
+Fills a scratch database in the hex text layout (schema version 8) with
+connections, secrets, payments and commits, runs a lookup workload with a
+small page cache, then migrates it to blob storage and runs the same
+workload again.
+
+Usage: tools/blob_storage_benchmark.py [DIR] [CONNECTIONS] [LOOKUPS]
+"""
+
+
+import os
+import sys
+import time
+import apsw
+import random
+import shutil
+import tempfile
+from micropayment_core import util
+from picopayments_hub import etc
+from picopayments_hub import db
+from picopayments_hub import sql
+
+
+CACHE_PAGES = 500
+PAYMENTS = 10  # per connection
+COMMITS = 3  # active and revoked per connection
+
+
+_ADD_COMMIT_ACTIVE = sql.load("add_commit_active")
+_ADD_COMMIT_REVOKED = sql.load("add_commit_revoked")
+
+
+def _rand_hex(size=32):
+    return util.b2h(os.urandom(size))
+
+
+def _commit(channel_id, active):
+    data = {
+        "channel_id": channel_id,
+        "script": _rand_hex(100),
+        "commit_address": _rand_hex(17),
+        "delay_time": 5,
+        "payee_notified": 1,
+    }
+    if active:
+        data["rawtx"] = _rand_hex(300)
+        data["revoke_secret_hash"] = _rand_hex(20)
+    else:
+        data["revoke_secret"] = _rand_hex(32)
+    return data
+
+
+def _fill(count):
+    handles = []
+    secret_hashes = []
+    with sql.transaction() as cursor:
+        for i in range(count):
+            handle = _rand_hex()
+            secret_hash = _rand_hex(20)
+            db.add_hub_connection({
+                "asset": "XCP",
+                "deposit_max": 0,
+                "deposit_min": 0,
+                "deposit_ratio": 1.0,
+                "expire_max": 0,
+                "expire_min": 0,
+                "sync_fee": 1,
+                "hub_pubkey": _rand_hex(33),
+                "hub_address": _rand_hex(17),
+                "client_pubkey": _rand_hex(33),
+                "client_address": _rand_hex(17),
+                "secret_hash": secret_hash,
+                "secret_value": _rand_hex(),
+                "h2c_spend_secret_hash": _rand_hex(20),
+                "handle": handle,
+                "hub_rpc_url": None,
+            }, cursor=cursor)
+            channel_id = db.hub_connection(handle=handle,
+                                           cursor=cursor)["c2h_channel_id"]
+            for j in range(PAYMENTS):
+                db.add_payment(payer_handle=handle, payee_handle=handle,
+                               amount=1, token=_rand_hex(16), cursor=cursor)
+            sql.executemany(_ADD_COMMIT_ACTIVE, [
+                _commit(channel_id, True) for j in range(COMMITS)
+            ], cursor=cursor)
+            sql.executemany(_ADD_COMMIT_REVOKED, [
+                _commit(channel_id, False) for j in range(COMMITS)
+            ], cursor=cursor)
+            handles.append(handle)
+            secret_hashes.append(secret_hash)
+    return handles, secret_hashes
+
+
+def _create_text_database(path, count):
+    """Database as it was before migration_8 (schema version 8)."""
+    connection = apsw.Connection(path)
+    cursor = connection.cursor()
+    for version in range(8):
+        cursor.execute(db._MIGRATIONS[version])
+    cursor.execute("PRAGMA user_version = 8;")
+    etc.database_connection = connection
+
+    hex_args = sql.HEX_ARGS
+    sql.HEX_ARGS = frozenset()  # write and look up hex as text
+    try:
+        handles, secret_hashes = _fill(count)
+    finally:
+        sql.HEX_ARGS = hex_args
+    cursor.execute("VACUUM;")
+    connection.close()
+    return handles, secret_hashes
+
+
+def _size(cursor):
+    page_size = sql.fetchone("PRAGMA page_size;", cursor=cursor)["page_size"]
+    pages = sql.fetchone("PRAGMA page_count;", cursor=cursor)["page_count"]
+    return page_size * pages
+
+
+def _workload(handles, secret_hashes, lookups):
+    """Return page cache hit rate and lookups per second."""
+    connection = etc.database_connection
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA cache_size = {0};".format(CACHE_PAGES))
+    connection.status(apsw.SQLITE_DBSTATUS_CACHE_HIT, True)
+    connection.status(apsw.SQLITE_DBSTATUS_CACHE_MISS, True)
+
+    begin = time.time()
+    for i in range(lookups):
+        index = random.randrange(len(handles))
+        handle = handles[index]
+        connection_data = db.hub_connection(handle=handle, cursor=cursor)
+        db.unnotified_payments(payee_handle=handle, cursor=cursor)
+        db.get_secret(hash=secret_hashes[index], cursor=cursor)
+        db.commits_active(connection_data["c2h_channel_id"], cursor=cursor)
+        db.commits_revoked(connection_data["c2h_channel_id"], cursor=cursor)
+    elapsed = time.time() - begin
+
+    hits = connection.status(apsw.SQLITE_DBSTATUS_CACHE_HIT)[0]
+    misses = connection.status(apsw.SQLITE_DBSTATUS_CACHE_MISS)[0]
+    return hits / float(hits + misses), lookups / elapsed
+
+
+def _report(label, cursor, hit_rate, rate):
+    print("{0}: {1:.1f} MiB, page cache hit rate {2:.3f}, {3:.0f} lookups/s"
+          .format(label, _size(cursor) / 1048576.0, hit_rate, rate))
+
+
+def main(args):
+    basedir = tempfile.mkdtemp(prefix="picopayments_bench_",
+                               dir=args[0] if args else None)
+    count = int(args[1]) if len(args) > 1 else 10000
+    lookups = int(args[2]) if len(args) > 2 else 20000
+    etc.database_path = os.path.join(basedir, "benchmark.db")
+    try:
+        handles, secret_hashes = _create_text_database(etc.database_path,
+                                                       count)
+
+        # before, text lookups against the unmigrated database
+        etc.database_connection = apsw.Connection(etc.database_path)
+        hex_args = sql.HEX_ARGS
+        sql.HEX_ARGS = frozenset()
+        try:
+            hit_rate, rate = _workload(handles, secret_hashes, lookups)
+        finally:
+            sql.HEX_ARGS = hex_args
+        cursor = etc.database_connection.cursor()
+        _report("hex text", cursor, hit_rate, rate)
+        etc.database_connection.close()
+
+        # after, migrated to blobs and vacuumed by setup
+        db.setup()
+        hit_rate, rate = _workload(handles, secret_hashes, lookups)
+        cursor = etc.database_connection.cursor()
+        _report("blob", cursor, hit_rate, rate)
+        etc.database_connection.close()
+    finally:
+        shutil.rmtree(basedir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+"""Signatures and verifications per second of each crypto backend.
+
+Signs and verifies a json payload the size of a typical mph_sync request
+as done for every request and response in api.py.
+
+Usage: tools/crypto_benchmark.py [ITERATIONS]
+"""
+
+
+import sys
+import time
+from micropayment_core import keys
+from picopayments_hub import crypto
+
+
+PAYLOAD = {
+    "handle": "ab" * 32,
+    "next_revoke_secret_hash": "cd" * 20,
+    "sends": [
+        {"payee_handle": "ef" * 32, "amount": 1337, "token": "01" * 32}
+        for i in range(5)
+    ],
+    "commit": {"rawtx": "02" * 300, "script": "03" * 120},
+    "revokes": ["04" * 32 for i in range(3)],
+}
+
+
+def run(name, iterations):
+    crypto.initialize(name)
+    wif = keys.generate_wif("XTN")
+
+    begin = time.time()
+    for i in range(iterations):
+        signed = crypto.sign_json(dict(PAYLOAD), wif)
+    sign_rate = iterations / (time.time() - begin)
+
+    begin = time.time()
+    for i in range(iterations):
+        assert crypto.verify_json(signed)
+    verify_rate = iterations / (time.time() - begin)
+
+    return sign_rate, verify_rate
+
+
+def main(args):
+    iterations = int(args[0]) if args else 200
+    for name in sorted(crypto.BACKENDS):
+        sign_rate, verify_rate = run(name, iterations)
+        print("{0}: {1:.1f} signs/s, {2:.1f} verifies/s".format(
+            name, sign_rate, verify_rate
+        ))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+"""Syncs per second with and without group commit on the same disk.
+
+Runs the database writes of a sync (next revoke secret hash, sync fee
+payment, next revoke secret) from concurrent threads against a scratch
+database, once committing every sync on its own and once with group commit.
+
+Usage: tools/group_commit_benchmark.py [DIR] [SYNCS] [THREADS]
+"""
+
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+from micropayment_core import util
+from picopayments_hub import etc
+from picopayments_hub import db
+from picopayments_hub import sql
+
+
+CONNECTIONS = 100
+
+
+def _rand_hex():
+    return util.b2h(os.urandom(32))
+
+
+def _create_connections(count):
+    hub_connections = []
+    for i in range(count):
+        handle = _rand_hex()
+        db.add_hub_connection({
+            "asset": "XCP",
+            "deposit_max": 0,
+            "deposit_min": 0,
+            "deposit_ratio": 1.0,
+            "expire_max": 0,
+            "expire_min": 0,
+            "sync_fee": 1,
+            "hub_pubkey": _rand_hex(),
+            "hub_address": _rand_hex(),
+            "client_pubkey": _rand_hex(),
+            "client_address": _rand_hex(),
+            "secret_hash": _rand_hex(),
+            "secret_value": _rand_hex(),
+            "h2c_spend_secret_hash": _rand_hex(),
+            "c2h_expire_time": 42,
+            "handle": handle,
+            "hub_rpc_url": None,
+        })
+        hub_connections.append(db.hub_connection(handle=handle))
+    return hub_connections
+
+
+def _sync_writes(hub_connection):
+    cursor = sql.get_cursor()
+    handle = hub_connection["handle"]
+    db.set_next_revoke_secret_hash(handle=handle,
+                                   next_revoke_secret_hash=_rand_hex(),
+                                   cursor=cursor)
+    db.add_payment(payer_handle=handle, payee_handle=None, amount=1,
+                   token="sync_fee", cursor=cursor)
+    db.add_revoke_secret(hub_connection["c2h_channel_id"], _rand_hex(),
+                         _rand_hex(), cursor=cursor)
+
+
+def _worker(hub_connections, syncs):
+    for i in range(syncs):
+        with etc.database_lock:
+            with sql.group_commit() as ack:
+                _sync_writes(random.choice(hub_connections))
+        ack.wait()
+
+
+def run(basedir, window, syncs, threads):
+    """Return syncs per second for the given group commit window."""
+    etc.database_path = os.path.join(basedir, "benchmark.db")
+    etc.group_commit_window = window
+    db.setup()
+    hub_connections = _create_connections(CONNECTIONS)
+
+    workers = [
+        threading.Thread(target=_worker,
+                         args=(hub_connections, syncs // threads))
+        for i in range(threads)
+    ]
+    begin = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - begin
+
+    etc.database_connection.close()
+    os.remove(etc.database_path)
+    return (syncs // threads) * threads / elapsed
+
+
+def main(args):
+    basedir = tempfile.mkdtemp(prefix="picopayments_bench_",
+                               dir=args[0] if args else None)
+    syncs = int(args[1]) if len(args) > 1 else 2000
+    threads = int(args[2]) if len(args) > 2 else 16
+    try:
+        for window in [0, 0.002, 0.005, 0.01]:
+            rate = run(basedir, window, syncs, threads)
+            print("window {0}s, {1} threads: {2:.1f} syncs/s".format(
+                window, threads, rate
+            ))
+    finally:
+        shutil.rmtree(basedir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+# Copyright (c) 2016 Fabian Barkhau <f483@storj.io>
+# License: MIT (see LICENSE file)
+
+
+"""Per request cpu time of rpc json handling for mph_sync payloads.
+
+Compares the previous path (body decoded four times by srv and json-rpc,
+schemas validated with jsonschema.validate, response json.dumps) with the
+current one (decoded once by jsoncodec, precompiled validators, response
+encoded by jsoncodec) for a growing number of payments.
+
+Usage: tools/json_benchmark.py [CODEC] [PAYMENTS ...]
+"""
+
+
+import os
+import sys
+import json
+import time
+import jsonschema
+from micropayment_core import util
+from picopayments_hub import jsoncodec
+from picopayments_hub import verify
+
+
+def _rand_hex(size=32):
+    return util.b2h(os.urandom(size))
+
+
+def _request(payments):
+    return json.dumps({
+        "jsonrpc": "2.0",
+        "id": 0,
+        "method": "mph_sync",
+        "params": {
+            "handle": _rand_hex(),
+            "next_revoke_secret_hash": _rand_hex(20),
+            "payments": [{
+                "payee_handle": _rand_hex(),
+                "amount": 5,
+                "token": _rand_hex(16),
+            } for i in range(payments)],
+            "commit": {"rawtx": _rand_hex(300), "script": _rand_hex(100)},
+            "revokes": [_rand_hex() for i in range(10)],
+            "pubkey": _rand_hex(33),
+            "signature": _rand_hex(71),
+        },
+    }).encode("utf-8")
+
+
+def _before(data, response):
+    for i in range(4):  # srv, handle, JSONRPCRequest, JSONRPC20Request
+        params = json.loads(data.decode("utf-8"))["params"]
+    jsonschema.validate(params["commit"], verify.COMMIT_SCHEMA)
+    jsonschema.validate(params["revokes"], verify.REVOKES_SCHEMA)
+    jsonschema.validate(params["payments"], verify.PAYMENT_SCHEMA)
+    return json.dumps(response)
+
+
+def _after(data, response):
+    params = jsoncodec.loads(data)["params"]
+    verify._COMMIT.validate(params["commit"])
+    verify._REVOKES.validate(params["revokes"])
+    verify._PAYMENTS.validate(params["payments"])
+    return jsoncodec.dumps(response)
+
+
+def _cpu_time(func, data, response, rounds):
+    begin = time.process_time()
+    for i in range(rounds):
+        func(data, response)
+    return (time.process_time() - begin) / rounds
+
+
+def main(args):
+    codec = jsoncodec.initialize(args[0] if args else "auto")
+    sizes = [int(arg) for arg in args[1:]] or [0, 10, 100, 1000]
+    for size in sizes:
+        data = _request(size)
+        response = {"jsonrpc": "2.0", "id": 0,
+                    "result": json.loads(data.decode("utf-8"))["params"]}
+        rounds = max(10, 10000 // (size + 1))
+        before = _cpu_time(_before, data, response, rounds)
+        after = _cpu_time(_after, data, response, rounds)
+        print("{0} payments, {1} bytes: {2:.0f}us -> {3:.0f}us ({4})".format(
+            size, len(data), before * 1e6, after * 1e6, codec
+        ))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])